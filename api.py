@@ -0,0 +1,354 @@
+"""Headless async HTTP API for content generation.
+
+Endpoints (bodies are validated as MessageInput, plus ``include_article``):
+    POST /v1/generate         one persona, returns GeneratedContent
+    POST /v1/generate/multi   several personas, returns content per persona
+    POST /v1/generate/stream  one persona as server-sent events: ``section``
+                              per finished field, ``article`` text deltas,
+                              then ``done`` or ``error``
+    POST /v1/refine           one persona plus ``field`` and optional
+                              ``instruction``: regenerates or refines one
+                              section of the cached content, returns it all
+    GET  /v1/cache?content=...&persona=...   cached content or 404
+    GET  /healthz
+    GET  /metrics             Prometheus text exposition of telemetry.py
+
+Generations run on a bounded worker pool and share the result cache and
+single-flight with the Streamlit app. When the pool's queue is full new
+work is answered with 429 and a Retry-After header.
+
+The daily token quota is charged to the user of the caller's API key, else
+to the user a trusted proxy names (``TRUSTED_USER_HEADER``), else to the
+caller's address; ``X-User-Id`` counts only with ``TRUST_CLIENT_USER_ID``.
+With ``API_KEYS`` set, /v1/ requests without a valid key get 401. A spent
+quota is answered with 429.
+
+Usage:
+    python api.py --port 8080
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional, Tuple
+
+from aiohttp import web
+from pydantic import ValidationError
+
+from claude_service import REFINABLE_FIELDS, ClaudeService
+from config import API_KEYS, API_MAX_QUEUE, API_MAX_WORKERS
+from generation import generate_cached, lookup_cached, refine_cached, stream_cached
+from models import MessageInput, ProcessingError
+from personas import get_persona_data
+from telemetry import render_prometheus
+from token_budget import (
+    QuotaExceededError,
+    api_key_user,
+    forwarded_user,
+    seconds_until_reset,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_SECONDS = 1
+
+
+class QueueFullError(Exception):
+    """Raised when the worker pool can't accept more generations"""
+
+
+class GenerationPool:
+    """Bounded thread pool for blocking generations, rejecting work when full"""
+
+    def __init__(
+        self, workers: int = API_MAX_WORKERS, max_pending: int = API_MAX_QUEUE
+    ):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="api"
+        )
+
+    def reserve(self, count: int = 1):
+        """Claim queue slots for count generations, or raise QueueFullError"""
+        with self._lock:
+            if self.pending + count > self.max_pending:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"Generation queue is full ({self.pending}/{self.max_pending})"
+                )
+            self.pending += count
+
+    def run(self, fn: Callable, *args) -> asyncio.Future:
+        """Run fn on the pool in a slot claimed with reserve()"""
+        future = self._executor.submit(fn, *args)
+        # Released when the work finishes, even if the client has gone away
+        future.add_done_callback(lambda _: self._release())
+        return asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def error_response(
+    status: int, error_type: str, message: str, **headers
+) -> web.Response:
+    error = ProcessingError(error_type=error_type, message=message)
+    return web.json_response(
+        error.to_dict(),
+        status=status,
+        headers=headers,
+        dumps=lambda data: json.dumps(data, default=str),
+    )
+
+
+@web.middleware
+async def error_middleware(request: web.Request, handler):
+    if (
+        API_KEYS
+        and request.path.startswith("/v1/")
+        and not api_key_user(request.headers)
+    ):
+        return error_response(401, "unauthorized", "A valid API key is required")
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except QueueFullError as e:
+        return error_response(
+            429, "queue_full", str(e), **{"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    except QuotaExceededError as e:
+        return error_response(
+            429, "quota_exceeded", str(e), **{"Retry-After": str(seconds_until_reset())}
+        )
+    except ValidationError as e:
+        return error_response(400, "validation_error", e.json())
+    except ValueError as e:
+        return error_response(400, "validation_error", str(e))
+    except Exception as e:
+        logger.error(f"Error handling {request.path}: {e}")
+        return error_response(502, "generation_error", str(e))
+
+
+async def read_input(request: web.Request, single: bool) -> Tuple[MessageInput, bool]:
+    """Validate the request body as a MessageInput and return include_article too"""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise ValueError("Request body must be JSON")
+    message_input = MessageInput.model_validate(body)
+
+    personas = message_input.selected_personas
+    if not personas or (single and len(personas) != 1):
+        raise ValueError(
+            "Select exactly one persona" if single else "Select at least one persona"
+        )
+    unknown = [key for key in personas if not get_persona_data(key)]
+    if unknown:
+        raise ValueError(f"Invalid persona selected: {', '.join(unknown)}")
+    return message_input, bool(body.get("include_article", True))
+
+
+def user_id(request: web.Request) -> str:
+    """Identify the caller for the daily token quota"""
+    return (
+        api_key_user(request.headers)
+        or forwarded_user(request.headers)
+        or request.remote
+        or "anonymous"
+    )
+
+
+async def generate(request: web.Request) -> web.Response:
+    message_input, include_article = await read_input(request, single=True)
+    pool: GenerationPool = request.app["pool"]
+    pool.reserve()
+    content = await pool.run(
+        partial(generate_cached, user_id=user_id(request)),
+        request.app["service"],
+        message_input.content,
+        message_input.selected_personas[0],
+        include_article,
+    )
+    return web.json_response(content.model_dump(mode="json"))
+
+
+async def generate_multi(request: web.Request) -> web.Response:
+    message_input, include_article = await read_input(request, single=False)
+    personas = list(dict.fromkeys(message_input.selected_personas))
+    pool: GenerationPool = request.app["pool"]
+    # All personas or none, so a partly admitted request never half-succeeds
+    pool.reserve(len(personas))
+    outcomes = await asyncio.gather(
+        *(
+            pool.run(
+                partial(generate_cached, user_id=user_id(request)),
+                request.app["service"],
+                message_input.content,
+                persona_key,
+                include_article,
+            )
+            for persona_key in personas
+        ),
+        return_exceptions=True,
+    )
+
+    results, errors = {}, {}
+    for persona_key, outcome in zip(personas, outcomes):
+        if isinstance(outcome, Exception):
+            logger.error(f"Error generating content for {persona_key}: {outcome}")
+            errors[persona_key] = str(outcome)
+        else:
+            results[persona_key] = outcome.model_dump(mode="json")
+    return web.json_response({"results": results, "errors": errors})
+
+
+async def generate_stream(request: web.Request) -> web.StreamResponse:
+    message_input, include_article = await read_input(request, single=True)
+    pool: GenerationPool = request.app["pool"]
+    pool.reserve()
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: Any):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    article_sent = [0]
+
+    def on_article_text(text: str):
+        emit("article", {"text": text[article_sent[0] :]})
+        article_sent[0] = len(text)
+
+    future = pool.run(
+        partial(stream_cached, user_id=user_id(request)),
+        request.app["service"],
+        message_input.content,
+        message_input.selected_personas[0],
+        lambda field, value: emit("section", {"field": field, "value": value}),
+        on_article_text,
+        include_article,
+    )
+    # Queued after every event the worker emitted before finishing
+    future.add_done_callback(lambda _: events.put_nowait(None))
+
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+    )
+    await response.prepare(request)
+
+    async def send(event: str, data: Any):
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+    while (item := await events.get()) is not None:
+        await send(*item)
+
+    try:
+        content = await future
+        await send("done", content.model_dump(mode="json"))
+    except Exception as e:
+        logger.error(f"Error streaming content: {e}")
+        await send("error", {"error_type": "generation_error", "message": str(e)})
+    await response.write_eof()
+    return response
+
+
+async def refine(request: web.Request) -> web.Response:
+    message_input, _ = await read_input(request, single=True)
+    body = await request.json()
+    field = body.get("field")
+    if field not in REFINABLE_FIELDS:
+        raise ValueError(f"field must be one of: {', '.join(REFINABLE_FIELDS)}")
+    pool: GenerationPool = request.app["pool"]
+    pool.reserve()
+    content = await pool.run(
+        partial(
+            refine_cached,
+            instruction=body.get("instruction") or None,
+            user_id=user_id(request),
+        ),
+        request.app["service"],
+        message_input.content,
+        message_input.selected_personas[0],
+        field,
+    )
+    return web.json_response(content.model_dump(mode="json"))
+
+
+async def cache_lookup(request: web.Request) -> web.Response:
+    message = request.query.get("content", "")
+    persona_key = request.query.get("persona", "")
+    if not message or not get_persona_data(persona_key):
+        raise ValueError("Both content and a valid persona are required")
+    content = await asyncio.get_running_loop().run_in_executor(
+        None, lookup_cached, message, persona_key
+    )
+    if content is None:
+        return error_response(404, "not_found", "No cached content for this request")
+    return web.json_response(content.model_dump(mode="json"))
+
+
+async def healthz(request: web.Request) -> web.Response:
+    pool: GenerationPool = request.app["pool"]
+    return web.json_response(
+        {
+            "status": "ok",
+            "pending": pool.pending,
+            "max_pending": pool.max_pending,
+            "rejected": pool.rejected,
+        }
+    )
+
+
+async def metrics(request: web.Request) -> web.Response:
+    text = await asyncio.get_running_loop().run_in_executor(None, render_prometheus)
+    return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+
+def create_app(
+    service: Optional[ClaudeService] = None, pool: Optional[GenerationPool] = None
+) -> web.Application:
+    app = web.Application(middlewares=[error_middleware])
+    app["service"] = service or ClaudeService()
+    app["pool"] = pool or GenerationPool()
+
+    async def shutdown_pool(app: web.Application):
+        app["pool"].shutdown()
+
+    app.on_cleanup.append(shutdown_pool)
+    app.router.add_post("/v1/generate", generate)
+    app.router.add_post("/v1/generate/multi", generate_multi)
+    app.router.add_post("/v1/generate/stream", generate_stream)
+    app.router.add_post("/v1/refine", refine)
+    app.router.add_get("/v1/cache", cache_lookup)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content generation HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
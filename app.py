@@ -1,36 +1,78 @@
 import streamlit as st
+import functools
+import html
 import logging
+import re
+import time
+import uuid
+from collections.abc import Mapping
 from config import (
     APP_TITLE,
     APP_SUBTITLE,
     THEME_COLOR,
     SECONDARY_COLOR,
     BACKGROUND_COLOR,
+    ENABLE_ADMIN_PAGE,
+    JOB_POLL_INTERVAL,
+    LOG_LEVEL,
+    METRICS_HOST,
+    METRICS_PORT,
 )
-from models import MessageInput, ProcessingError
-from claude_service import ClaudeService
+from claude_service import (
+    ClaudeService,
+    ANALYSIS_FIELDS,
+    REFINABLE_FIELDS,
+    warm_up_client,
+)
+from generation import lookup_similar
+from jobs import DONE, FAILED, get_job_queue
+from worker import job_result, start_job_workers
 from utils import (
     init_session_state,
-    cache_result,
     get_cached_result,
+    get_cached_article,
     display_error,
     create_cache_key,
+    create_article_cache_key,
+    get_cache_stats,
+)
+from archive import get_archive
+from singleflight import generation_flight
+from warmer import cache_warmer
+from token_budget import forwarded_user
+from telemetry import (
+    CLAUDE_FIRST_TOKEN_SECONDS,
+    CLAUDE_REQUEST_SECONDS,
+    CLAUDE_TOKENS,
+    GENERATION_SECONDS,
+    PARSE_RESULTS,
+    render_prometheus,
+    start_metrics_server,
 )
 from personas import get_persona_options, get_persona_data, display_persona_info
 
-# Initialize services
+# Initialize services (the Anthropic client underneath is shared process-wide
+# and created lazily, after the first page has rendered)
 claude_service = ClaudeService()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT, METRICS_HOST)
 
-def set_page_style():
-    """Set custom page styling"""
-    st.markdown(
-        f"""
+RESULT_SECTION_TITLES = {
+    "tone": "💭 Recommended Tone",
+    "keywords": "🎯 Key Keywords",
+    "feedback": "💡 Message Feedback",
+    "related_news": "📰 Related News Types",
+    "article": "📝 Generated Article",
+}
+
+
+def build_page_style() -> str:
+    """Return the custom CSS as one compact <style> block"""
+    css = f"""
         <style>
         .stApp {{
             background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
@@ -107,9 +149,21 @@ def set_page_style():
             color: white;
         }}
         </style>
-    """,
-        unsafe_allow_html=True,
-    )
+    """
+    return re.sub(r"\s*\n\s*", "", css)
+
+
+# Static, so built once per process instead of on every rerun
+PAGE_STYLE = build_page_style()
+
+
+def set_page_style():
+    """Set custom page styling; fragment reruns leave it in place.
+
+    It is sent on every full rerun rather than once per session: Streamlit
+    deletes whatever a full run doesn't emit again, styles included.
+    """
+    st.markdown(PAGE_STYLE, unsafe_allow_html=True)
 
 
 def init_session_vars():
@@ -124,8 +178,67 @@ def init_session_vars():
         st.session_state.processing = False
     if "generated_content" not in st.session_state:
         st.session_state.generated_content = None
+    if "generated_contents" not in st.session_state:
+        st.session_state.generated_contents = {}
     if "error" not in st.session_state:
         st.session_state.error = None
+    # Near-duplicate message whose cached results are being shown, if any
+    if "similar_message" not in st.session_state:
+        st.session_state.similar_message = None
+    # Similar past articles for the (message, persona) shown, looked up once
+    if "similar_articles" not in st.session_state:
+        st.session_state.similar_articles = (None, [])
+    # IDs of this session's background generations in the shared job queue
+    if "analysis_job" not in st.session_state:
+        st.session_state.analysis_job = None
+        # Why the last analysis job failed, shown until the user tries again
+        st.session_state.analysis_error = None
+    if "article_jobs" not in st.session_state:
+        st.session_state.article_jobs = {}
+    if "personas_job" not in st.session_state:
+        st.session_state.personas_job = None
+    if "refine_job" not in st.session_state:
+        st.session_state.refine_job = None
+        st.session_state.refine_target = None
+    # Whether this run's fragments poll their jobs, and job errors to show
+    # again after the full rerun that stops polling
+    if "polling_jobs" not in st.session_state:
+        st.session_state.polling_jobs = False
+        st.session_state.job_errors = []
+        st.session_state.carried_job_errors = []
+
+
+def show_job_error(message: str):
+    """Show why a finished job failed, surviving the rerun that stops polling"""
+    st.error(message)
+    st.session_state.job_errors.append(message)
+
+
+def polling_fragment(func):
+    """Render func as a fragment that reruns by itself while the session's jobs run.
+
+    Widgets inside it, and polling for job progress, rerun only the fragment
+    rather than the whole app. Polling is set up by a full run, so when a job
+    starts or the last one finishes the fragment triggers one full rerun.
+    """
+
+    @functools.wraps(func)
+    def body():
+        for message in st.session_state.carried_job_errors:
+            st.error(message)
+        st.session_state.carried_job_errors = []
+        st.session_state.job_errors = []
+        func()
+        if has_pending_jobs() != st.session_state.polling_jobs:
+            st.session_state.carried_job_errors = st.session_state.job_errors
+            st.rerun()
+
+    def render():
+        st.session_state.polling_jobs = has_pending_jobs()
+        run_every = JOB_POLL_INTERVAL if st.session_state.polling_jobs else None
+        st.fragment(body, run_every=run_every)()
+
+    return render
 
 
 def render_main_page():
@@ -165,14 +278,19 @@ def render_main_page():
                 st.error("Please enter your climate message")
             else:
                 st.session_state.message = message
+                cache_warmer.message_entered(message)
                 st.session_state.page = "persona"
                 st.rerun()
+        if st.button("📚 Search Past Content", use_container_width=True):
+            st.session_state.page = "archive"
+            st.rerun()
 
 
 def render_persona_page():
     """Render persona selection page"""
     # Back button
     if st.button("← Back to Message", type="secondary"):
+        cancel_session_jobs()
         st.session_state.page = "main"
         st.rerun()
 
@@ -186,12 +304,22 @@ def render_persona_page():
         unsafe_allow_html=True,
     )
 
+    render_persona_picker()
+
+
+def select_persona(persona_key: str):
+    st.session_state.selected_persona = persona_key
+
+
+@polling_fragment
+def render_persona_picker():
+    """Persona buttons and generate actions; picking a persona reruns only this"""
     personas = get_persona_options()
     cols = st.columns(4)
     for i, persona_key in enumerate(personas):
         persona_data = get_persona_data(persona_key)
         with cols[i % 4]:
-            if st.button(
+            st.button(
                 f"{persona_data['icon']}\n\n{persona_data['name']}",
                 key=f"persona_{persona_key}",
                 help=persona_data["description"],
@@ -201,8 +329,9 @@ def render_persona_page():
                     if persona_key != st.session_state.selected_persona
                     else "primary"
                 ),
-            ):
-                st.session_state.selected_persona = persona_key
+                on_click=select_persona,
+                args=(persona_key,),
+            )
 
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
@@ -214,20 +343,22 @@ def render_persona_page():
         ):
             try:
                 st.session_state.processing = True
+                cancel_session_jobs()
                 cache_key = create_cache_key(
                     st.session_state.message, st.session_state.selected_persona
                 )
                 cached_result = get_cached_result(cache_key)
-
-                if cached_result:
-                    st.session_state.generated_content = cached_result
-                else:
-                    with st.spinner("✨ Crafting your personalized content..."):
-                        content = generate_content(
-                            st.session_state.message, st.session_state.selected_persona
-                        )
-                        st.session_state.generated_content = content
-                        cache_result(cache_key, content)
+                st.session_state.similar_message = None
+                if cached_result is None:
+                    similar = lookup_similar(
+                        st.session_state.message, st.session_state.selected_persona
+                    )
+                    if similar is not None:
+                        st.session_state.similar_message, cached_result = similar
+
+                st.session_state.generated_contents = {}
+                # On a cache miss the results page runs a job and streams it in
+                st.session_state.generated_content = cached_result
 
                 st.session_state.page = "results"
                 st.rerun()
@@ -236,17 +367,77 @@ def render_persona_page():
             finally:
                 st.session_state.processing = False
 
+        if st.button(
+            "Generate for All Audiences →",
+            use_container_width=True,
+            type="secondary",
+        ):
+            cancel_session_jobs()
+            job = submit_personas_job(st.session_state.message, get_persona_options())
+            st.session_state.personas_job = job.id
+
+        render_personas_job()
+
+
+def render_personas_job():
+    """Report the "all audiences" job and open the results once it is done"""
+    job = get_job_queue().get(st.session_state.personas_job)
+    if job is None:
+        return
+    if not job.finished:
+        st.info("✨ Crafting content for every audience...")
+        return
+
+    st.session_state.personas_job = None
+    if job.status == FAILED:
+        show_job_error(f"Error generating content: {job.error}")
+    if job.status != DONE:
+        return
+
+    contents = {}
+    for persona_key, result in job_result(job).items():
+        if isinstance(result, Exception):
+            persona_name = get_persona_data(persona_key)["name"]
+            show_job_error(f"Error generating content for {persona_name}: {result}")
+        else:
+            contents[persona_key] = result
+
+    if contents:
+        st.session_state.similar_message = None
+        st.session_state.generated_contents = contents
+        if st.session_state.selected_persona not in contents:
+            st.session_state.selected_persona = next(iter(contents))
+        st.session_state.generated_content = contents[st.session_state.selected_persona]
+        st.session_state.page = "results"
+        st.rerun()
+
 
 def render_results_page():
     """Render results page"""
     # Back to main menu button
     if st.button("← Main Menu", type="secondary"):
+        cancel_session_jobs()
         st.session_state.page = "main"
         st.session_state.message = ""
         st.session_state.selected_persona = None
         st.session_state.generated_content = None
+        st.session_state.generated_contents = {}
+        st.session_state.similar_message = None
         st.rerun()
 
+    # Switch between audiences when content was generated for several of them
+    contents = st.session_state.generated_contents
+    if len(contents) > 1:
+        persona_keys = list(contents)
+        selected = st.selectbox(
+            "Audience",
+            persona_keys,
+            index=persona_keys.index(st.session_state.selected_persona),
+            format_func=lambda key: "{icon} {name}".format(**get_persona_data(key)),
+        )
+        st.session_state.selected_persona = selected
+        st.session_state.generated_content = contents[selected]
+
     # Summary header
     persona_data = get_persona_data(st.session_state.selected_persona)
     st.markdown(
@@ -259,82 +450,502 @@ def render_results_page():
         unsafe_allow_html=True,
     )
 
+    render_results()
+
+
+@polling_fragment
+def render_results():
+    """Result cards, article and refinements; their widgets and polling rerun only this"""
     content = st.session_state.generated_content
+    notice = st.empty()
+    sections = create_result_sections()
+
+    if content is None:
+        content = render_analysis_job(
+            st.session_state.message, st.session_state.selected_persona, sections
+        )
+        if content is None:
+            return
+        st.session_state.generated_content = content
+
+    if content.degraded:
+        render_degraded_notice(notice, st.session_state.selected_persona)
+    elif st.session_state.similar_message:
+        render_similar_notice(notice, st.session_state.similar_message)
+
+    for field in ANALYSIS_FIELDS:
+        render_result_section(sections[field], field, getattr(content, field))
+
+    content = render_article_section(
+        sections["article"],
+        st.session_state.message,
+        st.session_state.selected_persona,
+        content,
+    )
+    content = render_refine_job(sections, content)
+    st.session_state.generated_content = content
+    if st.session_state.selected_persona in st.session_state.generated_contents:
+        st.session_state.generated_contents[st.session_state.selected_persona] = content
+
+    if not content.degraded:
+        render_refine_form(
+            st.session_state.message, st.session_state.selected_persona, content
+        )
+        render_similar_articles(
+            st.session_state.message, st.session_state.selected_persona, content
+        )
+
+
+def render_degraded_notice(placeholder, persona_key: str):
+    """Label a fallback analysis built without Claude and offer to retry"""
+    with placeholder.container():
+        st.warning(
+            "⚠️ Claude is responding slowly, so this is general guidance for "
+            "the audience rather than an analysis of your message."
+        )
+        if st.button("🔄 Try Again", key=f"retry_{persona_key}"):
+            st.session_state.generated_content = None
+            if persona_key in st.session_state.generated_contents:
+                st.session_state.generated_contents[persona_key] = None
+            st.rerun()
+
+
+def render_similar_notice(placeholder, similar_message: str):
+    """Show which near-identical message the results came from and offer to regenerate"""
+    with placeholder.container():
+        st.info(
+            f'♻️ Reused the results for a near-identical message: "{similar_message}"'
+        )
+        if st.button("🔄 Regenerate Anyway", key="regenerate_similar"):
+            cancel_session_jobs()
+            st.session_state.similar_message = None
+            st.session_state.generated_content = None
+            st.rerun()
+
+
+def render_similar_articles(message: str, persona_key: str, content):
+    """List archived articles written for the most similar past messages"""
+    # Looked up once per result rather than on every polling rerun
+    target = (message, persona_key)
+    if st.session_state.similar_articles[0] != target:
+        similar = get_archive().similar_articles(message, content)
+        st.session_state.similar_articles = (target, similar)
+    similar = st.session_state.similar_articles[1]
+    if not similar:
+        return
+    with st.expander("📚 Similar Past Articles"):
+        for entry in similar:
+            persona_data = get_persona_data(entry.persona) or {}
+            st.markdown(
+                f'**"{entry.message}"** — {persona_data.get("icon", "")} '
+                f'{persona_data.get("name", entry.persona)}'
+            )
+            st.markdown(entry.content.article)
+            st.divider()
+
+
+def render_archive_page():
+    """Search everything generated before, by keyword, message, persona or article text"""
+    if st.button("← Back to Message", type="secondary"):
+        st.session_state.page = "main"
+        st.rerun()
 
-    # Tone Card
     st.markdown(
         """
-        <div class="result-card">
-            <h3>💭 Recommended Tone</h3>
+        <div class="section-title">
+            <h2>📚 Search Past Content</h2>
+        </div>
     """,
         unsafe_allow_html=True,
     )
-    st.write(content.tone)
-    st.markdown("</div>", unsafe_allow_html=True)
-
-    # Keywords and Feedback in columns
-    col1, col2 = st.columns(2)
 
+    archive = get_archive()
+    col1, col2 = st.columns([2, 1])
     with col1:
-        st.markdown(
-            """
-            <div class="result-card">
-                <h3>🎯 Key Keywords</h3>
-        """,
-            unsafe_allow_html=True,
+        query = st.text_input(
+            "Search", placeholder="e.g. drought irrigation costs", key="archive_query"
         )
-        for keyword in content.keywords:
-            st.markdown(f"- {keyword}")
-        st.markdown("</div>", unsafe_allow_html=True)
-
     with col2:
-        st.markdown(
-            """
-            <div class="result-card">
-                <h3>💡 Message Feedback</h3>
-        """,
-            unsafe_allow_html=True,
+        persona_keys = [None] + list(get_persona_options())
+        persona = st.selectbox(
+            "Audience",
+            persona_keys,
+            format_func=lambda key: (
+                "All audiences"
+                if key is None
+                else "{icon} {name}".format(**get_persona_data(key))
+            ),
+        )
+    if not query:
+        stats = archive.stats()
+        st.caption(
+            f"{stats['entries']} archived results, {stats['articles']} with an article"
         )
-        st.write(content.feedback)
-        st.markdown("</div>", unsafe_allow_html=True)
+        return
+
+    started = time.perf_counter()
+    results = archive.search(query, persona)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    st.caption(f"{len(results)} results in {elapsed_ms:.0f} ms")
+
+    for i, entry in enumerate(results):
+        persona_data = get_persona_data(entry.persona) or {}
+        title = f'{persona_data.get("icon", "")} "{entry.message}"'
+        with st.expander(title):
+            st.markdown(entry.snippet)
+            st.markdown(f"**{RESULT_SECTION_TITLES['tone']}:** {entry.content.tone}")
+            st.markdown(
+                f"**{RESULT_SECTION_TITLES['keywords']}:** "
+                + ", ".join(entry.content.keywords)
+            )
+            if entry.content.article:
+                st.markdown(f"**{RESULT_SECTION_TITLES['article']}**")
+                st.markdown(entry.content.article)
+            if st.button("Use This Message", key=f"archive_use_{i}"):
+                st.session_state.message = entry.message
+                st.session_state.page = "persona"
+                st.rerun()
+
+
+def create_result_sections():
+    """Lay out an empty placeholder for every result section"""
+    # Tone Card
+    tone = st.empty()
+
+    # Keywords and Feedback in columns
+    col1, col2 = st.columns(2)
+    with col1:
+        keywords = st.empty()
+    with col2:
+        feedback = st.empty()
 
     # Related News
-    st.markdown(
-        """
-        <div class="result-card">
-            <h3>📰 Related News Types</h3>
-    """,
-        unsafe_allow_html=True,
-    )
-    for news in content.related_news:
-        st.markdown(f"- {news}")
-    st.markdown("</div>", unsafe_allow_html=True)
+    related_news = st.empty()
 
     # Article with markdown support
+    article = st.empty()
+
+    return {
+        "tone": tone,
+        "keywords": keywords,
+        "feedback": feedback,
+        "related_news": related_news,
+        "article": article,
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def result_card_html(field: str, value) -> str:
+    """Build a result card as one markdown block, cached by field and content.
+
+    value is a string, a tuple of list items, or None while it is generated.
+    Generated text is escaped so it renders as markdown, never as HTML.
+    """
+    if value is None:
+        body = "*⏳ Generating...*"
+    elif isinstance(value, tuple):
+        body = "\n".join(f"- {html.escape(item, quote=False)}" for item in value)
+    else:
+        body = html.escape(value, quote=False)
+    # Blank lines let the markdown body render inside the card's <div>
+    return (
+        f'<div class="result-card">\n<h3>{RESULT_SECTION_TITLES[field]}</h3>\n\n'
+        f"{body}\n\n</div>"
+    )
+
+
+def render_result_section(placeholder, field: str, value):
+    """Render one result card into its placeholder, or a loading note if None"""
+    if isinstance(value, list):
+        value = tuple(value)
+    placeholder.markdown(result_card_html(field, value), unsafe_allow_html=True)
+
+
+def render_article_section(placeholder, message: str, persona_key: str, content):
+    """Render the sample article, generating it only once the user asks for it.
+
+    Returns the content with the article filled in when one is available.
+    """
+    article = content.article or get_cached_article(
+        create_article_cache_key(message, persona_key, content)
+    )
+    if article is None:
+        job = get_job_queue().get(st.session_state.article_jobs.get(persona_key))
+        if job is not None and job.finished and job.status != DONE:
+            if job.status == FAILED:
+                show_job_error(f"Error generating article: {job.error}")
+            del st.session_state.article_jobs[persona_key]
+            job = None
+        if job is None:
+            with placeholder.container():
+                st.markdown(
+                    f"""
+                    <div class="result-card">
+                        <h3>{RESULT_SECTION_TITLES["article"]}</h3>
+                """,
+                    unsafe_allow_html=True,
+                )
+                write_article = st.button(
+                    "✍️ Write Sample Article", key=f"write_article_{persona_key}"
+                )
+                st.markdown("</div>", unsafe_allow_html=True)
+            if not write_article:
+                return content
+            job = submit_article_job(message, persona_key, content)
+            st.session_state.article_jobs[persona_key] = job.id
+        if job.status != DONE:
+            # The article written so far; polling reruns show it growing
+            render_result_section(placeholder, "article", job.progress.get("article"))
+            return content
+        del st.session_state.article_jobs[persona_key]
+        article = job_result(job)
+
+    render_result_section(placeholder, "article", article)
+    return content.model_copy(update={"article": article})
+
+
+def render_refine_form(message: str, persona_key: str, content):
+    """Offer to regenerate or refine a single section of the results"""
+    fields = [field for field in REFINABLE_FIELDS if getattr(content, field)]
+    with st.form(key=f"refine_{persona_key}", clear_on_submit=True):
+        st.markdown("**✏️ Improve a Section**")
+        field = st.selectbox(
+            "Section", fields, format_func=lambda key: RESULT_SECTION_TITLES[key]
+        )
+        instruction = st.text_input(
+            "What should change?",
+            placeholder="Leave empty for a fresh version of the section",
+        )
+        submitted = st.form_submit_button("🔄 Update Section")
+    if submitted:
+        get_job_queue().cancel(st.session_state.refine_job)
+        job = submit_refine_job(message, persona_key, field, instruction, content)
+        st.session_state.refine_job = job.id
+        st.session_state.refine_target = (persona_key, field)
+        st.rerun()
+
+
+def render_refine_job(sections, content):
+    """Show the section being updated and return the content once it is refined"""
+    job = get_job_queue().get(st.session_state.refine_job)
+    if job is None:
+        return content
+    persona_key, field = st.session_state.refine_target
+    if persona_key != st.session_state.selected_persona:
+        # The user switched to another audience meanwhile
+        get_job_queue().cancel(job.id)
+        st.session_state.refine_job = None
+        return content
+    if not job.finished:
+        render_result_section(sections[field], field, job.progress.get(field))
+        return content
+
+    st.session_state.refine_job = None
+    if job.status == FAILED:
+        show_job_error(f"Error updating section: {job.error}")
+    if job.status != DONE:
+        return content
+    content = job_result(job)
+    render_result_section(sections[field], field, getattr(content, field))
+    return content
+
+
+def current_user_id() -> str:
+    """Identify the user for token quotas: login, trusted proxy header, client IP or session"""
+    if st.user.get("is_logged_in"):
+        return st.user.email
+    # Checked for the real types: they are mocks when the app runs under AppTest
+    headers = st.context.headers
+    user = forwarded_user(headers) if isinstance(headers, Mapping) else None
+    if user:
+        return user
+    ip_address = st.context.ip_address
+    if isinstance(ip_address, str) and ip_address:
+        return ip_address
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = f"session-{uuid.uuid4().hex}"
+    return st.session_state.user_id
+
+
+def submit_job(kind: str, payload: dict):
+    """Queue a generation for this session's user, starting the consumers if needed"""
+    start_job_workers(claude_service)
+    return get_job_queue().submit(kind, payload, user_id=current_user_id())
+
+
+def submit_analysis_job(message: str, persona_key: str):
+    """Start generating the analysis in the background, publishing each section as it completes"""
+    return submit_job("analysis", {"message": message, "persona": persona_key})
+
+
+def submit_article_job(message: str, persona_key: str, analysis):
+    """Start writing the sample article in the background, publishing the text so far"""
+    return submit_job(
+        "article",
+        {
+            "message": message,
+            "persona": persona_key,
+            "analysis": analysis.model_dump(mode="json"),
+        },
+    )
+
+
+def submit_personas_job(message: str, persona_keys: list):
+    """Start generating the analysis for several personas at once, reusing cached results"""
+    return submit_job("personas", {"message": message, "personas": persona_keys})
+
+
+def submit_refine_job(
+    message: str, persona_key: str, field: str, instruction: str, content
+):
+    """Start regenerating or refining one section in the background"""
+    return submit_job(
+        "refine",
+        {
+            "message": message,
+            "persona": persona_key,
+            "field": field,
+            "instruction": instruction,
+            "content": content.model_dump(mode="json"),
+        },
+    )
+
+
+def render_analysis_job(message: str, persona_key: str, sections):
+    """Render the sections the analysis job has finished so far.
+
+    Starts the job on the first call and returns its content once it is done.
+    """
+    if st.session_state.analysis_error is not None:
+        render_analysis_error(st.session_state.analysis_error)
+        return None
+
+    job = get_job_queue().get(st.session_state.analysis_job)
+    if job is None:
+        job = submit_analysis_job(message, persona_key)
+        st.session_state.analysis_job = job.id
+
+    for field in ANALYSIS_FIELDS:
+        render_result_section(sections[field], field, job.progress.get(field))
+
+    if job.status != DONE:
+        if job.finished:
+            # Kept until Try Again, so the next rerun doesn't resubmit at once
+            st.session_state.analysis_job = None
+            st.session_state.analysis_error = job.error or "The generation stopped"
+            render_analysis_error(st.session_state.analysis_error)
+        return None
+    st.session_state.analysis_job = None
+    return job_result(job)
+
+
+def render_analysis_error(error: str):
+    """Show why the analysis failed and offer to start it again"""
+    st.error(f"Error generating content: {error}")
+    if st.button("🔄 Try Again", key="retry_analysis"):
+        st.session_state.analysis_error = None
+        st.rerun()
+
+
+def session_job_ids() -> list:
+    job_ids = [
+        st.session_state.analysis_job,
+        st.session_state.personas_job,
+        st.session_state.refine_job,
+    ]
+    job_ids += st.session_state.article_jobs.values()
+    return [job_id for job_id in job_ids if job_id]
+
+
+def has_pending_jobs() -> bool:
+    jobs = [get_job_queue().get(job_id) for job_id in session_job_ids()]
+    return any(job is not None and not job.finished for job in jobs)
+
+
+def cancel_session_jobs():
+    """Cancel this session's generations when the user navigates away or resubmits"""
+    for job_id in session_job_ids():
+        get_job_queue().cancel(job_id)
+    st.session_state.analysis_job = None
+    st.session_state.analysis_error = None
+    st.session_state.personas_job = None
+    st.session_state.refine_job = None
+    st.session_state.article_jobs = {}
+
+
+def render_admin_page():
+    """Render live performance metrics of this process"""
     st.markdown(
         """
-        <div class="result-card">
-            <h3>📝 Generated Article</h3>
+        <div class="section-title">
+            <h2>📊 Performance Metrics</h2>
+        </div>
     """,
         unsafe_allow_html=True,
     )
-    st.markdown(content.article)
-    st.markdown("</div>", unsafe_allow_html=True)
 
+    cache = get_cache_stats()
+    lookups = cache["hits"] + cache["misses"]
+    cols = st.columns(4)
+    cols[0].metric(
+        "Cache hit ratio", f"{cache['hits'] / lookups:.0%}" if lookups else "–"
+    )
+    cols[1].metric("Cached results", cache["size"])
+    cols[2].metric("Coalesced requests", generation_flight.stats()["coalesced"])
+    cols[3].metric(
+        "Parse repairs / failures",
+        f"{PARSE_RESULTS.value(outcome='repaired'):.0f} / "
+        f"{PARSE_RESULTS.value(outcome='failed'):.0f}",
+    )
 
-def generate_content(message: str, persona_key: str):
-    """Generate content using Claude service"""
-    try:
-        persona_data = get_persona_data(persona_key)
-        if not persona_data:
-            raise ValueError("Invalid persona selected")
+    st.subheader("Job queue")
+    queue = get_job_queue().stats()
+    cols = st.columns(4)
+    cols[0].metric("Queued jobs", queue["queued"])
+    cols[1].metric("Running jobs", queue["running"])
+    cols[2].metric("Oldest queued", f"{queue['queue_age']:.1f} s")
+    cols[3].metric("Workers / retried jobs", f"{queue['workers']} / {queue['retried']}")
+
+    st.subheader("Latency (seconds)")
+    rows = []
+    for histogram in (
+        CLAUDE_REQUEST_SECONDS,
+        CLAUDE_FIRST_TOKEN_SECONDS,
+        GENERATION_SECONDS,
+    ):
+        for labels, stats in histogram.summary().items():
+            rows.append(
+                {
+                    "metric": histogram.name,
+                    "labels": ", ".join(labels),
+                    "count": int(stats["count"]),
+                    "mean": round(stats["mean"], 3),
+                    "p50 ≤": stats["p50"],
+                    "p95 ≤": stats["p95"],
+                }
+            )
+    st.dataframe(rows, use_container_width=True)
+
+    st.subheader("Tokens")
+    st.dataframe(
+        [
+            {"model": model, "type": token_type, "tokens": int(value)}
+            for (model, token_type), value in CLAUDE_TOKENS.series().items()
+        ],
+        use_container_width=True,
+    )
 
-        message_input = MessageInput(content=message, selected_personas=[persona_key])
+    st.subheader("Popular messages")
+    st.dataframe(
+        [
+            {"message": message, "uses": uses}
+            for message, uses in cache_warmer.popular()
+        ],
+        use_container_width=True,
+    )
 
-        return claude_service.generate_content(message_input, persona_data)
-    except Exception as e:
-        logging.error(f"Error generating content: {e}")
-        raise ProcessingError(error_type="generation_error", message=str(e))
+    with st.expander("Prometheus text"):
+        st.code(render_prometheus(), language="text")
 
 
 def main():
@@ -342,14 +953,24 @@ def main():
     init_session_state()
     init_session_vars()
     set_page_style()
+    st.session_state.polling_jobs = False
 
     # Render appropriate page based on state
-    if st.session_state.page == "main":
+    if ENABLE_ADMIN_PAGE and st.query_params.get("page") == "admin":
+        render_admin_page()
+    elif st.session_state.page == "main":
         render_main_page()
     elif st.session_state.page == "persona":
         render_persona_page()
     elif st.session_state.page == "results":
         render_results_page()
+    elif st.session_state.page == "archive":
+        render_archive_page()
+
+    # The page is up; load the SDK before the user's first generation needs it,
+    # and pick up jobs queued before a restart
+    warm_up_client()
+    start_job_workers(claude_service)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+"""Permanent archive of generated content with full-text search.
+
+Unlike the result cache, entries never expire: every analysis and article
+is kept per message and persona so staff can find and reuse it in later
+campaigns. Refinements are one user's edits and are not archived. An
+SQLite FTS5 inverted index covers the message, persona, keywords, related
+news and article, which keeps searches over tens of thousands of entries
+in the low milliseconds.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from config import ARCHIVE_DB_PATH, ARCHIVE_SEARCH_LIMIT
+from models import ArchivedContent, GeneratedContent
+from personas import get_persona_data
+
+logger = logging.getLogger(__name__)
+
+# Terms of a free-text query; more than this many add little but cost time
+_TERMS = re.compile(r"\w+")
+MAX_QUERY_TERMS = 32
+# Left out when ranking by overlap: they match nearly every entry
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or our "
+    "that the their this to was we will with you your".split()
+)
+# Column weights for ranking: message, persona, keywords, related news, article
+_RANK = "bm25(archive_fts, 2.0, 0.5, 3.0, 1.0, 1.0)"
+
+
+def _entry_key(message: str, persona: str) -> str:
+    payload = json.dumps([message, persona], ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _match_query(text: str, any_term: bool = False) -> Optional[str]:
+    """Turn free text into an FTS5 query, or None if it has no searchable terms.
+
+    Every term is quoted so user input can't inject query syntax. Search
+    matches all terms as prefixes; any_term matches any whole term instead,
+    for ranking by overlap.
+    """
+    terms = list(dict.fromkeys(_TERMS.findall(text.lower())))
+    if any_term:
+        terms = [term for term in terms if term not in _STOPWORDS]
+    terms = terms[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    if any_term:
+        return " OR ".join(f'"{term}"' for term in terms)
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+class ContentArchive:
+    """SQLite archive of every generation, one entry per message and persona"""
+
+    def __init__(self, path: str = ARCHIVE_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS archive (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                message TEXT NOT NULL,
+                persona TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+                message, persona, keywords, related_news, article,
+                tokenize = 'porter unicode61'
+            )""")
+
+    def save(self, message: str, persona: str, content: GeneratedContent):
+        """Archive content for a message and persona, replacing the earlier version.
+
+        Content without an article keeps the article archived before, since
+        analyses are regenerated after their cache entry expires.
+        """
+        key = _entry_key(message, persona)
+        persona_data = get_persona_data(persona) or {}
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, content FROM archive WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and content.article is None:
+                    previous = GeneratedContent.model_validate_json(row[1])
+                    content = content.model_copy(update={"article": previous.article})
+                if row is None:
+                    entry_id = self._conn.execute(
+                        "INSERT INTO archive "
+                        "(key, message, persona, content, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, message, persona, content.model_dump_json(), now, now),
+                    ).lastrowid
+                else:
+                    entry_id = row[0]
+                    self._conn.execute(
+                        "UPDATE archive SET content = ?, updated_at = ? WHERE id = ?",
+                        (content.model_dump_json(), now, entry_id),
+                    )
+                    self._conn.execute(
+                        "DELETE FROM archive_fts WHERE rowid = ?", (entry_id,)
+                    )
+                self._conn.execute(
+                    "INSERT INTO archive_fts "
+                    "(rowid, message, persona, keywords, related_news, article) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        entry_id,
+                        message,
+                        f"{persona} {persona_data.get('name', '')}",
+                        " ".join(content.keywords),
+                        " ".join(content.related_news),
+                        content.article or "",
+                    ),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(
+        self, match: str, where: str, params: list, limit: int
+    ) -> List[ArchivedContent]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT a.message, a.persona, a.content, a.updated_at, "
+                "snippet(archive_fts, -1, '**', '**', '…', 16) "
+                "FROM archive_fts JOIN archive a ON a.id = archive_fts.rowid "
+                f"WHERE archive_fts MATCH ? {where} ORDER BY {_RANK} LIMIT ?",
+                [match] + params + [limit],
+            ).fetchall()
+        return [
+            ArchivedContent(
+                message=message,
+                persona=persona,
+                content=GeneratedContent.model_validate_json(content),
+                archived_at=updated_at,
+                snippet=snippet,
+            )
+            for message, persona, content, updated_at, snippet in rows
+        ]
+
+    def search(
+        self,
+        query: str,
+        persona: Optional[str] = None,
+        limit: int = ARCHIVE_SEARCH_LIMIT,
+    ) -> List[ArchivedContent]:
+        """Return the best matches for every term of query, optionally for one persona"""
+        match = _match_query(query)
+        if match is None:
+            return []
+        if persona is None:
+            return self._query(match, "", [], limit)
+        return self._query(match, "AND a.persona = ?", [persona], limit)
+
+    def similar_articles(
+        self, message: str, content: GeneratedContent, limit: int = 3
+    ) -> List[ArchivedContent]:
+        """Return archived articles about the most similar messages and keywords.
+
+        Entries for the same message are left out, whichever the persona.
+        """
+        match = _match_query(f"{message} {' '.join(content.keywords)}", any_term=True)
+        if match is None:
+            return []
+        return self._query(
+            match,
+            "AND archive_fts.article != '' AND a.message != ?",
+            [message],
+            limit,
+        )
+
+    def stats(self) -> dict:
+        """Return the number of archived entries and of those with an article"""
+        with self._lock:
+            total, articles = self._conn.execute(
+                "SELECT COUNT(*), COUNT(NULLIF(article, '')) FROM archive_fts"
+            ).fetchone()
+        return {"entries": total, "articles": articles}
+
+
+_archive: Optional[ContentArchive] = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> ContentArchive:
+    """Return the process-wide content archive, opening it on first use"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = ContentArchive()
+    return _archive
@@ -0,0 +1,260 @@
+"""Headless batch generation for campaign planning.
+
+Reads messages from a CSV (``message`` column, optional ``id``) or JSONL file
+(``message`` or ``content`` field, optional ``id``), expands each one against
+the selected personas and streams one JSON line per finished item to the
+output file. The output file doubles as the checkpoint: rerunning the same
+command skips every item already written successfully.
+
+With --deferred the items go through the Message Batches API instead, for
+half the price and no competition with interactive traffic; see deferred.py.
+
+Usage:
+    python batch.py messages.csv -o results.jsonl [--personas student,parent]
+    python batch.py messages.csv -o results.jsonl --deferred
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from claude_service import ClaudeService
+from config import AVAILABLE_PERSONAS, MAX_CONCURRENT_GENERATIONS
+from generation import generate_cached
+from scheduler import PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+# Stage of a written record: the analysis only, or with its article
+ANALYSIS = "analysis"
+ARTICLE = "article"
+
+
+def read_messages(path: str) -> List[Dict[str, str]]:
+    """Load messages from a CSV or JSONL file as {"id", "message"} records"""
+    records = []
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    for row in rows:
+        message = (row.get("message") or row.get("content") or "").strip()
+        if not message:
+            continue
+        message_id = (
+            row.get("id") or hashlib.sha256(message.encode("utf-8")).hexdigest()[:12]
+        )
+        records.append({"id": str(message_id), "message": message})
+    return records
+
+
+def expand_items(
+    messages: List[Dict[str, str]], persona_keys: List[str]
+) -> Iterator[Tuple[str, str, str]]:
+    """Yield (message_id, message, persona_key) for every combination"""
+    for record in messages:
+        for persona_key in persona_keys:
+            yield record["id"], record["message"], persona_key
+
+
+def load_checkpoint(
+    output_path: str, include_article: bool = True
+) -> Set[Tuple[str, str]]:
+    """Return the (message_id, persona) pairs already completed in the output.
+
+    With include_article, items written without an article are not complete.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A partial last line from a crash; the item is simply redone
+                continue
+            if "content" not in record:
+                continue
+            # Records written before the stage was recorded go by their content
+            stage = record.get("stage")
+            if stage is None:
+                stage = ARTICLE if record["content"].get("article") else ANALYSIS
+            if stage == ARTICLE or not include_article:
+                done.add((record["id"], record["persona"]))
+    return done
+
+
+def write_record(
+    output,
+    message_id: str,
+    persona_key: str,
+    result,
+    stats,
+    seconds: Optional[float] = None,
+):
+    """Append one item's content, or its error, to the output and count it.
+
+    seconds is how long the item took to generate, if it was timed.
+    """
+    record = {
+        "id": message_id,
+        "persona": persona_key,
+        "finished_at": datetime.now().isoformat(),
+    }
+    if seconds is not None:
+        record["seconds"] = round(seconds, 3)
+    if isinstance(result, Exception):
+        logger.error(f"Failed {message_id}/{persona_key}: {result}")
+        record["error"] = str(result)
+        stats["failed"] += 1
+    else:
+        record["content"] = result.model_dump(mode="json")
+        # So a run without articles doesn't count as done for one with them
+        record["stage"] = ARTICLE if result.article else ANALYSIS
+        stats["succeeded"] += 1
+
+    # Results are written as they finish so a crash loses nothing
+    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+    output.flush()
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    persona_keys: List[str],
+    concurrency: int = MAX_CONCURRENT_GENERATIONS,
+    include_article: bool = True,
+    service: Optional[ClaudeService] = None,
+    deferred: bool = False,
+) -> Dict[str, int]:
+    """Generate every pending item and append results to output_path.
+
+    With deferred, items go through the Message Batches API instead of
+    direct calls and the results are written once the batches end.
+    """
+    done = load_checkpoint(output_path, include_article)
+    pending = [
+        item
+        for item in expand_items(read_messages(input_path), persona_keys)
+        if (item[0], item[2]) not in done
+    ]
+    stats = {"skipped": len(done), "pending": len(pending), "succeeded": 0, "failed": 0}
+    logger.info(f"{len(done)} items already done, {len(pending)} to generate")
+    if not pending:
+        return stats
+
+    service = service or ClaudeService()
+
+    if deferred:
+        # Imported here so direct runs don't open the batch store
+        from deferred import DeferredGenerator
+
+        results = DeferredGenerator(service).run(
+            [(message, persona_key) for _, message, persona_key in pending],
+            include_article=include_article,
+        )
+        with open(output_path, "a", encoding="utf-8") as output:
+            for message_id, message, persona_key in pending:
+                result = results[(message, persona_key)]
+                write_record(output, message_id, persona_key, result, stats)
+        return stats
+
+    def generate(message: str, persona_key: str):
+        started = time.perf_counter()
+        try:
+            result = generate_cached(
+                service,
+                message,
+                persona_key,
+                include_article=include_article,
+                priority=PRIORITY_BATCH,
+            )
+        except Exception as e:
+            result = e
+        return result, time.perf_counter() - started
+
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(
+        max_workers=max(1, concurrency), thread_name_prefix="batch"
+    ) as executor:
+        futures = {
+            executor.submit(generate, message, persona_key): (message_id, persona_key)
+            for message_id, message, persona_key in pending
+        }
+        for future in as_completed(futures):
+            message_id, persona_key = futures[future]
+            result, seconds = future.result()
+            write_record(output, message_id, persona_key, result, stats, seconds)
+
+            finished = stats["succeeded"] + stats["failed"]
+            if finished % 10 == 0 or finished == len(pending):
+                logger.info(f"Progress: {finished}/{len(pending)}")
+
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Generate content for many messages and personas"
+    )
+    parser.add_argument("input", help="CSV or JSONL file of messages")
+    parser.add_argument(
+        "-o", "--output", required=True, help="JSONL file to append results to"
+    )
+    parser.add_argument(
+        "--personas",
+        default=",".join(AVAILABLE_PERSONAS),
+        help="Comma-separated persona keys (default: all)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=MAX_CONCURRENT_GENERATIONS,
+        help="Maximum generations in flight",
+    )
+    parser.add_argument(
+        "--no-article",
+        action="store_true",
+        help="Only generate the analysis, skip the sample article",
+    )
+    parser.add_argument(
+        "--deferred",
+        action="store_true",
+        help="Use the Message Batches API: half the price, done within 24 hours; "
+        "rerun the same command to resume after an interruption",
+    )
+    args = parser.parse_args(argv)
+
+    persona_keys = [key.strip() for key in args.personas.split(",") if key.strip()]
+    unknown = [key for key in persona_keys if key not in AVAILABLE_PERSONAS]
+    if unknown:
+        parser.error(f"Unknown personas: {', '.join(unknown)}")
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    stats = run_batch(
+        args.input,
+        args.output,
+        persona_keys,
+        concurrency=args.concurrency,
+        include_article=not args.no_article,
+        deferred=args.deferred,
+    )
+    logger.info(f"Batch finished: {stats}")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""Offline end-to-end benchmarks of the generation path.
+
+Starts fake_claude.py in-process and drives ClaudeService through the cache,
+single-flight and parse layers for single, multi-persona and batch
+workloads. Reports p50/p95/p99 latency, throughput, cache hit ratio and
+parse-failure rate. No API key or network access is needed, so it can run
+in CI.
+
+Usage:
+    python benchmark.py [--quick] [--json results.json] [--error-rate 0.05]
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+# Keep benchmark state away from the real cache, before config is imported
+os.environ.setdefault("CLAUDE_API_KEY", "fake-key")
+_STATE_DIR = tempfile.mkdtemp(prefix="bench-")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(_STATE_DIR, "results.db"))
+os.environ.setdefault("ARCHIVE_DB_PATH", os.path.join(_STATE_DIR, "archive.db"))
+
+import anthropic
+
+from batch import run_batch
+from claude_service import ClaudeService
+from config import AVAILABLE_PERSONAS
+from fake_claude import FakeSettings, running_fake_server
+from generation import generate_cached
+from models import MessageInput
+from result_cache import get_result_cache
+from scheduler import RequestScheduler
+
+TOPICS = [
+    "rising water prices during the summer drought",
+    "community solar panels on the school roof",
+    "heat waves and how to keep older neighbours safe",
+    "cheaper bus passes to cut city traffic emissions",
+    "switching the bakery ovens to renewable electricity",
+    "planting trees along the river to prevent flooding",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def make_messages(workload: str, count: int) -> List[str]:
+    return [
+        f"[{workload} {i}] Our campaign this month is about {TOPICS[i % len(TOPICS)]}."
+        for i in range(count)
+    ]
+
+
+class Recorder:
+    """Collect latencies and counter deltas for one workload"""
+
+    def __init__(self, name: str, service: ClaudeService):
+        self.name = name
+        self.service = service
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def __enter__(self):
+        self.cache_before = get_result_cache().stats()
+        self.parses_before = self.service.parses
+        self.repairs_before = self.service.parse_repairs
+        self.failures_before = self.service.parse_failures
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.started
+        cache_after = get_result_cache().stats()
+        self.hits = cache_after["hits"] - self.cache_before["hits"]
+        self.misses = cache_after["misses"] - self.cache_before["misses"]
+        self.parses = self.service.parses - self.parses_before
+        self.repairs = self.service.parse_repairs - self.repairs_before
+        self.failures = self.service.parse_failures - self.failures_before
+
+    def timed(self, fn: Callable[[], Any]):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - started)
+
+    def report(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        parses = self.parses or 1
+        return {
+            "workload": self.name,
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "p50_s": round(percentile(self.latencies, 50), 3),
+            "p95_s": round(percentile(self.latencies, 95), 3),
+            "p99_s": round(percentile(self.latencies, 99), 3),
+            "throughput_per_s": round(len(self.latencies) / self.elapsed, 2),
+            "cache_hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "parse_repair_rate": round(self.repairs / parses, 3),
+            "parse_failure_rate": round(self.failures / parses, 3),
+        }
+
+
+def bench_single(service, count: int, concurrency: int, warm: bool) -> Dict[str, Any]:
+    name = "single_warm" if warm else "single_cold"
+    messages = make_messages("single", count)
+    with Recorder(name, service) as recorder:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for message in messages:
+                executor.submit(
+                    recorder.timed,
+                    lambda m=message: generate_cached(service, m, "pt_farmer"),
+                )
+    return recorder.report()
+
+
+def bench_multi(service, count: int) -> Dict[str, Any]:
+    personas = dict(AVAILABLE_PERSONAS)
+
+    def fan_out(message_input: MessageInput):
+        results = service.generate_content_for_personas(
+            message_input, personas, include_article=False
+        )
+        # A fan-out counts as failed when any persona failed
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+
+    with Recorder("multi_persona", service) as recorder:
+        for message in make_messages("multi", count):
+            message_input = MessageInput(
+                content=message, selected_personas=list(personas)
+            )
+            recorder.timed(lambda: fan_out(message_input))
+    return recorder.report()
+
+
+def bench_batch(service, count: int, concurrency: int) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="bench-batch-")
+    input_path = os.path.join(workdir, "messages.jsonl")
+    with open(input_path, "w", encoding="utf-8") as f:
+        for message in make_messages("batch", count):
+            f.write(json.dumps({"message": message}) + "\n")
+
+    output_path = os.path.join(workdir, "results.jsonl")
+    with Recorder("batch", service) as recorder:
+        stats = run_batch(
+            input_path,
+            output_path,
+            list(AVAILABLE_PERSONAS)[:4],
+            concurrency=concurrency,
+            include_article=False,
+            service=service,
+        )
+    # Every record carries how long its item took to generate
+    with open(output_path, encoding="utf-8") as f:
+        recorder.latencies = [json.loads(line)["seconds"] for line in f]
+    recorder.errors = stats["failed"]
+    report = recorder.report()
+    report.update(elapsed_s=round(recorder.elapsed, 3))
+    return report
+
+
+def print_table(reports: List[Dict[str, Any]]):
+    columns = [
+        "workload",
+        "requests",
+        "errors",
+        "p50_s",
+        "p95_s",
+        "p99_s",
+        "throughput_per_s",
+        "cache_hit_ratio",
+        "parse_failure_rate",
+    ]
+    print(" | ".join(f"{c:>16}" for c in columns))
+    for report in reports:
+        print(" | ".join(f"{str(report.get(c, '')):>16}" for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline generation benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Small, fast run for CI")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-median", type=float, default=None)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.02)
+    args = parser.parse_args(argv)
+    # Per-request client logging would dominate the output and the timings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    count = 8 if args.quick else 40
+    settings = FakeSettings(
+        latency_median=(
+            args.latency_median
+            if args.latency_median is not None
+            else (0.05 if args.quick else 0.4)
+        ),
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        retry_after=0.05,
+        malformed_rate=args.malformed_rate,
+        seed=1234,
+    )
+
+    with running_fake_server(settings) as base_url:
+        client = anthropic.Anthropic(
+            api_key="fake-key", base_url=base_url, max_retries=0
+        )
+        # Effectively unlimited so the benchmark measures the code path, not quotas
+        scheduler = RequestScheduler(
+            requests_per_minute=1e6,
+            tokens_per_minute=1e9,
+            max_in_flight=64,
+            base_delay=0.05,
+            max_delay=1.0,
+        )
+        service = ClaudeService(client=client, scheduler=scheduler)
+        reports = [
+            bench_single(service, count, args.concurrency, warm=False),
+            bench_single(service, count, args.concurrency, warm=True),
+            bench_multi(service, max(1, count // 4)),
+            bench_batch(service, count, args.concurrency),
+        ]
+        client.close()
+
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,103 +1,1066 @@
-import anthropic
-from typing import Dict, Any
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Any,
+    Union,
+    Callable,
+    Set,
+    Optional,
+    List,
+    Iterator,
+    Tuple,
+)
+import atexit
 import json
 import logging
-from config import CLAUDE_API_KEY
-from models import MessageInput, GeneratedContent
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    CLAUDE_API_KEY,
+    CLAUDE_BASE_URL,
+    CLAUDE_ANALYSIS_MODEL,
+    CLAUDE_ARTICLE_MODEL,
+    CLAUDE_CONNECT_TIMEOUT,
+    CLAUDE_READ_TIMEOUT,
+    CLAUDE_MAX_CONNECTIONS,
+    CLAUDE_MAX_KEEPALIVE_CONNECTIONS,
+    CLAUDE_KEEPALIVE_EXPIRY,
+    CLAUDE_HARD_DEADLINE,
+    CLAUDE_HEDGE_MODEL,
+    CLAUDE_HEDGING,
+    DAILY_TOKEN_QUOTA,
+    MAX_CONCURRENT_GENERATIONS,
+    MIN_ARTICLE_TOKENS,
+    OUTPUT_TOKEN_BUDGETS,
+)
+from models import MessageInput, GeneratedArticle, GeneratedContent
+from pydantic import ValidationError
+from json_utils import PartialJsonParser, repair_json
+from hedging import Attempt, DeadlineExceeded, hedged_call
+from scheduler import (
+    CancelToken,
+    RequestScheduler,
+    get_scheduler,
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+)
+from token_budget import (
+    QuotaExceededError,
+    estimate_input_tokens,
+    get_token_quota,
+    output_budget,
+)
+from telemetry import (
+    GENERATION_SECONDS,
+    PARSE_RESULTS,
+    PARSE_SECONDS,
+    log_prompt,
+    record_tokens,
+    track_request,
+)
 import ssl
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# The SDK and its HTTP stack take most of the import time, so they are only
+# loaded once the first generation needs a client
+if TYPE_CHECKING:
+    import anthropic
+
 logger = logging.getLogger(__name__)
 
+# The user's text, a whole conversation, or a function building either for
+# the max_tokens a call is granted, e.g. an article prompt stating its length
+Prompt = Union[str, List[Dict[str, Any]], Callable[[int], Any]]
 
-class ClaudeService:
-    def __init__(self):
+
+def _prompt_for(prompt: Prompt, max_tokens: int) -> Union[str, List[Dict[str, Any]]]:
+    return prompt(max_tokens) if callable(prompt) else prompt
+
+
+_client: Optional["anthropic.Anthropic"] = None
+_client_lock = threading.Lock()
+_warmup_started = False
+
+
+def get_client() -> "anthropic.Anthropic":
+    """Return the process-wide Anthropic client, creating it on first use.
+
+    The client owns a keep-alive connection pool, so sharing it across sessions
+    and Streamlit reruns reuses open TLS connections instead of dialing anew.
+    The API key is checked here rather than at import, so tools that never
+    call Claude run without one.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if not CLAUDE_API_KEY:
+                    raise ValueError(
+                        "CLAUDE_API_KEY must be set in environment variables"
+                    )
+                try:
+                    import anthropic
+                    import httpx
+
+                    timeout = anthropic.Timeout(
+                        CLAUDE_READ_TIMEOUT, connect=CLAUDE_CONNECT_TIMEOUT
+                    )
+                    limits = httpx.Limits(
+                        max_connections=CLAUDE_MAX_CONNECTIONS,
+                        max_keepalive_connections=CLAUDE_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=CLAUDE_KEEPALIVE_EXPIRY,
+                    )
+                    _client = anthropic.Anthropic(
+                        api_key=CLAUDE_API_KEY,
+                        base_url=CLAUDE_BASE_URL,
+                        timeout=timeout,
+                        # Retries are handled by the shared RequestScheduler
+                        max_retries=0,
+                        http_client=anthropic.DefaultHttpxClient(
+                            timeout=timeout, limits=limits
+                        ),
+                    )
+                    atexit.register(close_client)
+                    logger.info("Anthropic client initialized successfully")
+                except Exception as e:
+                    logger.error(f"Failed to initialize Anthropic client: {e}")
+                    raise
+    return _client
+
+
+def warm_up_client():
+    """Create the shared client on a background thread if it doesn't exist yet.
+
+    Called once a page is on screen, so the first generation doesn't pay for
+    importing the SDK while startup doesn't either.
+    """
+    global _warmup_started
+    if _client is not None or _warmup_started or not CLAUDE_API_KEY:
+        return
+    _warmup_started = True
+
+    def create():
         try:
-            self.client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
-            logger.info("Anthropic client initialized successfully")
+            get_client()
         except Exception as e:
-            logger.error(f"Failed to initialize Anthropic client: {e}")
-            raise
+            logger.warning(f"Could not warm up the Anthropic client: {e}")
 
-    def _get_response(self, prompt: str) -> str:
-        try:
-            logger.debug(f"Sending prompt: {prompt}")
-            message = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=4096,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-            )
-            logger.info("Message received successfully")
+    threading.Thread(target=create, name="client-warmup", daemon=True).start()
 
-            # Extract text from content, handling both single and multiple content blocks
-            if isinstance(message.content, list):
-                # If multiple content blocks, concatenate their text
-                response_text = " ".join(
-                    block.text for block in message.content if hasattr(block, "text")
-                )
-            elif hasattr(message.content, "text"):
-                # If single content block
-                response_text = message.content.text
-            else:
-                # Fallback to string representation if unexpected format
-                response_text = str(message.content)
 
-            return response_text
-        except Exception as e:
-            logger.error(f"Error getting Claude response: {e}")
-            raise Exception(f"Error getting Claude response: {str(e)}")
+def close_client():
+    """Close the shared client and its connection pool"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            atexit.unregister(close_client)
+            logger.info("Anthropic client closed")
 
-    def _build_analysis_prompt(self, message: str, persona: Dict[str, Any]) -> str:
-        return f"""As a climate communications expert, analyze this message and provide guidance:
 
-Message: {message}
-Target Audience: {persona['name']}
+# Words of Markdown prose per output token, with headroom so articles end
+# before max_tokens cuts them off
+ARTICLE_WORDS_PER_TOKEN = 0.6
 
-Audience Characteristics:
-- Primary concerns: {', '.join(persona['primary_concerns'])}
-- Language level: {persona['language_level']}
-- Key characteristics: {', '.join(persona['characteristics'])}
+
+ANALYSIS_INSTRUCTIONS = """As a climate communications expert, analyze the user's message and provide guidance for the target audience described below.
 
 Please provide a complete analysis including:
 1. Appropriate tone for this audience
 2. Key phrases and keywords that will resonate
 3. Specific feedback on message effectiveness
 4. Types of news stories that would interest this audience
-5. A sample article tailored to this audience
 
-Respond STRICTLY in the following JSON format:
-{{
-    "tone": "description of appropriate tone",
-    "keywords": ["list", "of", "keywords"],
-    "feedback": "specific feedback on message",
-    "related_news": ["list", "of", "news", "types"],
-    "article": "complete sample article"
-}}
+Submit your complete analysis by calling the submit_analysis tool."""
+
+ARTICLE_INSTRUCTIONS = """As a climate communications expert, write a complete sample article that communicates the user's message to the target audience described below.
+
+Use the recommended tone and weave in the recommended keywords. Respond with the article only, formatted in Markdown, without any preamble."""
+
+ANALYSIS_FIELDS = ("tone", "keywords", "feedback", "related_news")
+# Sections that can be regenerated or refined on their own
+REFINABLE_FIELDS = ANALYSIS_FIELDS + ("article",)
+
+
+def _build_analysis_tool() -> Dict[str, Any]:
+    """Derive the tool schema Claude must answer with from GeneratedContent"""
+    schema = GeneratedContent.model_json_schema()
+    schema["properties"] = {
+        field: schema["properties"][field] for field in ANALYSIS_FIELDS
+    }
+    schema["required"] = list(ANALYSIS_FIELDS)
+    return {
+        "name": "submit_analysis",
+        "description": "Submit the tailored climate communication analysis",
+        "input_schema": schema,
+    }
+
+
+ANALYSIS_TOOL = _build_analysis_tool()
+
+
+@lru_cache(maxsize=None)
+def _build_section_tool(field: str) -> Dict[str, Any]:
+    """Tool schema for resubmitting a single analysis field"""
+    schema = ANALYSIS_TOOL["input_schema"]
+    return {
+        "name": f"submit_{field}",
+        "description": f"Submit the revised {field.replace('_', ' ')}",
+        "input_schema": {
+            **schema,
+            "properties": {field: schema["properties"][field]},
+            "required": [field],
+        },
+    }
+
+
+def _build_refine_request(field: str, instruction: Optional[str]) -> str:
+    label = field.replace("_", " ")
+    if instruction:
+        return f"Revise only the {label}, following this feedback: {instruction}"
+    return f"Write a different version of only the {label}, still tailored to the audience."
+
+
+@lru_cache(maxsize=None)
+def _persona_prompt(
+    name: str, concerns: tuple, language_level: str, characteristics: tuple
+) -> str:
+    return f"""Target Audience: {name}
+
+Audience Characteristics:
+- Primary concerns: {', '.join(concerns)}
+- Language level: {language_level}
+- Key characteristics: {', '.join(characteristics)}"""
+
+
+def _build_persona_prompt(persona: Dict[str, Any]) -> str:
+    """Render the per-persona prompt block, memoized so it stays byte-identical"""
+    return _persona_prompt(
+        persona["name"],
+        tuple(persona["primary_concerns"]),
+        persona["language_level"],
+        tuple(persona["characteristics"]),
+    )
+
+
+def _degraded_analysis(persona: Dict[str, Any]) -> GeneratedContent:
+    """Generic analysis built from the persona alone, for when Claude is too slow"""
+    concerns = [concern.replace("_", " ") for concern in persona["primary_concerns"]]
+    traits = [trait.replace("_", " ") for trait in persona["characteristics"]]
+    return GeneratedContent(
+        tone=f"Use {persona['language_level']} language for a {', '.join(traits)} "
+        "audience.",
+        keywords=concerns,
+        feedback=f"Connect your message to what matters most to this audience: "
+        f"{', '.join(concerns)}.",
+        related_news=[f"Local stories about {concern}" for concern in concerns],
+        degraded=True,
+    )
+
+
+def _response_text(message) -> str:
+    """Return the tool call's input as JSON, else the text of a Messages API reply"""
+    # Prefer the schema-constrained tool call, re-serialized for validation
+    for block in message.content:
+        if getattr(block, "type", None) == "tool_use":
+            return json.dumps(block.input)
+
+    # Extract text from content, handling both single and multiple content blocks
+    if isinstance(message.content, list):
+        # If multiple content blocks, concatenate their text
+        return " ".join(
+            block.text for block in message.content if hasattr(block, "text")
+        )
+    elif hasattr(message.content, "text"):
+        # If single content block
+        return message.content.text
+    # Fallback to string representation if unexpected format
+    return str(message.content)
+
+
+@contextmanager
+def _closed_on_cancel(stream, cancel: Optional[CancelToken]):
+    """Close an open message stream from another thread if cancel fires"""
+    if cancel is None:
+        yield
+        return
+    unregister = cancel.on_cancel(stream.close)
+    try:
+        yield
+    finally:
+        unregister()
+
+
+class ClaudeService:
+    def __init__(
+        self,
+        client: Optional["anthropic.Anthropic"] = None,
+        scheduler: Optional[RequestScheduler] = None,
+    ):
+        self._client = client
+        self.scheduler = scheduler or get_scheduler()
+        self.usage_totals = {
+            "input_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "output_tokens": 0,
+        }
+        self.parses = 0
+        self.parse_repairs = 0
+        self.parse_failures = 0
+        self._usage_lock = threading.Lock()
+        # The parse counters are bumped from scheduler and job threads alike
+        self._parse_lock = threading.Lock()
+
+    @property
+    def client(self) -> "anthropic.Anthropic":
+        """The Anthropic client, the shared one unless given, created on first use"""
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def _request_params(
+        self,
+        model: str,
+        system: List[Dict[str, Any]],
+        prompt: Union[str, List[Dict[str, Any]]],
+        tool: Optional[Dict[str, Any]],
+        max_tokens: int,
+    ) -> Dict[str, Any]:
+        # A list is a whole conversation, e.g. a refinement after earlier turns
+        if isinstance(prompt, str):
+            prompt = [{"role": "user", "content": prompt}]
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "system": system,
+            "messages": prompt,
+            "temperature": 0.7,
+        }
+        if tool is not None:
+            params["tools"] = [tool]
+            params["tool_choice"] = {"type": "tool", "name": tool["name"]}
+        return params
+
+    def _stream_attempt(
+        self,
+        attempt: Attempt,
+        params: Dict[str, Any],
+        mode: str,
+        user_id: Optional[str],
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> Tuple[str, Any]:
+        """Stream one attempt, calling on_text with the text received so far.
+
+        Every call streams, even those whose caller wants the whole message:
+        the first token is then the attempt's first output, which hedging
+        and the hard deadline time, and cancelling closes the HTTP stream so
+        the upstream call and its scheduler slot end at once. Returns the
+        streamed text and the final message.
+        """
+        response_text = ""
+        attempt.sent()
+        with track_request(attempt.model, mode) as timer:
+            with self.client.messages.stream(**params) as stream:
+                with _closed_on_cancel(stream, attempt.cancel):
+                    for event in stream:
+                        if event.type != "content_block_delta":
+                            continue
+                        # Tool input arrives as raw JSON fragments
+                        if event.delta.type == "input_json_delta":
+                            response_text += event.delta.partial_json
+                        elif event.delta.type == "text_delta":
+                            response_text += event.delta.text
+                        else:
+                            continue
+                        timer.first_token()
+                        # A hedged attempt that lost the race is cancelled shortly
+                        if attempt.first_output() and on_text is not None:
+                            on_text(response_text)
+                # A closed stream may just end early rather than raise
+                attempt.cancel.raise_if_cancelled()
+                message = stream.get_final_message()
+        # A hedged loser is billed too, so its usage counts as well
+        self._record_usage(message.usage, attempt.model, user_id)
+        return response_text, message
+
+    def _get_response(
+        self,
+        system: List[Dict[str, Any]],
+        prompt: Prompt,
+        priority: int = PRIORITY_INTERACTIVE,
+        model: str = CLAUDE_ANALYSIS_MODEL,
+        tool: Optional[Dict[str, Any]] = ANALYSIS_TOOL,
+        cancel: Optional[CancelToken] = None,
+        max_tokens: int = OUTPUT_TOKEN_BUDGETS["analysis"],
+        min_tokens: Optional[int] = None,
+        user_id: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """Return the response text and whether it was cut off at max_tokens"""
+        try:
+            log_prompt(logger, _prompt_for(prompt, max_tokens))
+
+            def create_once(attempt: Attempt):
+                with self._token_budget(
+                    system, prompt, tool, max_tokens, min_tokens, user_id
+                ) as (attempt_prompt, attempt_max_tokens):
+                    params = self._request_params(
+                        attempt.model, system, attempt_prompt, tool, attempt_max_tokens
+                    )
+                    _, message = self._stream_attempt(attempt, params, "sync", user_id)
+                return message
+
+            message = self._call(
+                create_once,
+                model,
+                "sync",
+                self._estimate_tokens(system, prompt, tool, max_tokens),
+                priority,
+                cancel,
+            )
+            logger.debug("Message received successfully")
+            return _response_text(message), message.stop_reason == "max_tokens"
+        except (DeadlineExceeded, QuotaExceededError):
+            raise
+        except Exception as e:
+            logger.error(f"Error getting Claude response: {e}")
+            raise Exception(f"Error getting Claude response: {str(e)}")
+
+    def _stream_response(
+        self,
+        system: List[Dict[str, Any]],
+        prompt: Prompt,
+        on_text: Callable[[str], None],
+        priority: int = PRIORITY_INTERACTIVE,
+        model: str = CLAUDE_ANALYSIS_MODEL,
+        tool: Optional[Dict[str, Any]] = ANALYSIS_TOOL,
+        cancel: Optional[CancelToken] = None,
+        max_tokens: int = OUTPUT_TOKEN_BUDGETS["analysis"],
+        min_tokens: Optional[int] = None,
+        user_id: Optional[str] = None,
+    ) -> Tuple[str, bool]:
+        """Stream the response, calling on_text with the text received so far.
+
+        Returns the text and whether it was cut off at max_tokens. Cancelling
+        closes the HTTP stream, so the upstream call stops at once.
+        """
+
+        def stream_once(attempt: Attempt) -> Tuple[str, bool]:
+            with self._token_budget(
+                system, prompt, tool, max_tokens, min_tokens, user_id
+            ) as (attempt_prompt, attempt_max_tokens):
+                params = self._request_params(
+                    attempt.model, system, attempt_prompt, tool, attempt_max_tokens
+                )
+                response_text, message = self._stream_attempt(
+                    attempt, params, "stream", user_id, on_text
+                )
+            return response_text, message.stop_reason == "max_tokens"
+
+        try:
+            log_prompt(logger, _prompt_for(prompt, max_tokens))
+            response = self._call(
+                stream_once,
+                model,
+                "stream",
+                self._estimate_tokens(system, prompt, tool, max_tokens),
+                priority,
+                cancel,
+            )
+            logger.debug("Message stream completed successfully")
+            return response
+        except (DeadlineExceeded, QuotaExceededError):
+            raise
+        except Exception as e:
+            logger.error(f"Error streaming Claude response: {e}")
+            raise Exception(f"Error getting Claude response: {str(e)}")
+
+    def _estimate_tokens(
+        self,
+        system: List[Dict[str, Any]],
+        prompt: Prompt,
+        tool: Optional[Dict[str, Any]],
+        max_tokens: int,
+    ) -> int:
+        """Upper estimate of a call's input and output tokens, for the rate limits"""
+        return estimate_input_tokens(system, _prompt_for(prompt, max_tokens), tool) + (
+            max_tokens
+        )
+
+    @contextmanager
+    def _token_budget(
+        self,
+        system: List[Dict[str, Any]],
+        prompt: Prompt,
+        tool: Optional[Dict[str, Any]],
+        max_tokens: int,
+        min_tokens: Optional[int],
+        user_id: Optional[str],
+    ) -> Iterator[Tuple[Union[str, List[Dict[str, Any]]], int]]:
+        """Reserve an attempt against the user's daily quota before it is sent.
+
+        Yields the prompt and the max_tokens to request, which the quota may
+        cut down to min_tokens (default: max_tokens itself); a prompt built
+        from max_tokens is built for the granted amount. Every attempt of a
+        hedged or retried call is billed, so each reserves its own tokens.
+        """
+        input_tokens = estimate_input_tokens(
+            system, _prompt_for(prompt, max_tokens), tool
+        )
+        if user_id is None or DAILY_TOKEN_QUOTA <= 0:
+            yield _prompt_for(prompt, max_tokens), max_tokens
+            return
+        quota = get_token_quota()
+        granted = quota.reserve(
+            user_id, input_tokens, max_tokens, min_tokens or max_tokens
+        )
+        try:
+            yield _prompt_for(prompt, granted), granted
+        finally:
+            quota.release(user_id, input_tokens + granted)
+
+    def _call(
+        self,
+        fn: Callable[[Attempt], Any],
+        model: str,
+        mode: str,
+        estimated_tokens: int,
+        priority: int,
+        cancel: Optional[CancelToken],
+    ) -> Any:
+        """Run fn(attempt) through the scheduler, hedged when the call is interactive"""
 
-Important: Ensure the response is a valid JSON object that can be parsed directly."""
+        def run_attempt(attempt: Attempt) -> Any:
+            return self.scheduler.run(
+                lambda: fn(attempt),
+                estimated_tokens=estimated_tokens,
+                priority=priority,
+                cancel=attempt.cancel,
+            )
+
+        # Background work has no latency target, so it never pays for a hedge
+        if not CLAUDE_HEDGING or priority != PRIORITY_INTERACTIVE:
+            return run_attempt(Attempt(model, mode, cancel))
+        return hedged_call(
+            run_attempt,
+            model,
+            mode,
+            CLAUDE_HEDGE_MODEL or model,
+            CLAUDE_HARD_DEADLINE,
+            cancel,
+        )
+
+    def _record_usage(self, usage, model: str, user_id: Optional[str] = None):
+        """Record cached vs uncached input tokens for a call and add them to the totals"""
+        call_usage = {
+            "input_tokens": usage.input_tokens,
+            "cache_read_input_tokens": usage.cache_read_input_tokens or 0,
+            "cache_creation_input_tokens": usage.cache_creation_input_tokens or 0,
+            "output_tokens": usage.output_tokens,
+        }
+        record_tokens(model, call_usage)
+        logger.debug(
+            "Token usage: uncached_input=%(input_tokens)d "
+            "cache_read=%(cache_read_input_tokens)d "
+            "cache_write=%(cache_creation_input_tokens)d "
+            "output=%(output_tokens)d",
+            call_usage,
+        )
+        with self._usage_lock:
+            for name, value in call_usage.items():
+                self.usage_totals[name] += value
+        if user_id is not None and DAILY_TOKEN_QUOTA > 0:
+            get_token_quota().record(user_id, sum(call_usage.values()))
+
+    def _build_system_prompt(
+        self, persona: Dict[str, Any], instructions: str = ANALYSIS_INSTRUCTIONS
+    ) -> List[Dict[str, Any]]:
+        """Build the stable prompt prefix: shared instructions, then the persona block.
+
+        Both blocks are marked for prompt caching so repeated calls only pay
+        full price for the user's message.
+        """
+        return [
+            {
+                "type": "text",
+                "text": instructions,
+                "cache_control": {"type": "ephemeral"},
+            },
+            {
+                "type": "text",
+                "text": _build_persona_prompt(persona),
+                "cache_control": {"type": "ephemeral"},
+            },
+        ]
 
+    def _build_analysis_prompt(self, message: str) -> str:
+        return f"Message: {message}"
+
+    def _build_article_prompt(
+        self, message: str, analysis: GeneratedContent, max_tokens: int
+    ) -> str:
+        # Rounded so prompts stay identical across similar budgets
+        words = max(50, int(max_tokens * ARTICLE_WORDS_PER_TOKEN) // 50 * 50)
+        return f"""Message: {message}
+
+Recommended tone: {analysis.tone}
+Recommended keywords: {', '.join(analysis.keywords)}
+Length: at most {words} words"""
+
+    @GENERATION_SECONDS.time(stage="content")
     def generate_content(
-        self, message_input: MessageInput, persona_data: Dict[str, Any]
+        self,
+        message_input: MessageInput,
+        persona_data: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        include_article: bool = True,
+    ) -> GeneratedContent:
+        """Generate the analysis and, unless include_article is False, the article"""
+        content = self.generate_analysis(message_input, persona_data, priority)
+        if include_article:
+            article = self.generate_article(
+                message_input, persona_data, content, priority=priority
+            )
+            content.article = article.article
+            content.truncated = content.truncated or article.truncated
+        return content
+
+    @GENERATION_SECONDS.time(stage="analysis")
+    def generate_analysis(
+        self,
+        message_input: MessageInput,
+        persona_data: Dict[str, Any],
+        priority: int = PRIORITY_INTERACTIVE,
+        cancel: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
     ) -> GeneratedContent:
+        """Generate tone, keywords, feedback and related news with the fast model"""
         try:
-            prompt = self._build_analysis_prompt(message_input.content, persona_data)
-            response = self._get_response(prompt)
+            system = self._build_system_prompt(persona_data)
+            prompt = self._build_analysis_prompt(message_input.content)
+            response, truncated = self._get_response(
+                system,
+                prompt,
+                priority,
+                cancel=cancel,
+                max_tokens=output_budget(persona_data, "analysis"),
+                user_id=user_id,
+            )
+            return self._parse_content(response, truncated)
+        except QuotaExceededError:
+            raise
+        except DeadlineExceeded as e:
+            logger.warning(f"Falling back to a degraded analysis: {e}")
+            return _degraded_analysis(persona_data)
+        except Exception as e:
+            logger.error(f"Error generating content: {e}")
+            raise Exception(f"Error generating content: {str(e)}")
 
-            # Attempt to parse the JSON response
-            try:
-                # Strip any leading/trailing whitespace or code block markers
-                response = response.strip("```json\n```\n").strip()
-                content = json.loads(response)
-                return GeneratedContent(**content)
-            except json.JSONDecodeError as json_error:
-                logger.error(f"Failed to parse Claude response as JSON: {json_error}")
-                logger.error(f"Problematic response: {response}")
-                raise ValueError(
-                    f"Failed to parse Claude response as JSON: {json_error}"
-                )
+    @GENERATION_SECONDS.time(stage="analysis_stream")
+    def generate_analysis_streaming(
+        self,
+        message_input: MessageInput,
+        persona_data: Dict[str, Any],
+        on_update: Callable[[Dict[str, Any], Set[str]], None],
+        priority: int = PRIORITY_INTERACTIVE,
+        cancel: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
+    ) -> GeneratedContent:
+        """Generate the analysis while streaming partial sections to on_update.
 
+        on_update receives the fields parsed so far and the set of fields whose
+        values are complete.
+        """
+        try:
+            system = self._build_system_prompt(persona_data)
+            prompt = self._build_analysis_prompt(message_input.content)
+            parser = PartialJsonParser()
+            response, truncated = self._stream_response(
+                system,
+                prompt,
+                lambda text: on_update(*parser.feed(text)),
+                priority,
+                cancel=cancel,
+                max_tokens=output_budget(persona_data, "analysis"),
+                user_id=user_id,
+            )
+            return self._parse_content(response, truncated)
+        except QuotaExceededError:
+            raise
+        except DeadlineExceeded as e:
+            logger.warning(f"Falling back to a degraded analysis: {e}")
+            return _degraded_analysis(persona_data)
         except Exception as e:
             logger.error(f"Error generating content: {e}")
             raise Exception(f"Error generating content: {str(e)}")
+
+    @GENERATION_SECONDS.time(stage="article")
+    def generate_article(
+        self,
+        message_input: MessageInput,
+        persona_data: Dict[str, Any],
+        analysis: GeneratedContent,
+        on_text: Optional[Callable[[str], None]] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        cancel: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
+    ) -> GeneratedArticle:
+        """Write the sample article with the article model, guided by the analysis.
+
+        If on_text is given the article is streamed to it as it is written.
+        The persona's article budget sets max_tokens, which a nearly spent
+        quota may shorten; the length asked for follows what was granted.
+        """
+        try:
+            max_tokens = output_budget(persona_data, "article")
+            system = self._build_system_prompt(persona_data, ARTICLE_INSTRUCTIONS)
+
+            def prompt(granted: int) -> str:
+                return self._build_article_prompt(
+                    message_input.content, analysis, granted
+                )
+
+            if on_text is None:
+                article, truncated = self._get_response(
+                    system,
+                    prompt,
+                    priority,
+                    model=CLAUDE_ARTICLE_MODEL,
+                    tool=None,
+                    cancel=cancel,
+                    max_tokens=max_tokens,
+                    min_tokens=MIN_ARTICLE_TOKENS,
+                    user_id=user_id,
+                )
+            else:
+                article, truncated = self._stream_response(
+                    system,
+                    prompt,
+                    on_text,
+                    priority,
+                    model=CLAUDE_ARTICLE_MODEL,
+                    tool=None,
+                    cancel=cancel,
+                    max_tokens=max_tokens,
+                    min_tokens=MIN_ARTICLE_TOKENS,
+                    user_id=user_id,
+                )
+            return GeneratedArticle(article=article.strip(), truncated=truncated)
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Error generating article: {e}")
+            raise Exception(f"Error generating article: {str(e)}")
+
+    def _build_refine_messages(
+        self, prompt: str, answer: str, request: str
+    ) -> List[Dict[str, Any]]:
+        """Replay the earlier exchange ahead of a refinement request.
+
+        The earlier answer is marked for prompt caching, so further
+        refinements of the same result reuse the whole prefix.
+        """
+        return [
+            {"role": "user", "content": prompt},
+            {
+                "role": "assistant",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": answer,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ],
+            },
+            {"role": "user", "content": request},
+        ]
+
+    @GENERATION_SECONDS.time(stage="refine")
+    def refine_section(
+        self,
+        message_input: MessageInput,
+        persona_data: Dict[str, Any],
+        content: GeneratedContent,
+        field: str,
+        instruction: Optional[str] = None,
+        on_text: Optional[Callable[[str], None]] = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        cancel: Optional[CancelToken] = None,
+        user_id: Optional[str] = None,
+    ) -> GeneratedContent:
+        """Regenerate one field of content, or refine it following instruction.
+
+        The request and answer that produced content are replayed as earlier
+        conversation turns, so only the one field is written anew. on_text
+        streams a rewritten article. Returns content with the field replaced.
+        """
+        if field not in REFINABLE_FIELDS:
+            raise ValueError(f"Unknown section: {field}")
+        if field == "article" and not content.article:
+            raise ValueError("There is no article to refine yet")
+
+        request = _build_refine_request(field, instruction)
+        try:
+            if field == "article":
+                max_tokens = output_budget(persona_data, "article")
+
+                def messages(granted: int) -> List[Dict[str, Any]]:
+                    return self._build_refine_messages(
+                        self._build_article_prompt(
+                            message_input.content, content, granted
+                        ),
+                        content.article,
+                        request,
+                    )
+
+                system = self._build_system_prompt(persona_data, ARTICLE_INSTRUCTIONS)
+                if on_text is None:
+                    article, _ = self._get_response(
+                        system,
+                        messages,
+                        priority,
+                        model=CLAUDE_ARTICLE_MODEL,
+                        tool=None,
+                        cancel=cancel,
+                        max_tokens=max_tokens,
+                        min_tokens=MIN_ARTICLE_TOKENS,
+                        user_id=user_id,
+                    )
+                else:
+                    article, _ = self._stream_response(
+                        system,
+                        messages,
+                        on_text,
+                        priority,
+                        model=CLAUDE_ARTICLE_MODEL,
+                        tool=None,
+                        cancel=cancel,
+                        max_tokens=max_tokens,
+                        min_tokens=MIN_ARTICLE_TOKENS,
+                        user_id=user_id,
+                    )
+                return content.model_copy(update={"article": article.strip()})
+
+            prior = {name: getattr(content, name) for name in ANALYSIS_FIELDS}
+            messages = self._build_refine_messages(
+                self._build_analysis_prompt(message_input.content),
+                json.dumps(prior, ensure_ascii=False),
+                request,
+            )
+            response, _ = self._get_response(
+                self._build_system_prompt(persona_data),
+                messages,
+                priority,
+                tool=_build_section_tool(field),
+                cancel=cancel,
+                max_tokens=output_budget(persona_data, "section"),
+                user_id=user_id,
+            )
+            return self._parse_section(response, content, field)
+        except QuotaExceededError:
+            raise
+        except Exception as e:
+            logger.error(f"Error refining {field}: {e}")
+            raise Exception(f"Error refining {field}: {str(e)}")
+
+    def _parse_section(
+        self, response: str, content: GeneratedContent, field: str
+    ) -> GeneratedContent:
+        """Validate a single resubmitted field and merge it into content"""
+        with PARSE_SECONDS.time():
+            # Salvage fenced, prose-wrapped or truncated JSON like _parse_content
+            candidates = (("ok", response), ("repaired", repair_json(response)))
+            for outcome, candidate in candidates:
+                try:
+                    value = json.loads(candidate)[field]
+                    refined = GeneratedContent.model_validate(
+                        {**content.model_dump(exclude={"generated_at"}), field: value}
+                    )
+                except (ValueError, KeyError, TypeError) as error:
+                    logger.warning(f"Malformed {field} in Claude response: {error}")
+                    continue
+                PARSE_RESULTS.inc(outcome=outcome)
+                return refined
+            PARSE_RESULTS.inc(outcome="failed")
+            raise ValueError(
+                f"Failed to parse the revised {field} from Claude's response"
+            )
+
+    def _count_parse(self, counter: str):
+        with self._parse_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _parse_content(
+        self, response: str, truncated: bool = False
+    ) -> GeneratedContent:
+        self._count_parse("parses")
+        with PARSE_SECONDS.time():
+            try:
+                content = GeneratedContent.model_validate_json(response)
+                content.truncated = truncated
+                PARSE_RESULTS.inc(outcome="ok")
+                return content
+            except ValidationError as error:
+                logger.warning(f"Malformed Claude response, attempting repair: {error}")
+                self._count_parse("parse_repairs")
+
+            # Salvage fenced, prose-wrapped or truncated JSON instead of regenerating
+            repaired = repair_json(response)
+            try:
+                content = GeneratedContent.model_validate_json(repaired)
+                content.truncated = truncated
+                PARSE_RESULTS.inc(outcome="repaired")
+                logger.info("Recovered malformed Claude response locally")
+                return content
+            except ValidationError as error:
+                self._count_parse("parse_failures")
+                PARSE_RESULTS.inc(outcome="failed")
+                logger.error(f"Failed to parse Claude response as JSON: {error}")
+                logger.error(f"Problematic response: {response}")
+                raise ValueError(f"Failed to parse Claude response as JSON: {error}")
+
+    def generate_content_for_personas(
+        self,
+        message_input: MessageInput,
+        personas: Dict[str, Dict[str, Any]],
+        max_concurrency: int = MAX_CONCURRENT_GENERATIONS,
+        priority: int = PRIORITY_INTERACTIVE,
+        include_article: bool = True,
+    ) -> Dict[str, Union[GeneratedContent, Exception]]:
+        """Generate content for several personas concurrently.
+
+        Returns a mapping of persona key to its GeneratedContent, or to the
+        exception raised for that persona so one failure doesn't sink the rest.
+        """
+        if not personas:
+            return {}
+
+        results: Dict[str, Union[GeneratedContent, Exception]] = {}
+        workers = max(1, min(max_concurrency, len(personas)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="claude-fanout"
+        ) as executor:
+            futures = {
+                persona_key: executor.submit(
+                    self.generate_content,
+                    message_input,
+                    persona_data,
+                    priority,
+                    include_article,
+                )
+                for persona_key, persona_data in personas.items()
+            }
+            for persona_key, future in futures.items():
+                try:
+                    results[persona_key] = future.result()
+                except Exception as e:
+                    logger.error(f"Error generating content for {persona_key}: {e}")
+                    results[persona_key] = e
+        return results
+
+    # Deferred mode: prompts go through the Message Batches API, which answers
+    # within 24 hours at half the price, away from the interactive rate limits
+
+    def _analysis_params(self, message: str, persona_data: Dict[str, Any]):
+        return self._request_params(
+            CLAUDE_ANALYSIS_MODEL,
+            self._build_system_prompt(persona_data),
+            self._build_analysis_prompt(message),
+            ANALYSIS_TOOL,
+            output_budget(persona_data, "analysis"),
+        )
+
+    def _article_params(
+        self, message: str, persona_data: Dict[str, Any], analysis: GeneratedContent
+    ):
+        max_tokens = output_budget(persona_data, "article")
+        return self._request_params(
+            CLAUDE_ARTICLE_MODEL,
+            self._build_system_prompt(persona_data, ARTICLE_INSTRUCTIONS),
+            self._build_article_prompt(message, analysis, max_tokens),
+            None,
+            max_tokens,
+        )
+
+    def submit_batch(
+        self,
+        analyses: Optional[Dict[str, Tuple[str, Dict[str, Any]]]] = None,
+        articles: Optional[
+            Dict[str, Tuple[str, Dict[str, Any], GeneratedContent]]
+        ] = None,
+    ) -> str:
+        """Submit analyses and articles as one Message Batch and return its ID.
+
+        analyses maps a custom ID to (message, persona data); articles maps
+        one to (message, persona data, analysis). The prompts are the same
+        as for direct calls, so the shared prompt prefixes are cached too.
+        """
+        # The kind prefix tells batch_results how to parse each answer
+        requests = [
+            {
+                "custom_id": f"analysis-{custom_id}",
+                "params": self._analysis_params(*item),
+            }
+            for custom_id, item in (analyses or {}).items()
+        ]
+        requests += [
+            {"custom_id": f"article-{custom_id}", "params": self._article_params(*item)}
+            for custom_id, item in (articles or {}).items()
+        ]
+        if not requests:
+            raise ValueError("A batch needs at least one request")
+
+        def create():
+            with track_request("batch", "batch_submit"):
+                return self.client.messages.batches.create(requests=requests)
+
+        batch = self.scheduler.run(create, priority=PRIORITY_BATCH)
+        logger.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+        return batch.id
+
+    def retrieve_batch(self, batch_id: str) -> "anthropic.types.messages.MessageBatch":
+        """Return a Message Batch with its processing status and request counts"""
+
+        def retrieve():
+            with track_request("batch", "batch_poll"):
+                return self.client.messages.batches.retrieve(batch_id)
+
+        return self.scheduler.run(retrieve, priority=PRIORITY_BATCH)
+
+    def batch_results(
+        self, batch_id: str
+    ) -> Iterator[Tuple[str, Union[GeneratedContent, GeneratedArticle, Exception]]]:
+        """Yield (custom ID, result) for every request of an ended batch.
+
+        The result is a GeneratedContent for an analysis, a GeneratedArticle
+        for an article, or the exception describing why the request failed.
+        """
+
+        def results():
+            with track_request("batch", "batch_results"):
+                return list(self.client.messages.batches.results(batch_id))
+
+        for entry in self.scheduler.run(results, priority=PRIORITY_BATCH):
+            kind, _, custom_id = entry.custom_id.partition("-")
+            result = entry.result
+            if result.type != "succeeded":
+                error = getattr(getattr(result, "error", None), "error", None)
+                detail = f": {error.message}" if error is not None else ""
+                yield custom_id, Exception(f"Batch request {result.type}{detail}")
+                continue
+
+            message = result.message
+            self._record_usage(message.usage, message.model)
+            text = _response_text(message)
+            truncated = message.stop_reason == "max_tokens"
+            if kind != "analysis":
+                yield custom_id, GeneratedArticle(
+                    article=text.strip(), truncated=truncated
+                )
+                continue
+            try:
+                yield custom_id, self._parse_content(text, truncated)
+            except ValueError as e:
+                yield custom_id, e
@@ -4,9 +4,56 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # API Configuration
+# Checked when the first Claude client is created, so importing config,
+# personas or models works without credentials
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
-if not CLAUDE_API_KEY:
-    raise ValueError("CLAUDE_API_KEY must be set in environment variables")
+# Override the Messages API endpoint, e.g. to point at fake_claude.py
+CLAUDE_BASE_URL = os.getenv("CLAUDE_BASE_URL")
+
+# Model Configuration
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+# Fast, cheap model for tone/keywords/feedback/related news
+CLAUDE_ANALYSIS_MODEL = os.getenv("CLAUDE_ANALYSIS_MODEL", "claude-3-5-haiku-20241022")
+# Model for the sample article, generated only when the user asks for it
+CLAUDE_ARTICLE_MODEL = os.getenv("CLAUDE_ARTICLE_MODEL", CLAUDE_MODEL)
+# HTTP connection settings for the shared Anthropic client (seconds)
+CLAUDE_CONNECT_TIMEOUT = 5.0
+CLAUDE_READ_TIMEOUT = 120.0
+CLAUDE_MAX_CONNECTIONS = 20
+CLAUDE_MAX_KEEPALIVE_CONNECTIONS = 10
+CLAUDE_KEEPALIVE_EXPIRY = 60.0
+# Upstream rate limits and retry policy enforced by scheduler.RequestScheduler
+CLAUDE_REQUESTS_PER_MINUTE = 50
+CLAUDE_TOKENS_PER_MINUTE = 100000
+CLAUDE_MAX_IN_FLIGHT = 16
+CLAUDE_MAX_RETRIES = 4
+CLAUDE_RETRY_BASE_DELAY = 1.0
+CLAUDE_RETRY_MAX_DELAY = 30.0
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+# Hedging of interactive calls: with no output after the CLAUDE_HEDGE_PERCENTILE
+# of recent time-to-first-output (CLAUDE_HEDGE_DEFAULT_DELAY until there are
+# CLAUDE_HEDGE_MIN_SAMPLES samples) a backup request is sent, to
+# CLAUDE_HEDGE_MODEL if set, and the first to answer wins. With no output by
+# CLAUDE_HARD_DEADLINE seconds the analysis falls back to a degraded result.
+CLAUDE_HEDGING = os.getenv("CLAUDE_HEDGING", "true").lower() in ("1", "true", "yes")
+CLAUDE_HEDGE_MODEL = os.getenv("CLAUDE_HEDGE_MODEL", "")
+CLAUDE_HEDGE_PERCENTILE = float(os.getenv("CLAUDE_HEDGE_PERCENTILE", "95"))
+CLAUDE_HEDGE_DEFAULT_DELAY = 5.0
+CLAUDE_HEDGE_MIN_DELAY = 1.0
+CLAUDE_HEDGE_MIN_SAMPLES = 20
+CLAUDE_HARD_DEADLINE = float(os.getenv("CLAUDE_HARD_DEADLINE", "30"))
+# Bump whenever the analysis prompt changes so stale cached results are not reused
+PROMPT_VERSION = "4"
+
+# Telemetry: share of calls whose full prompt is logged (0 disables), a port
+# serving /metrics from the Streamlit process and the interface it listens on
+# (only this host unless set, e.g. to 0.0.0.0), and the ?page=admin metrics page
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_PROMPT_SAMPLE_RATE = float(os.getenv("LOG_PROMPT_SAMPLE_RATE", "0"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+ENABLE_ADMIN_PAGE = os.getenv("ENABLE_ADMIN_PAGE", "").lower() in ("1", "true", "yes")
 
 # App Configuration
 APP_TITLE = "Climate Communications Tool"
@@ -23,6 +70,7 @@ AVAILABLE_PERSONAS = {
             "traditional_values",
         ],
         "language_level": "simple",
+        "output_tokens": {"analysis": 768, "article": 700},
         "primary_concerns": ["water_scarcity", "energy_costs", "crop_yields"],
         "icon": "🌾",
     },
@@ -35,6 +83,7 @@ AVAILABLE_PERSONAS = {
             "busy_lifestyle",
         ],
         "language_level": "moderate",
+        "output_tokens": {"analysis": 1024, "article": 1000},
         "primary_concerns": ["air_quality", "recycling", "green_spaces"],
         "icon": "🏢",
     },
@@ -47,6 +96,7 @@ AVAILABLE_PERSONAS = {
             "community_minded",
         ],
         "language_level": "professional",
+        "output_tokens": {"analysis": 1024, "article": 1200},
         "primary_concerns": ["energy_efficiency", "waste_reduction", "cost_savings"],
         "icon": "💼",
     },
@@ -55,6 +105,7 @@ AVAILABLE_PERSONAS = {
         "description": "Young adults passionate about climate action and social change",
         "characteristics": ["idealistic", "tech_native", "socially_conscious"],
         "language_level": "academic",
+        "output_tokens": {"analysis": 1024, "article": 1400},
         "primary_concerns": ["future_impact", "sustainable_living", "social_justice"],
         "icon": "📚",
     },
@@ -63,6 +114,7 @@ AVAILABLE_PERSONAS = {
         "description": "Parents concerned about their children's environmental future",
         "characteristics": ["family_oriented", "safety_conscious", "long_term_planner"],
         "language_level": "simple",
+        "output_tokens": {"analysis": 768, "article": 700},
         "primary_concerns": [
             "health_impacts",
             "future_generations",
@@ -75,6 +127,7 @@ AVAILABLE_PERSONAS = {
         "description": "Experienced individuals with traditional values and environmental concerns",
         "characteristics": ["traditional", "value_conscious", "community_oriented"],
         "language_level": "simple",
+        "output_tokens": {"analysis": 768, "article": 700},
         "primary_concerns": ["health", "cost_of_living", "community_impact"],
         "icon": "👴",
     },
@@ -83,6 +136,7 @@ AVAILABLE_PERSONAS = {
         "description": "Technology workers interested in innovative climate solutions",
         "characteristics": ["innovation_focused", "data_driven", "solution_oriented"],
         "language_level": "technical",
+        "output_tokens": {"analysis": 1024, "article": 1400},
         "primary_concerns": ["technological_solutions", "data_analysis", "efficiency"],
         "icon": "💻",
     },
@@ -91,13 +145,120 @@ AVAILABLE_PERSONAS = {
         "description": "Teachers and professors who want to communicate climate issues effectively",
         "characteristics": ["knowledge_sharing", "analytical", "community_impact"],
         "language_level": "academic",
+        "output_tokens": {"analysis": 1024, "article": 1400},
         "primary_concerns": ["education", "research", "public_awareness"],
         "icon": "👩‍🏫",
     },
 }
 
+# Maximum number of Claude calls issued in parallel for multi-persona generation
+MAX_CONCURRENT_GENERATIONS = 8
+
+# Headless HTTP API: generations run at once, and queued plus running before 429s
+API_MAX_WORKERS = int(os.getenv("API_MAX_WORKERS", MAX_CONCURRENT_GENERATIONS))
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "64"))
+
 # Cache Configuration
 CACHE_TTL = 3600  # 1 hour
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", os.path.join(".cache", "results.db"))
+CACHE_MAX_ENTRIES = 5000
+# Near-duplicate reuse: a message at least this MinHash-similar (0-1) to one
+# already generated for the same persona, with the same words up to typos and
+# identical numbers and negations, is served its cached results. Only case,
+# punctuation and whitespace edits score 1; set above 1 to disable.
+SIMILARITY_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.85"))
+
+# Background generation jobs of the Streamlit app go through a durable queue
+# in JOB_QUEUE_DB_PATH, shared by every app replica and worker.py process on
+# the host. It is a database of its own, next to the cache by default, so the
+# frequent heartbeat writes don't hold the cache's write lock. Each consumer
+# runs JOB_WORKERS jobs at once: jobs mostly wait on the scheduler, which does
+# the admission control, so this is larger than its in-flight limit. The app consumes the queue on its own threads, or starts
+# JOB_PROCESSES worker processes instead, sharing the rate limits; with
+# JOB_EXTERNAL_WORKERS it leaves the queue to separately run worker.py pools.
+# A consumer renews its lease on a running job every JOB_HEARTBEAT_INTERVAL
+# seconds, also writing back progress; a job whose lease is
+# JOB_VISIBILITY_TIMEOUT seconds old is claimed again, up to JOB_MAX_ATTEMPTS
+# times. Waiting pages poll every JOB_POLL_INTERVAL and idle consumers every
+# JOB_CLAIM_INTERVAL seconds; finished jobs are kept JOB_RETENTION_SECONDS.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2 * CLAUDE_MAX_IN_FLIGHT))
+JOB_PROCESSES = int(os.getenv("JOB_PROCESSES", "0"))
+JOB_EXTERNAL_WORKERS = os.getenv("JOB_EXTERNAL_WORKERS", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+JOB_QUEUE_DB_PATH = os.getenv(
+    "JOB_QUEUE_DB_PATH", os.path.join(os.path.dirname(CACHE_DB_PATH), "jobs.db")
+)
+JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "30"))
+JOB_MAX_ATTEMPTS = 3
+JOB_HEARTBEAT_INTERVAL = 0.2
+JOB_CLAIM_INTERVAL = 0.1
+JOB_POLL_INTERVAL = 0.3
+JOB_RETENTION_SECONDS = 600
+
+# The upstream rate limits are accounted in RATE_LIMIT_DB_PATH, shared by the
+# app, its worker processes and every replica on the host, so together they
+# stay within the account's limits. Set it empty to give each process its own
+# limits instead; a worker.py pool then splits them between its processes.
+RATE_LIMIT_DB_PATH = os.getenv(
+    "RATE_LIMIT_DB_PATH", os.path.join(os.path.dirname(CACHE_DB_PATH), "limits.db")
+)
+
+# Archive: every generation kept for good with a full-text index, for the
+# "Search Past Content" page and similar past articles; never expires
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", os.path.join(".cache", "archive.db"))
+ARCHIVE_SEARCH_LIMIT = 20
+
+# Cache warming: once a message has been entered CACHE_WARM_MIN_USES times
+# within CACHE_WARM_WINDOW_DAYS, its analysis is generated in the background
+# for every persona not cached yet. Warming runs at the lowest priority, spends
+# at most CACHE_WARM_TOKENS_PER_MINUTE and is cancelled whenever another call
+# has to wait; up to CACHE_WARM_MAX_PENDING messages wait to be warmed.
+CACHE_WARMING = os.getenv("CACHE_WARMING", "true").lower() in ("1", "true", "yes")
+CACHE_WARM_MIN_USES = int(os.getenv("CACHE_WARM_MIN_USES", "2"))
+CACHE_WARM_WINDOW_DAYS = 7
+CACHE_WARM_TOKENS_PER_MINUTE = int(
+    os.getenv("CACHE_WARM_TOKENS_PER_MINUTE", CLAUDE_TOKENS_PER_MINUTE // 10)
+)
+CACHE_WARM_MAX_PENDING = 16
+
+# Token budgets: default max_tokens per generation stage (personas override
+# them with "output_tokens"; "section" is one refined analysis field), the
+# smallest article worth writing when a quota leaves less than the budget, and
+# the tokens each user may spend per UTC day (0 disables the quota)
+OUTPUT_TOKEN_BUDGETS = {"analysis": 1024, "article": 1500, "section": 512}
+MIN_ARTICLE_TOKENS = 256
+DAILY_TOKEN_QUOTA = int(os.getenv("DAILY_TOKEN_QUOTA", "0"))
+QUOTA_DB_PATH = os.getenv("QUOTA_DB_PATH", CACHE_DB_PATH)
+# Who a quota is charged to. API_KEYS ("key1:alice,key2:bob") maps API keys
+# to users; with any set, the HTTP API requires one as a Bearer token or an
+# X-API-Key header. TRUSTED_USER_HEADER names a header that an authenticating
+# reverse proxy sets, which clients must not be able to reach around. The
+# X-User-Id header is chosen by the client and ignored unless
+# TRUST_CLIENT_USER_ID is set. Otherwise users are told apart by login, then
+# by address, which everyone behind one proxy shares.
+API_KEYS = dict(
+    (key.strip(), user.strip())
+    for key, _, user in (
+        entry.partition(":") for entry in os.getenv("API_KEYS", "").split(",")
+    )
+    if key.strip() and user.strip()
+)
+TRUSTED_USER_HEADER = os.getenv("TRUSTED_USER_HEADER", "")
+TRUST_CLIENT_USER_ID = os.getenv("TRUST_CLIENT_USER_ID", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Deferred mode (batch.py --deferred): prompts go through the Message Batches
+# API, at most DEFERRED_MAX_REQUESTS per batch, whose status is checked every
+# DEFERRED_POLL_INTERVAL seconds and kept in DEFERRED_DB_PATH across restarts
+DEFERRED_DB_PATH = os.getenv("DEFERRED_DB_PATH", CACHE_DB_PATH)
+DEFERRED_POLL_INTERVAL = float(os.getenv("DEFERRED_POLL_INTERVAL", "30"))
+DEFERRED_MAX_REQUESTS = 10000
 
 # UI Configuration
 THEME_COLOR = "#1abc9c"
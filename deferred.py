@@ -0,0 +1,417 @@
+"""Deferred generation through the Message Batches API.
+
+For campaign prep that can wait: the analyses of many message × persona
+items, then their articles, are submitted as Message Batches instead of
+direct calls. Batches cost half as much, may take up to 24 hours and don't
+compete with interactive traffic for the rate limits. Every batch and item
+is recorded in SQLite, so a restarted run waits for the batches it already
+submitted instead of paying for them again. Finished results fill the
+result cache, similarity index and archive like any other generation.
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from claude_service import ClaudeService
+from config import DEFERRED_DB_PATH, DEFERRED_MAX_REQUESTS, DEFERRED_POLL_INTERVAL
+from generation import cache_generated, lookup_cached
+from models import GeneratedContent
+from personas import get_persona_data
+from result_cache import make_article_cache_key, make_cache_key
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS = "analysis"
+ARTICLE = "article"
+# Item status: submitted and waiting for its batch, or its outcome
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def _custom_id(
+    message: str,
+    persona_key: str,
+    stage: str,
+    analysis: Optional[GeneratedContent] = None,
+) -> str:
+    """Batch custom ID of an item: its cache key, cut to fit the 64 character limit.
+
+    The article stage needs the analysis the article is written from.
+    """
+    if stage == ANALYSIS:
+        return make_cache_key(message, persona_key)[:48]
+    return make_article_cache_key(message, persona_key, analysis)[:48]
+
+
+class DeferredStore:
+    """Submitted batches and the status of each of their items, in SQLite"""
+
+    def __init__(self, path: str = DEFERRED_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS deferred_batches (
+                batch_id TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                collected INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        # One row per item and stage, for its latest submission
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS deferred_items (
+                custom_id TEXT PRIMARY KEY,
+                stage TEXT NOT NULL,
+                batch_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                persona TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS deferred_items_batch "
+            "ON deferred_items (batch_id)"
+        )
+
+    def add_batch(self, batch_id: str, stage: str, items: List[Tuple[str, str, str]]):
+        """Record a submitted batch of (custom ID, message, persona) items"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO deferred_batches "
+                    "(batch_id, stage, requests, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (batch_id, stage, len(items), now, now),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO deferred_items "
+                    "(custom_id, stage, batch_id, message, persona, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (custom_id, stage, batch_id, message, persona, PENDING, now)
+                        for custom_id, message, persona in items
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def open_batches(self) -> List[str]:
+        """Return the IDs of batches whose results haven't been collected yet"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_id FROM deferred_batches WHERE collected = 0 "
+                "ORDER BY created_at"
+            ).fetchall()
+        return [batch_id for (batch_id,) in rows]
+
+    def item(self, custom_id: str) -> Optional[Dict[str, str]]:
+        """Return the status, result and error of an item, or None if never submitted"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, result, error FROM deferred_items WHERE custom_id = ?",
+                (custom_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "result": row[1], "error": row[2]}
+
+    def items(self, batch_id: str) -> Dict[str, Tuple[str, str]]:
+        """Return the (message, persona) of each custom ID submitted in a batch"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, message, persona FROM deferred_items "
+                "WHERE batch_id = ?",
+                (batch_id,),
+            ).fetchall()
+        return {custom_id: (message, persona) for custom_id, message, persona in rows}
+
+    def finish_item(
+        self,
+        custom_id: str,
+        batch_id: str,
+        result: Optional[str] = None,
+        error: Optional[str] = None,
+    ):
+        """Record an item's result, or why it failed"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE deferred_items SET status = ?, result = ?, error = ?, "
+                "updated_at = ? WHERE custom_id = ? AND batch_id = ?",
+                (
+                    FAILED if error is not None else SUCCEEDED,
+                    result,
+                    error,
+                    time.time(),
+                    custom_id,
+                    batch_id,
+                ),
+            )
+
+    def mark_collected(self, batch_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE deferred_batches SET collected = 1, updated_at = ? "
+                "WHERE batch_id = ?",
+                (time.time(), batch_id),
+            )
+
+    def summary(self) -> List[Dict[str, object]]:
+        """Return every batch with its item counts per status, newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT b.batch_id, b.stage, b.requests, b.collected, b.created_at, "
+                "SUM(i.status = 'pending'), SUM(i.status = 'succeeded'), "
+                "SUM(i.status = 'failed') FROM deferred_batches b "
+                "LEFT JOIN deferred_items i ON i.batch_id = b.batch_id "
+                "GROUP BY b.batch_id ORDER BY b.created_at DESC"
+            ).fetchall()
+        columns = (
+            "batch_id",
+            "stage",
+            "requests",
+            "collected",
+            "created_at",
+            PENDING,
+            SUCCEEDED,
+            FAILED,
+        )
+        return [dict(zip(columns, row)) for row in rows]
+
+
+_store: Optional[DeferredStore] = None
+_store_lock = threading.Lock()
+
+
+def get_deferred_store() -> DeferredStore:
+    """Return the process-wide deferred batch store, opening it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DeferredStore()
+    return _store
+
+
+class DeferredGenerator:
+    """Generates message × persona items through Message Batches.
+
+    The analyses go first; articles need them, so they follow in a second
+    batch. Items already cached, or already submitted and not failed, are
+    never submitted again.
+    """
+
+    def __init__(
+        self,
+        service: Optional[ClaudeService] = None,
+        store: Optional[DeferredStore] = None,
+        poll_interval: float = DEFERRED_POLL_INTERVAL,
+        max_requests: int = DEFERRED_MAX_REQUESTS,
+    ):
+        self.service = service or ClaudeService()
+        self.store = store or get_deferred_store()
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+
+    def _analysis(self, message: str, persona_key: str) -> Optional[GeneratedContent]:
+        """Return the cached or batch-generated analysis, with the article if any"""
+        content = lookup_cached(message, persona_key)
+        item = self.store.item(_custom_id(message, persona_key, ANALYSIS))
+        if content is None and item is not None and item["status"] == SUCCEEDED:
+            content = GeneratedContent.model_validate_json(item["result"])
+        if content is None or content.article:
+            return content
+        item = self.store.item(_custom_id(message, persona_key, ARTICLE, content))
+        if item is not None and item["status"] == SUCCEEDED:
+            return content.model_copy(update={"article": item["result"]})
+        return content
+
+    def _needs(self, message: str, persona_key: str, stage: str) -> bool:
+        content = self._analysis(message, persona_key)
+        if stage == ARTICLE and (content is None or content.article):
+            return False
+        item = self.store.item(_custom_id(message, persona_key, stage, content))
+        if item is not None and item["status"] != FAILED:
+            return False
+        return stage == ARTICLE or content is None
+
+    def submit(
+        self, items: Iterable[Tuple[str, str]], stage: str = ANALYSIS
+    ) -> List[str]:
+        """Submit the stage of every (message, persona) item that still needs it.
+
+        Returns the IDs of the batches submitted, several when there are more
+        items than fit in one.
+        """
+        pending = [
+            (message, persona_key)
+            for message, persona_key in dict.fromkeys(items)
+            if self._needs(message, persona_key, stage)
+        ]
+        batch_ids = []
+        for start in range(0, len(pending), self.max_requests):
+            chunk = pending[start : start + self.max_requests]
+            requests = {}
+            for message, persona_key in chunk:
+                persona_data = get_persona_data(persona_key)
+                item = (message, persona_data)
+                analysis = None
+                if stage == ARTICLE:
+                    analysis = self._analysis(message, persona_key)
+                    item += (analysis,)
+                requests[_custom_id(message, persona_key, stage, analysis)] = item
+            if stage == ANALYSIS:
+                batch_id = self.service.submit_batch(analyses=requests)
+            else:
+                batch_id = self.service.submit_batch(articles=requests)
+            self.store.add_batch(
+                batch_id,
+                stage,
+                [
+                    (custom_id, message, persona_key)
+                    for custom_id, (message, persona_key) in zip(requests, chunk)
+                ],
+            )
+            batch_ids.append(batch_id)
+        return batch_ids
+
+    def poll(self) -> int:
+        """Collect every open batch that has ended; returns how many are still open"""
+        still_open = 0
+        for batch_id in self.store.open_batches():
+            batch = self.service.retrieve_batch(batch_id)
+            if batch.processing_status != "ended":
+                still_open += 1
+                continue
+            self._collect(batch_id)
+        return still_open
+
+    def _collect(self, batch_id: str):
+        items = self.store.items(batch_id)
+        succeeded = failed = 0
+        for custom_id, result in self.service.batch_results(batch_id):
+            if custom_id not in items:
+                continue
+            message, persona_key = items.pop(custom_id)
+            if isinstance(result, Exception):
+                self.store.finish_item(custom_id, batch_id, error=str(result))
+                failed += 1
+                continue
+
+            # Truncated output is still returned from the store, but not cached
+            if isinstance(result, GeneratedContent):
+                self.store.finish_item(custom_id, batch_id, result.model_dump_json())
+                if not result.truncated:
+                    cache_generated(message, persona_key, result)
+            else:
+                self.store.finish_item(custom_id, batch_id, result.article)
+                analysis = self._analysis(message, persona_key)
+                if analysis is not None and not result.truncated:
+                    cache_generated(
+                        message,
+                        persona_key,
+                        analysis.model_copy(update={"article": result.article}),
+                    )
+            succeeded += 1
+        # Expired with the batch, or otherwise missing from its results
+        for custom_id in items:
+            self.store.finish_item(custom_id, batch_id, error="No result in the batch")
+            failed += 1
+        self.store.mark_collected(batch_id)
+        logger.info(
+            f"Collected batch {batch_id}: {succeeded} succeeded, {failed} failed"
+        )
+
+    def wait(self, timeout: Optional[float] = None):
+        """Poll until every open batch is collected, or raise TimeoutError"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll():
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("Batches still processing, run again to resume")
+            time.sleep(self.poll_interval)
+
+    def run(
+        self,
+        items: Iterable[Tuple[str, str]],
+        include_article: bool = True,
+        timeout: Optional[float] = None,
+    ) -> Dict[Tuple[str, str], Union[GeneratedContent, Exception]]:
+        """Generate every (message, persona) item and return its content or error.
+
+        Blocks until the batches end, which may take hours. Interrupted runs
+        resume: batches submitted before are waited for, not resubmitted.
+        """
+        items = list(dict.fromkeys(items))
+        # Collect what earlier runs left behind before deciding what to submit
+        self.wait(timeout)
+        self.submit(items, ANALYSIS)
+        self.wait(timeout)
+        if include_article:
+            self.submit(items, ARTICLE)
+            self.wait(timeout)
+
+        results: Dict[Tuple[str, str], Union[GeneratedContent, Exception]] = {}
+        for message, persona_key in items:
+            content = self._analysis(message, persona_key)
+            stages = [ANALYSIS] if content is None else []
+            if content is not None and include_article and not content.article:
+                stages.append(ARTICLE)
+            if not stages:
+                results[(message, persona_key)] = content
+                continue
+            item = self.store.item(_custom_id(message, persona_key, stages[0], content))
+            error = item["error"] if item is not None else None
+            results[(message, persona_key)] = Exception(
+                f"{stages[0].capitalize()} failed: {error or 'not generated'}"
+            )
+        return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Show the deferred batches and their item counts"
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="Collect finished batches first, waiting for those still processing",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    if args.wait:
+        DeferredGenerator().wait()
+    for batch in get_deferred_store().summary():
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(batch["created_at"]))
+        state = "collected" if batch["collected"] else "open"
+        print(
+            f"{batch['batch_id']}  {batch['stage']:<8}  {created}  {state:<9}  "
+            f"{batch['requests']} requests: {batch[SUCCEEDED] or 0} succeeded, "
+            f"{batch[FAILED] or 0} failed, {batch[PENDING] or 0} pending"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,443 @@
+"""Local stand-in for the Anthropic Messages API.
+
+Serves ``POST /v1/messages`` (plain and streaming) with deterministic content
+derived from the request, so ClaudeService can be exercised and benchmarked
+without an API key. Latency, token rate, 429/529 errors and malformed JSON
+responses are injectable. The Message Batches endpoints are served too:
+batches end ``batch_seconds`` after they are created, with ``error_rate`` of
+their requests errored.
+
+Usage:
+    python fake_claude.py --port 8765 --error-rate 0.05
+    CLAUDE_BASE_URL=http://127.0.0.1:8765 CLAUDE_API_KEY=fake streamlit run app.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from aiohttp import web
+
+WORDS = (
+    "climate water energy costs community health future action solar "
+    "drought heat farming efficiency savings resilience emissions local"
+).split()
+
+
+@dataclass
+class FakeSettings:
+    latency_median: float = 0.5  # seconds before the first token
+    latency_sigma: float = 0.5  # lognormal spread of the first-token latency
+    tokens_per_second: float = 200.0
+    article_tokens: int = 400
+    error_rate: float = 0.0  # share of requests answered with 429 or 529
+    retry_after: float = 0.1
+    malformed_rate: float = 0.0  # share of tool calls answered as broken JSON text
+    batch_seconds: float = 2.0  # time until a message batch has ended
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeStats:
+    requests: int = 0
+    streamed: int = 0
+    errors: int = 0
+    malformed: int = 0
+    disconnected: int = 0  # streams the client closed before the end
+    batches: int = 0
+    batch_requests: int = 0
+    cached_prefixes: List[str] = field(default_factory=list)
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _system_text(body: Dict[str, Any]) -> str:
+    system = body.get("system") or ""
+    if isinstance(system, str):
+        return system
+    return "".join(block.get("text", "") for block in system)
+
+
+def _user_text(body: Dict[str, Any]) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return "\n".join(parts)
+
+
+class FakeClaude:
+    def __init__(self, settings: FakeSettings):
+        self.settings = settings
+        self.stats = FakeStats()
+        self.random = random.Random(settings.seed)
+        self.batches: Dict[str, Dict[str, Any]] = {}
+
+    def _first_token_delay(self) -> float:
+        s = self.settings
+        if s.latency_median <= 0:
+            return 0.0
+        return self.random.lognormvariate(0, s.latency_sigma) * s.latency_median
+
+    def _tool_input(self, tool: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """Fill the tool schema with plausible values derived from the prompt"""
+        words = [w.strip(".,!?").lower() for w in prompt.split() if len(w) > 3]
+        words = words or WORDS
+        result = {}
+        for name, schema in tool["input_schema"]["properties"].items():
+            if schema.get("type") == "array":
+                result[name] = [
+                    f"{self.random.choice(WORDS)} {self.random.choice(words)}"
+                    for _ in range(4)
+                ]
+            else:
+                result[name] = f"Fake {name} for: {' '.join(words[:8])}"
+        return result
+
+    def _article(self, prompt: str) -> str:
+        words = [self.random.choice(WORDS) for _ in range(self.settings.article_tokens)]
+        paragraphs = [" ".join(words[i : i + 60]) for i in range(0, len(words), 60)]
+        return "# Fake article\n\n" + "\n\n".join(
+            p.capitalize() + "." for p in paragraphs
+        )
+
+    def _usage(self, body: Dict[str, Any], output_text: str) -> Dict[str, int]:
+        system = _system_text(body)
+        cached = 0
+        creation = 0
+        if system:
+            if system in self.stats.cached_prefixes:
+                cached = _estimate_tokens(system)
+            else:
+                self.stats.cached_prefixes.append(system)
+                creation = _estimate_tokens(system)
+        return {
+            "input_tokens": _estimate_tokens(_user_text(body)),
+            "cache_read_input_tokens": cached,
+            "cache_creation_input_tokens": creation,
+            "output_tokens": _estimate_tokens(output_text),
+        }
+
+    def _error(self) -> Optional[web.Response]:
+        if self.random.random() >= self.settings.error_rate:
+            return None
+        self.stats.errors += 1
+        if self.random.random() < 0.5:
+            return web.json_response(
+                {
+                    "type": "error",
+                    "error": {"type": "rate_limit_error", "message": "Fake rate limit"},
+                },
+                status=429,
+                headers={"retry-after": str(self.settings.retry_after)},
+            )
+        return web.json_response(
+            {
+                "type": "error",
+                "error": {"type": "overloaded_error", "message": "Fake overload"},
+            },
+            status=529,
+        )
+
+    def _build_reply(self, body: Dict[str, Any]):
+        """Return (content block, payload text) for the request"""
+        prompt = _user_text(body)
+        tools = body.get("tools") or []
+        if not tools:
+            text = self._article(prompt)
+            return {"type": "text", "text": text}, text
+
+        payload = json.dumps(self._tool_input(tools[0], prompt))
+        if self.random.random() < self.settings.malformed_rate:
+            # Fenced and cut off, the way a misbehaving model answers
+            self.stats.malformed += 1
+            text = "```json\n" + payload[: int(len(payload) * 0.8)]
+            return {"type": "text", "text": text}, text
+        return (
+            {
+                "type": "tool_use",
+                "id": f"toolu_{uuid.uuid4().hex[:24]}",
+                "name": tools[0]["name"],
+                "input": json.loads(payload),
+            },
+            payload,
+        )
+
+    def _build_message(self, body: Dict[str, Any]):
+        """Return (message, content block, payload text) answering the request"""
+        block, payload = self._build_reply(body)
+        stop_reason = "tool_use" if block["type"] == "tool_use" else "end_turn"
+        # Real models write about 3 words per 4 tokens of English prose
+        max_words = body.get("max_tokens", 0) * 3 // 4
+        words = payload.split(" ")
+        if block["type"] == "text" and len(words) > max_words:
+            # Cut off at max_tokens, as a real model would be
+            payload = " ".join(words[:max_words])
+            block = dict(block, text=payload)
+            stop_reason = "max_tokens"
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake-model"),
+            "content": [block],
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": self._usage(body, payload),
+        }
+        return message, block, payload
+
+    async def messages(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.stats.requests += 1
+        await asyncio.sleep(self._first_token_delay())
+
+        error = self._error()
+        if error is not None:
+            return error
+
+        message, block, payload = self._build_message(body)
+        usage = message["usage"]
+        if not body.get("stream"):
+            await asyncio.sleep(
+                usage["output_tokens"] / self.settings.tokens_per_second
+            )
+            return web.json_response(message)
+
+        self.stats.streamed += 1
+        response = web.StreamResponse(headers={"content-type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            await self._stream(response, message, block, payload)
+        except ConnectionResetError:
+            # The client cancelled the request mid-stream
+            self.stats.disconnected += 1
+        return response
+
+    async def _stream(self, response, message, block, payload):
+
+        async def send(event: str, data: Dict[str, Any]):
+            await response.write(
+                f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+            )
+
+        start_usage = dict(message["usage"], output_tokens=1)
+        await send(
+            "message_start",
+            {
+                "type": "message_start",
+                "message": dict(
+                    message, content=[], stop_reason=None, usage=start_usage
+                ),
+            },
+        )
+        if block["type"] == "tool_use":
+            start_block = dict(block, input={})
+            delta_type, delta_key = "input_json_delta", "partial_json"
+        else:
+            start_block = {"type": "text", "text": ""}
+            delta_type, delta_key = "text_delta", "text"
+        await send(
+            "content_block_start",
+            {"type": "content_block_start", "index": 0, "content_block": start_block},
+        )
+
+        # Roughly one token per 4 characters, flushed in small bursts
+        chunk = 16
+        interval = (chunk / 4) / self.settings.tokens_per_second
+        for i in range(0, len(payload), chunk):
+            await send(
+                "content_block_delta",
+                {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": delta_type, delta_key: payload[i : i + chunk]},
+                },
+            )
+            await asyncio.sleep(interval)
+
+        await send("content_block_stop", {"type": "content_block_stop", "index": 0})
+        await send(
+            "message_delta",
+            {
+                "type": "message_delta",
+                "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                "usage": {"output_tokens": message["usage"]["output_tokens"]},
+            },
+        )
+        await send("message_stop", {"type": "message_stop"})
+        await response.write_eof()
+
+    def _batch_result(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if self.random.random() < self.settings.error_rate:
+            self.stats.errors += 1
+            error = {"type": "overloaded_error", "message": "Fake overload"}
+            result = {"type": "errored", "error": {"type": "error", "error": error}}
+        else:
+            message, _, _ = self._build_message(request["params"])
+            result = {"type": "succeeded", "message": message}
+        return {"custom_id": request["custom_id"], "result": result}
+
+    def _batch_json(self, request: web.Request, batch: Dict[str, Any]):
+        ended = time.time() >= batch["ends_at"]
+        counts = dict.fromkeys(
+            ("processing", "succeeded", "errored", "canceled", "expired"), 0
+        )
+        if ended:
+            # Answered all at once, the first time anyone asks after the end
+            if batch["results"] is None:
+                batch["results"] = [self._batch_result(r) for r in batch["requests"]]
+            for entry in batch["results"]:
+                counts[entry["result"]["type"]] += 1
+        else:
+            counts["processing"] = len(batch["requests"])
+
+        def timestamp(seconds: float) -> str:
+            return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": counts,
+            "created_at": timestamp(batch["created_at"]),
+            "ended_at": timestamp(batch["ends_at"]) if ended else None,
+            "expires_at": timestamp(batch["created_at"] + 86400),
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": (
+                f"{request.url.origin()}/v1/messages/batches/{batch['id']}/results"
+                if ended
+                else None
+            ),
+        }
+
+    def _invalid_request(self, message: str) -> web.Response:
+        return web.json_response(
+            {
+                "type": "error",
+                "error": {"type": "invalid_request_error", "message": message},
+            },
+            status=400,
+        )
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        requests = body.get("requests") or []
+        if not requests:
+            return self._invalid_request("requests: at least one request is required")
+        custom_ids = [r.get("custom_id", "") for r in requests]
+        if len(set(custom_ids)) != len(custom_ids):
+            return self._invalid_request("requests: custom_id values must be unique")
+        if not all(re.fullmatch(r"[a-zA-Z0-9_-]{1,64}", c) for c in custom_ids):
+            return self._invalid_request("requests: invalid custom_id")
+
+        now = time.time()
+        batch = {
+            "id": f"msgbatch_{uuid.uuid4().hex[:24]}",
+            "requests": requests,
+            "created_at": now,
+            "ends_at": now + self.settings.batch_seconds,
+            "results": None,
+        }
+        self.batches[batch["id"]] = batch
+        self.stats.batches += 1
+        self.stats.batch_requests += len(requests)
+        return web.json_response(self._batch_json(request, batch))
+
+    def _find_batch(self, request: web.Request) -> Optional[Dict[str, Any]]:
+        return self.batches.get(request.match_info["batch_id"])
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        batch = self._find_batch(request)
+        if batch is None:
+            return web.json_response(
+                {
+                    "type": "error",
+                    "error": {"type": "not_found_error", "message": "No such batch"},
+                },
+                status=404,
+            )
+        return web.json_response(self._batch_json(request, batch))
+
+    async def batch_results(self, request: web.Request) -> web.Response:
+        batch = self._find_batch(request)
+        if batch is None or time.time() < batch["ends_at"]:
+            return self._invalid_request("Batch has not ended yet")
+        self._batch_json(request, batch)
+        lines = [json.dumps(entry) for entry in batch["results"]]
+        return web.Response(
+            text="\n".join(lines) + "\n", content_type="application/binary"
+        )
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        stats = asdict(self.stats)
+        stats["cached_prefixes"] = len(stats["cached_prefixes"])
+        return web.json_response(stats)
+
+
+def create_app(settings: Optional[FakeSettings] = None) -> web.Application:
+    fake = FakeClaude(settings or FakeSettings())
+    app = web.Application()
+    app["fake"] = fake
+    app.router.add_post("/v1/messages", fake.messages)
+    app.router.add_post("/v1/messages/batches", fake.create_batch)
+    app.router.add_get("/v1/messages/batches/{batch_id}", fake.retrieve_batch)
+    app.router.add_get("/v1/messages/batches/{batch_id}/results", fake.batch_results)
+    app.router.add_get("/stats", fake.stats_handler)
+    return app
+
+
+@contextmanager
+def running_fake_server(settings: Optional[FakeSettings] = None) -> Iterator[str]:
+    """Run the fake API on an ephemeral port in a background thread, yielding its URL"""
+    loop = asyncio.new_event_loop()
+    app = create_app(settings)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Anthropic Messages API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    defaults = FakeSettings()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            type=float if isinstance(value, float) else int,
+            default=value,
+        )
+    args = parser.parse_args(argv)
+    settings = FakeSettings(**{name: getattr(args, name) for name in asdict(defaults)})
+    web.run_app(create_app(settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from claude_service import ANALYSIS_FIELDS, ClaudeService
+from config import MAX_CONCURRENT_GENERATIONS, SIMILARITY_THRESHOLD
+from archive import get_archive
+from models import MessageInput, GeneratedContent, GeneratedArticle
+from personas import get_persona_data
+from result_cache import get_result_cache, make_cache_key, make_article_cache_key
+from scheduler import CancelToken, PRIORITY_INTERACTIVE
+from similarity import get_similarity_index
+from singleflight import generation_flight
+
+logger = logging.getLogger(__name__)
+
+
+def _persona_input(message: str, persona_key: str):
+    persona_data = get_persona_data(persona_key)
+    if not persona_data:
+        raise ValueError(f"Invalid persona selected: {persona_key}")
+    return MessageInput(content=message, selected_personas=[persona_key]), persona_data
+
+
+def _with_article(
+    service: ClaudeService,
+    message_input: MessageInput,
+    persona_data: Dict[str, Any],
+    content: GeneratedContent,
+    priority: int,
+    on_text: Optional[Callable[[str], None]] = None,
+    cancel: Optional[CancelToken] = None,
+    user_id: Optional[str] = None,
+) -> GeneratedContent:
+    """Attach the cached or freshly written article to the analysis"""
+    if content.article:
+        return content
+
+    message = message_input.content
+    persona_key = message_input.selected_personas[0]
+    cache = get_result_cache()
+    article_key = make_article_cache_key(message, persona_key, content)
+
+    def generate_article() -> GeneratedArticle:
+        cached: Optional[GeneratedArticle] = cache.get(article_key, GeneratedArticle)
+        if cached is not None:
+            return cached
+        article = service.generate_article(
+            message_input,
+            persona_data,
+            content,
+            on_text=on_text,
+            priority=priority,
+            cancel=cancel,
+            user_id=user_id,
+        )
+        # Written from a generic or cut off analysis, or cut off itself, so a
+        # retry should get a fresh one
+        if not (content.degraded or content.truncated or article.truncated):
+            cache.set(article_key, article)
+            _archive(
+                message,
+                persona_key,
+                content.model_copy(update={"article": article.article}),
+            )
+        return article
+
+    article = generation_flight.do(article_key, generate_article)
+    return content.model_copy(
+        update={
+            "article": article.article,
+            "truncated": content.truncated or article.truncated,
+        }
+    )
+
+
+def _archive(message: str, persona_key: str, content: GeneratedContent):
+    """Keep content in the searchable archive; a failure there never fails a generation"""
+    try:
+        get_archive().save(message, persona_key, content)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not archive content for {persona_key}: {e}")
+
+
+def _cache_analysis(
+    key: str, message: str, persona_key: str, content: GeneratedContent
+):
+    """Cache a fresh analysis, index its message for near-duplicate lookups and archive it"""
+    get_result_cache().set(key, content)
+    get_similarity_index().add(message, persona_key)
+    _archive(message, persona_key, content)
+
+
+def generate_cached(
+    service: ClaudeService,
+    message: str,
+    persona_key: str,
+    include_article: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    cancel: Optional[CancelToken] = None,
+    user_id: Optional[str] = None,
+) -> GeneratedContent:
+    """Return content for a message/persona, generating only what isn't cached.
+
+    The analysis and the article are looked up, coalesced and cached under
+    the same keys the Streamlit app uses, so work done here is reused there.
+    Calls made for it count against user_id's daily token quota, if any.
+    """
+    message_input, persona_data = _persona_input(message, persona_key)
+    cache = get_result_cache()
+
+    analysis_key = make_cache_key(message, persona_key)
+
+    def generate_analysis() -> GeneratedContent:
+        content = cache.get(analysis_key)
+        if content is None:
+            content = service.generate_analysis(
+                message_input, persona_data, priority, cancel=cancel, user_id=user_id
+            )
+            # A degraded fallback or cut off answer is only good for this request
+            if not (content.degraded or content.truncated):
+                _cache_analysis(analysis_key, message, persona_key, content)
+        return content
+
+    content = generation_flight.do(analysis_key, generate_analysis)
+    if not include_article:
+        return content
+    return _with_article(
+        service,
+        message_input,
+        persona_data,
+        content,
+        priority,
+        cancel=cancel,
+        user_id=user_id,
+    )
+
+
+def stream_cached(
+    service: ClaudeService,
+    message: str,
+    persona_key: str,
+    on_section: Callable[[str, Any], None],
+    on_article_text: Optional[Callable[[str], None]] = None,
+    include_article: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    cancel: Optional[CancelToken] = None,
+    user_id: Optional[str] = None,
+) -> GeneratedContent:
+    """Like generate_cached, but report each analysis section as soon as it is complete.
+
+    on_section is called once per field. Sections served from the cache or
+    by an identical request already in flight arrive together at the end.
+    on_article_text receives the article written so far while it streams.
+    """
+    message_input, persona_data = _persona_input(message, persona_key)
+    cache = get_result_cache()
+    reported = set()
+
+    def on_update(fields, complete):
+        for field in ANALYSIS_FIELDS:
+            if field in complete and field not in reported:
+                reported.add(field)
+                on_section(field, fields[field])
+
+    analysis_key = make_cache_key(message, persona_key)
+
+    def generate_analysis() -> GeneratedContent:
+        content = cache.get(analysis_key)
+        if content is None:
+            content = service.generate_analysis_streaming(
+                message_input,
+                persona_data,
+                on_update,
+                priority,
+                cancel=cancel,
+                user_id=user_id,
+            )
+            # A degraded fallback or cut off answer is only good for this request
+            if not (content.degraded or content.truncated):
+                _cache_analysis(analysis_key, message, persona_key, content)
+        return content
+
+    content = generation_flight.do(analysis_key, generate_analysis)
+    for field in ANALYSIS_FIELDS:
+        if field not in reported:
+            reported.add(field)
+            on_section(field, getattr(content, field))
+
+    if not include_article:
+        return content
+    return _with_article(
+        service,
+        message_input,
+        persona_data,
+        content,
+        priority,
+        on_article_text,
+        cancel=cancel,
+        user_id=user_id,
+    )
+
+
+def write_article_cached(
+    service: ClaudeService,
+    message: str,
+    persona_key: str,
+    content: GeneratedContent,
+    on_text: Optional[Callable[[str], None]] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    cancel: Optional[CancelToken] = None,
+    user_id: Optional[str] = None,
+) -> str:
+    """Return the cached or freshly written article for an existing analysis"""
+    message_input, persona_data = _persona_input(message, persona_key)
+    content = _with_article(
+        service,
+        message_input,
+        persona_data,
+        content,
+        priority,
+        on_text,
+        cancel,
+        user_id,
+    )
+    return content.article
+
+
+def generate_cached_for_personas(
+    service: ClaudeService,
+    message: str,
+    persona_keys: List[str],
+    include_article: bool = False,
+    priority: int = PRIORITY_INTERACTIVE,
+    cancel: Optional[CancelToken] = None,
+    max_concurrency: int = MAX_CONCURRENT_GENERATIONS,
+    user_id: Optional[str] = None,
+) -> Dict[str, Union[GeneratedContent, Exception]]:
+    """Run generate_cached for several personas concurrently.
+
+    Returns a mapping of persona key to its content, or to the exception
+    raised for that persona so one failure doesn't sink the rest.
+    """
+    results: Dict[str, Union[GeneratedContent, Exception]] = {}
+    workers = max(1, min(max_concurrency, len(persona_keys)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout") as ex:
+        futures = {
+            persona_key: ex.submit(
+                generate_cached,
+                service,
+                message,
+                persona_key,
+                include_article,
+                priority,
+                cancel,
+                user_id,
+            )
+            for persona_key in persona_keys
+        }
+        for persona_key, future in futures.items():
+            try:
+                results[persona_key] = future.result()
+            except Exception as e:
+                logger.error(f"Error generating content for {persona_key}: {e}")
+                results[persona_key] = e
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    return results
+
+
+def lookup_cached(message: str, persona_key: str) -> Optional[GeneratedContent]:
+    """Return the cached analysis with its article if one is cached, without generating"""
+    cache = get_result_cache()
+    content = cache.get(make_cache_key(message, persona_key))
+    if content is None or content.article:
+        return content
+    cached = cache.get(
+        make_article_cache_key(message, persona_key, content), GeneratedArticle
+    )
+    if cached is None:
+        return content
+    return content.model_copy(update={"article": cached.article})
+
+
+def refine_cached(
+    service: ClaudeService,
+    message: str,
+    persona_key: str,
+    field: str,
+    instruction: Optional[str] = None,
+    content: Optional[GeneratedContent] = None,
+    on_text: Optional[Callable[[str], None]] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    cancel: Optional[CancelToken] = None,
+    user_id: Optional[str] = None,
+) -> GeneratedContent:
+    """Regenerate or refine one section of the content and return the result.
+
+    content defaults to what is cached for the message and persona. Only the
+    changed section is generated. The refinement is the requesting user's
+    own, so it is returned for their session and never written to the
+    shared cache or archive, which keep the canonical content.
+    """
+    message_input, persona_data = _persona_input(message, persona_key)
+    if content is None:
+        content = lookup_cached(message, persona_key)
+        if content is None:
+            raise ValueError("Nothing is cached for this message and persona yet")
+    if content.degraded:
+        raise ValueError("Generic fallback content can't be refined, regenerate it")
+
+    return service.refine_section(
+        message_input,
+        persona_data,
+        content,
+        field,
+        instruction,
+        on_text=on_text,
+        priority=priority,
+        cancel=cancel,
+        user_id=user_id,
+    )
+
+
+def cache_generated(message: str, persona_key: str, content: GeneratedContent):
+    """Cache content generated outside these helpers, e.g. by a Message Batch.
+
+    The analysis and any article go under the usual keys, are indexed for
+    near-duplicate lookups and archived, so the app serves them as hits.
+    """
+    analysis_key = make_cache_key(message, persona_key)
+    _cache_analysis(
+        analysis_key, message, persona_key, content.model_copy(update={"article": None})
+    )
+    if content.article:
+        article_key = make_article_cache_key(message, persona_key, content)
+        get_result_cache().set(article_key, GeneratedArticle(article=content.article))
+        _archive(message, persona_key, content)
+
+
+def lookup_similar(
+    message: str, persona_key: str, threshold: float = SIMILARITY_THRESHOLD
+) -> Optional[Tuple[str, GeneratedContent]]:
+    """Return a near-duplicate message and its cached content, if one was generated.
+
+    Catches resubmissions with trivial edits that miss the exact cache key.
+    The closest message whose results are still cached wins.
+    """
+    for similar, score in get_similarity_index().find(message, persona_key, threshold):
+        content = lookup_cached(similar, persona_key)
+        if content is not None:
+            logger.info(f"Reusing results of a {score:.0%} similar message")
+            return similar, content
+    return None
@@ -0,0 +1,213 @@
+"""Hedged upstream calls for interactive requests.
+
+A call that has produced no output by a deadline taken from the recent
+latency percentile gets a second, backup attempt; whichever attempt answers
+first wins and the other is cancelled. If neither answers before a hard
+deadline the call fails with DeadlineExceeded so the caller can fall back.
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import (
+    CLAUDE_HEDGE_DEFAULT_DELAY,
+    CLAUDE_HEDGE_MIN_DELAY,
+    CLAUDE_HEDGE_MIN_SAMPLES,
+    CLAUDE_HEDGE_PERCENTILE,
+)
+from scheduler import CancelToken, RequestCancelled
+from telemetry import HEDGED_CALLS
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW_SIZE = 500
+
+
+class DeadlineExceeded(Exception):
+    """Raised when no attempt produced output before the hard deadline"""
+
+
+class LatencyWindow:
+    """Recent time-to-first-output samples of one model and call mode"""
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile, or None with too few samples to trust"""
+        with self._lock:
+            if len(self._samples) < CLAUDE_HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, math.ceil(q / 100 * len(samples)) - 1)
+        return samples[max(0, index)]
+
+
+_windows: Dict[Tuple[str, str], LatencyWindow] = {}
+_windows_lock = threading.Lock()
+
+
+def latency_window(model: str, mode: str) -> LatencyWindow:
+    with _windows_lock:
+        return _windows.setdefault((model, mode), LatencyWindow())
+
+
+def hedge_delay(model: str, mode: str) -> float:
+    """Seconds to wait for output before hedging a call of this model and mode"""
+    delay = latency_window(model, mode).percentile(CLAUDE_HEDGE_PERCENTILE)
+    if delay is None:
+        delay = CLAUDE_HEDGE_DEFAULT_DELAY
+    return max(CLAUDE_HEDGE_MIN_DELAY, delay)
+
+
+class _Race:
+    """Events from the attempts of one hedged call, and which one owns the output"""
+
+    def __init__(self):
+        self.events: "queue.Queue[Tuple[str, Optional[Attempt], Any]]" = queue.Queue()
+        self.owner: Optional["Attempt"] = None
+        self._lock = threading.Lock()
+
+    def claim(self, attempt: "Attempt") -> bool:
+        with self._lock:
+            if self.owner is None:
+                self.owner = attempt
+                self.events.put(("output", attempt, None))
+            return self.owner is attempt
+
+    def run(self, fn: Callable[["Attempt"], Any], attempt: "Attempt"):
+        try:
+            self.events.put(("done", attempt, fn(attempt)))
+        except BaseException as e:
+            self.events.put(("error", attempt, e))
+
+
+class Attempt:
+    """One try at an upstream call: its model, cancel token and progress signals.
+
+    The call reports sent() once its request goes out and first_output() when
+    output arrives. Outside a hedged call both only record latency samples.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        mode: str,
+        cancel: Optional[CancelToken] = None,
+        race: Optional[_Race] = None,
+    ):
+        self.model = model
+        self.mode = mode
+        self.cancel = cancel or CancelToken()
+        self._race = race
+        self._sent_at: Optional[float] = None
+        self._owns_output: Optional[bool] = None
+
+    def sent(self):
+        self._sent_at = time.perf_counter()
+        if self._race is not None:
+            self._race.events.put(("sent", self, None))
+
+    def first_output(self) -> bool:
+        """Record the first output; returns False if another attempt got there first"""
+        if self._owns_output is None:
+            if self._sent_at is not None:
+                latency_window(self.model, self.mode).add(
+                    time.perf_counter() - self._sent_at
+                )
+            self._owns_output = self._race is None or self._race.claim(self)
+        return self._owns_output
+
+
+def hedged_call(
+    fn: Callable[[Attempt], Any],
+    model: str,
+    mode: str,
+    hedge_model: str,
+    deadline: float,
+    cancel: Optional[CancelToken] = None,
+) -> Any:
+    """Run fn(attempt), hedging it with a second attempt on hedge_model if it is slow.
+
+    The backup starts once the first attempt has been sent but produced no
+    output within hedge_delay(). The first attempt to produce output wins
+    and the other is cancelled; errors of an attempt are only raised once no
+    other attempt is left to answer.
+    """
+    race = _Race()
+    started = time.monotonic()
+    attempts: List[Attempt] = []
+
+    def launch(attempt_model: str) -> Attempt:
+        attempt = Attempt(attempt_model, mode, race=race)
+        attempts.append(attempt)
+        threading.Thread(
+            target=race.run, args=(fn, attempt), name="hedge", daemon=True
+        ).start()
+        return attempt
+
+    unregister = None
+    if cancel is not None:
+        unregister = cancel.on_cancel(lambda: race.events.put(("cancel", None, None)))
+    try:
+        primary = launch(model)
+        hedge_at: Optional[float] = None
+        delay = 0.0
+        failed = 0
+        while True:
+            wake_at = None
+            if race.owner is None:
+                wake_at = started + deadline
+                if hedge_at is not None and len(attempts) == 1:
+                    wake_at = min(wake_at, hedge_at)
+            timeout = None if wake_at is None else max(0, wake_at - time.monotonic())
+            try:
+                kind, attempt, value = race.events.get(timeout=timeout)
+            except queue.Empty:
+                if time.monotonic() >= started + deadline:
+                    HEDGED_CALLS.inc(outcome="deadline")
+                    raise DeadlineExceeded(
+                        f"No response from Claude within {deadline:g}s"
+                    )
+                logger.info(
+                    f"No output from {model} within {delay:.1f}s, "
+                    f"hedging with {hedge_model}"
+                )
+                HEDGED_CALLS.inc(outcome="hedged")
+                launch(hedge_model)
+                continue
+
+            if kind == "cancel":
+                raise RequestCancelled()
+            if kind == "sent":
+                if attempt is primary:
+                    delay = hedge_delay(model, mode)
+                    hedge_at = time.monotonic() + delay
+            elif kind == "output":
+                if attempt is not primary:
+                    HEDGED_CALLS.inc(outcome="backup_won")
+                for other in attempts:
+                    if other is not attempt:
+                        other.cancel.cancel()
+            elif kind == "done":
+                if race.owner is None or race.owner is attempt:
+                    return value
+            elif kind == "error":
+                failed += 1
+                if race.owner is attempt or failed == len(attempts):
+                    raise value
+    finally:
+        if unregister is not None:
+            unregister()
+        for attempt in attempts:
+            attempt.cancel.cancel()
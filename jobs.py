@@ -0,0 +1,543 @@
+"""Durable queue of background generation jobs, shared between processes.
+
+The Streamlit script submits a job, keeps its ID in session state and polls
+the job on later reruns instead of blocking its own run. Jobs are rows in an
+SQLite (WAL) queue, so any consumer on the host may run them: threads of the
+app process itself or worker.py processes shared by several app replicas.
+A consumer leases a job for JOB_VISIBILITY_TIMEOUT seconds and renews the
+lease while the job runs, so the jobs of a crashed consumer are claimed again
+once their lease runs out, up to JOB_MAX_ATTEMPTS times. Identical jobs
+submitted while one is unfinished share it. Cancelling a job nobody else
+waits for stops its upstream call: queued calls leave the scheduler, streams
+are closed and retries are dropped, which frees the concurrency slot at once.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from config import (
+    JOB_CLAIM_INTERVAL,
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_MAX_ATTEMPTS,
+    JOB_QUEUE_DB_PATH,
+    JOB_RETENTION_SECONDS,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_WORKERS,
+)
+from scheduler import CancelToken, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+_COLUMNS = (
+    "id, kind, payload, user_id, status, progress, result, error, "
+    "attempts, created_at, finished_at"
+)
+
+
+@dataclass
+class Job:
+    """State of one background generation.
+
+    Readers get a snapshot from the queue; the consumer running the job
+    publishes progress on its own copy, which it writes back periodically.
+    """
+
+    id: str
+    kind: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+    user_id: Optional[str] = None
+    status: str = QUEUED
+    # Partial results published while the job runs, e.g. streamed sections
+    progress: Dict[str, Any] = field(default_factory=dict)
+    # JSON value returned by the job's handler
+    result: Any = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancel_token: CancelToken = field(default_factory=CancelToken, repr=False)
+    # Bumped on every publish so the consumer knows what to write back
+    version: int = field(default=0, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def publish(self, **progress):
+        """Merge partial results; the dict is replaced so readers never see it mid-update"""
+        self.progress = {**self.progress, **progress}
+        self.version += 1
+
+
+def _dedup_key(kind: str, payload: Dict[str, Any]) -> str:
+    data = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _job_from_row(row) -> Job:
+    (
+        job_id,
+        kind,
+        payload,
+        user_id,
+        status,
+        progress,
+        result,
+        error,
+        attempts,
+        created_at,
+        finished_at,
+    ) = row
+    return Job(
+        id=job_id,
+        kind=kind,
+        payload=json.loads(payload),
+        user_id=user_id,
+        status=status,
+        progress=json.loads(progress),
+        result=None if result is None else json.loads(result),
+        error=error,
+        attempts=attempts,
+        created_at=created_at,
+        finished_at=finished_at,
+    )
+
+
+class JobQueue:
+    """SQLite queue of jobs, claimed by consumers under a renewable lease"""
+
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_DB_PATH,
+        retention: float = JOB_RETENTION_SECONDS,
+        visibility_timeout: float = JOB_VISIBILITY_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.retention = retention
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Set on every submit, so consumers in this process claim without delay
+        self._submitted = threading.Event()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                dedup_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                user_id TEXT,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                result TEXT,
+                error TEXT,
+                subscribers INTEGER NOT NULL DEFAULT 1,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )""")
+        # One live job per key: identical submissions join it
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS jobs_live ON jobs (dedup_key) "
+            "WHERE finished_at IS NULL AND cancel_requested = 0"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)"
+        )
+
+    def _transaction(self, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def submit(
+        self, kind: str, payload: Dict[str, Any], user_id: Optional[str] = None
+    ) -> Job:
+        """Queue a job and return it, or the unfinished identical job if there is one.
+
+        A joined job keeps the user_id it was submitted with, so its calls
+        count against the first submitter's quota.
+        """
+        key = _dedup_key(kind, payload)
+        now = time.time()
+
+        def submit():
+            self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at < ?", (now - self.retention,)
+            )
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE dedup_key = ? "
+                "AND finished_at IS NULL AND cancel_requested = 0",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET subscribers = subscribers + 1 WHERE id = ?",
+                    (row[0],),
+                )
+                return row[0]
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, dedup_key, payload, user_id, status, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    kind,
+                    key,
+                    json.dumps(payload, ensure_ascii=False),
+                    user_id,
+                    QUEUED,
+                    now,
+                ),
+            )
+            return job_id
+
+        job_id = self._transaction(submit)
+        self._submitted.set()
+        return self.get(job_id)
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        if job_id is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else _job_from_row(row)
+
+    def cancel(self, job_id: Optional[str]):
+        """Drop one interest in a job, cancelling it once nobody waits for it.
+
+        A queued job is cancelled at once; a running one when its consumer
+        next renews the lease, which aborts the upstream call.
+        """
+        if job_id is None:
+            return
+        now = time.time()
+
+        def cancel():
+            row = self._conn.execute(
+                "SELECT kind, status, subscribers FROM jobs "
+                "WHERE id = ? AND finished_at IS NULL",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return
+            kind, status, subscribers = row
+            if subscribers > 1:
+                self._conn.execute(
+                    "UPDATE jobs SET subscribers = subscribers - 1 WHERE id = ?",
+                    (job_id,),
+                )
+                return
+            logger.info(f"Cancelling {kind} job {job_id}")
+            if status == QUEUED:
+                self._conn.execute(
+                    "UPDATE jobs SET subscribers = 0, cancel_requested = 1, "
+                    "status = ?, finished_at = ? WHERE id = ?",
+                    (CANCELLED, now, job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET subscribers = 0, cancel_requested = 1 "
+                    "WHERE id = ?",
+                    (job_id,),
+                )
+
+        self._transaction(cancel)
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Lease the oldest queued job to worker, or return None if there is none.
+
+        Jobs whose lease ran out are queued again first, or failed once they
+        have been attempted max_attempts times.
+        """
+        now = time.time()
+
+        def claim():
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, worker = NULL, "
+                "error = 'Abandoned by ' || attempts || ' workers' "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, now, RUNNING, now, self.max_attempts),
+            )
+            expired = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, progress = '{}' "
+                "WHERE status = ? AND lease_until < ?",
+                (QUEUED, RUNNING, now),
+            ).rowcount
+            if expired:
+                logger.warning(f"Requeued {expired} jobs whose worker stopped")
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE status = ? "
+                "ORDER BY created_at LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            job = _job_from_row(row)
+            job.status = RUNNING
+            job.attempts += 1
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, "
+                "attempts = ?, started_at = ? WHERE id = ?",
+                (
+                    RUNNING,
+                    worker,
+                    now + self.visibility_timeout,
+                    job.attempts,
+                    now,
+                    job.id,
+                ),
+            )
+            return job
+
+        return self._transaction(claim)
+
+    def wait_for_jobs(self, timeout: float):
+        """Sleep up to timeout, waking early when this process submits a job"""
+        if self._submitted.wait(timeout):
+            self._submitted.clear()
+
+    def heartbeat(self, worker: str, progress: Dict[str, Dict[str, Any]]) -> Set[str]:
+        """Write back progress, renew worker's leases and return its cancelled job IDs"""
+        now = time.time()
+
+        def heartbeat():
+            for job_id, values in progress.items():
+                self._conn.execute(
+                    "UPDATE jobs SET progress = ? WHERE id = ? AND worker = ?",
+                    (json.dumps(values, ensure_ascii=False), job_id, worker),
+                )
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = ?",
+                (now + self.visibility_timeout, worker, RUNNING),
+            )
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE worker = ? AND status = ? "
+                "AND cancel_requested = 1",
+                (worker, RUNNING),
+            ).fetchall()
+            return {row[0] for row in rows}
+
+        return self._transaction(heartbeat)
+
+    def finish(
+        self,
+        job_id: str,
+        worker: str,
+        status: str,
+        result: Any = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Record a job's outcome; False if worker lost its lease in the meantime"""
+        with self._lock:
+            return (
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, "
+                    "finished_at = ?, worker = NULL WHERE id = ? AND worker = ?",
+                    (
+                        status,
+                        None if result is None else json.dumps(result),
+                        error,
+                        time.time(),
+                        job_id,
+                        worker,
+                    ),
+                ).rowcount
+                > 0
+            )
+
+    def release(self, worker: str):
+        """Queue worker's running jobs again at once, e.g. when it shuts down"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, progress = '{}', "
+                "attempts = attempts - 1 WHERE worker = ? AND status = ?",
+                (QUEUED, worker, RUNNING),
+            )
+
+    def stats(self) -> Dict[str, float]:
+        """Return the number of retained jobs in each status and queue health figures.
+
+        queue_age is how long the oldest queued job has waited, retried the
+        jobs run again after their worker stopped, and workers the consumers
+        holding a lease.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+            oldest, retried, workers = self._conn.execute(
+                "SELECT MIN(CASE WHEN status = ? THEN created_at END), "
+                "COUNT(CASE WHEN attempts > 1 THEN 1 END), "
+                "COUNT(DISTINCT CASE WHEN status = ? THEN worker END) FROM jobs",
+                (QUEUED, RUNNING),
+            ).fetchone()
+        counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED}
+        counts.update(rows)
+        counts["queue_age"] = 0.0 if oldest is None else time.time() - oldest
+        counts["retried"] = retried
+        counts["workers"] = workers
+        return counts
+
+
+class JobConsumer:
+    """Claims jobs from the queue and runs each with the handler for its kind.
+
+    Handlers take the Job, publish progress on it and return a JSON value.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handlers: Dict[str, Callable[[Job], Any]],
+        threads: int = JOB_WORKERS,
+    ):
+        self.queue = queue
+        self.handlers = handlers
+        self.worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running: Dict[str, Job] = {}
+        self._flushed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max(1, threads))
+        self._stopped = threading.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, threads), thread_name_prefix="job"
+        )
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for target, name in ((self._dispatch, "dispatch"), (self._heartbeat, "beat")):
+            thread = threading.Thread(target=target, name=f"job-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job consumer {self.worker} started")
+
+    def stop(self):
+        """Stop claiming and hand the running jobs back to the queue"""
+        self._stopped.set()
+        self.queue.release(self.worker)
+        with self._lock:
+            running = list(self._running.values())
+        for job in running:
+            job.cancel_token.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _dispatch(self):
+        while not self._stopped.is_set():
+            self._slots.acquire()
+            job = None
+            while job is None and not self._stopped.is_set():
+                try:
+                    job = self.queue.claim(self.worker)
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not claim a job: {e}")
+                if job is None:
+                    self.queue.wait_for_jobs(JOB_CLAIM_INTERVAL)
+            if job is None:
+                return
+            with self._lock:
+                self._running[job.id] = job
+                self._flushed[job.id] = job.version
+            self._executor.submit(self._run, job)
+
+    def _run(self, job: Job):
+        result = error = None
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise ValueError(f"No handler for {job.kind} jobs")
+            result = handler(job)
+        except RequestCancelled:
+            status = CANCELLED
+        except Exception as e:
+            logger.error(f"{job.kind} job {job.id} failed: {e}")
+            status, error = FAILED, str(e)
+        else:
+            # Work that raced past its cancellation still counts as done
+            status = DONE
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+                self._flushed.pop(job.id, None)
+            self._slots.release()
+        try:
+            finished = self.queue.finish(job.id, self.worker, status, result, error)
+            if not finished and not self._stopped.is_set():
+                logger.warning(f"{job.kind} job {job.id} was taken over meanwhile")
+        except sqlite3.Error as e:
+            logger.error(f"Could not record {job.kind} job {job.id}: {e}")
+
+    def _heartbeat(self):
+        while not self._stopped.wait(JOB_HEARTBEAT_INTERVAL):
+            with self._lock:
+                if not self._running:
+                    continue
+                running = dict(self._running)
+                # Versions first: progress published meanwhile is written next time
+                versions = {
+                    job_id: job.version
+                    for job_id, job in running.items()
+                    if job.version != self._flushed[job_id]
+                }
+                progress = {job_id: running[job_id].progress for job_id in versions}
+            try:
+                cancelled = self.queue.heartbeat(self.worker, progress)
+            except sqlite3.Error as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+                continue
+            with self._lock:
+                for job_id, version in versions.items():
+                    if job_id in self._flushed:
+                        self._flushed[job_id] = version
+            for job_id in cancelled & running.keys():
+                running[job_id].cancel_token.cancel()
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, opening it on first use"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
@@ -0,0 +1,184 @@
+import json
+from typing import Any, Dict, Set, Tuple
+
+# strict=False tolerates raw newlines inside strings, which models often emit
+_decoder = json.JSONDecoder(strict=False)
+_WHITESPACE = " \t\n\r"
+
+
+def _skip_whitespace(text: str, idx: int) -> int:
+    while idx < len(text) and text[idx] in _WHITESPACE:
+        idx += 1
+    return idx
+
+
+def _decode_partial_string(text: str, idx: int) -> str:
+    """Decode an unterminated JSON string starting at the opening quote"""
+    body = text[idx + 1 :]
+    # Drop a trailing, half-received escape sequence before decoding
+    for cut in range(0, 7):
+        candidate = body[: len(body) - cut] if cut else body
+        try:
+            return _decoder.decode(f'"{candidate}"')
+        except json.JSONDecodeError:
+            continue
+    return ""
+
+
+def _parse_fields(
+    text: str, idx: int, fields: Dict[str, Any], complete: Set[str]
+) -> int:
+    """Parse top-level fields from idx on; return the offset after the last complete one"""
+    resume = idx
+    while True:
+        idx = _skip_whitespace(text, idx)
+        if idx >= len(text) or text[idx] != '"':
+            return resume
+        try:
+            key, idx = json.decoder.scanstring(text, idx + 1, False)
+        except json.JSONDecodeError:
+            return resume
+
+        idx = _skip_whitespace(text, idx)
+        if idx >= len(text) or text[idx] != ":":
+            return resume
+        idx = _skip_whitespace(text, idx + 1)
+        if idx >= len(text):
+            return resume
+
+        try:
+            value, end = _decoder.raw_decode(text, idx)
+        except json.JSONDecodeError:
+            if text[idx] == '"':
+                fields[key] = _decode_partial_string(text, idx)
+            return resume
+
+        # A value only counts as complete once its terminator has arrived
+        end = _skip_whitespace(text, end)
+        fields[key] = value
+        if end >= len(text):
+            return resume
+        complete.add(key)
+        if text[end] != ",":
+            return resume
+        idx = resume = end + 1
+
+
+class PartialJsonParser:
+    """parse_partial_json for text that grows as a stream arrives.
+
+    Complete fields are kept with the offset after them, so each call only
+    parses the fields after the last complete one instead of the whole text.
+    Text that doesn't extend the previous call's, e.g. from a retried
+    request, starts over.
+    """
+
+    def __init__(self):
+        self._prefix = ""
+        self._fields: Dict[str, Any] = {}
+        self._complete: Set[str] = set()
+
+    def feed(self, text: str) -> Tuple[Dict[str, Any], Set[str]]:
+        """Return the fields decoded so far and the keys whose values are complete"""
+        if not self._prefix or not text.startswith(self._prefix):
+            start = text.find("{")
+            if start == -1:
+                return {}, set()
+            self._prefix = text[: start + 1]
+            self._fields = {}
+            self._complete = set()
+
+        fields = dict(self._fields)
+        complete = set(self._complete)
+        resume = _parse_fields(text, len(self._prefix), fields, complete)
+        if resume > len(self._prefix):
+            self._prefix = text[:resume]
+            self._fields = {key: fields[key] for key in complete}
+            self._complete = set(complete)
+        return fields, complete
+
+
+def parse_partial_json(text: str) -> Tuple[Dict[str, Any], Set[str]]:
+    """Parse the top-level fields of a JSON object that may still be arriving.
+
+    Returns the fields decoded so far and the set of keys whose values are
+    complete. A string value that is still being written is included in the
+    fields truncated to what has arrived, but not marked complete.
+    """
+    return PartialJsonParser().feed(text)
+
+
+def repair_json(text: str) -> str:
+    """Salvage a JSON object from a fenced, prose-wrapped or truncated response.
+
+    Drops anything around the outermost object and, if the object was cut
+    off, closes the open string value, arrays and objects; a field cut off
+    before its value has begun is dropped. Returns normalized JSON text;
+    callers still validate it.
+    """
+    start = text.find("{")
+    if start == -1:
+        return text.strip()
+    text = text[start:]
+
+    # Complete object followed by a closing fence or trailing prose
+    try:
+        value, _ = _decoder.raw_decode(text)
+        return json.dumps(value, ensure_ascii=False)
+    except json.JSONDecodeError:
+        pass
+
+    # Closers of the open objects and arrays
+    stack = []
+    in_string = False
+    escaped = False
+    string_start = 0
+    is_key = False
+    # The last structural character, which tells a key from a string value
+    last = ""
+    # Length of text, and the open containers, where it last ended in a whole value
+    clean, clean_stack = 0, []
+    for idx, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                if not is_key:
+                    clean, clean_stack = idx + 1, list(stack)
+        elif char == '"':
+            in_string = True
+            string_start = idx
+            is_key = stack[-1:] == ["}"] and last in "{,"
+            last = char
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            last = char
+            clean, clean_stack = idx + 1, list(stack)
+        elif char in "}]" and stack:
+            stack.pop()
+            last = char
+            clean, clean_stack = idx + 1, list(stack)
+        elif char == ",":
+            last = char
+            clean, clean_stack = idx, list(stack)
+        elif char == ":":
+            last = char
+
+    if in_string and not is_key:
+        # Cut off inside a string value: keep what arrived of it
+        value = json.dumps(_decode_partial_string(text, string_start))
+        repaired = text[:string_start] + value + "".join(reversed(stack))
+    else:
+        # Cut off in a key, after one or inside a number or literal: drop that
+        # field or list item rather than guess its value
+        repaired = text[:clean] + "".join(reversed(clean_stack))
+
+    try:
+        return json.dumps(_decoder.decode(repaired), ensure_ascii=False)
+    except json.JSONDecodeError:
+        # e.g. stray closers: keep only the top-level fields that parsed
+        fields, _ = parse_partial_json(text)
+        return json.dumps(fields, ensure_ascii=False)
@@ -0,0 +1,260 @@
+"""Load test of the Streamlit app with many concurrent sessions.
+
+Drives app.py through main -> persona -> results with Streamlit's AppTest,
+one simulated session per thread, against fake_claude.py. For each
+concurrency level it reports per-page render time, end-to-end latency
+percentiles, st.session_state size per session and process RSS growth.
+
+Usage:
+    python loadtest.py [--sessions 1,5,10,20] [--article] [--json loadtest.json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from fake_claude import FakeSettings, running_fake_server
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PAGES = ("main", "persona", "results", "article")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def rss_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is KiB on Linux and bytes on macOS; close enough for a trend
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def session_state_bytes(at) -> int:
+    """Approximate st.session_state size as its pickled length"""
+    total = 0
+    state = at.session_state
+    # AppTest's session state only has items() on newer Streamlit releases
+    items = state.items() if hasattr(state, "items") else state.filtered_state.items()
+    for key, value in items:
+        try:
+            total += len(pickle.dumps((key, value)))
+        except Exception:
+            pass
+    return total
+
+
+def share_server_state():
+    """Let AppTest sessions run concurrently in one process.
+
+    AppTest gives every run its own mock Runtime, clears it when the run
+    ends, and compiles the script per session. Concurrent sessions then
+    break each other, and parallel compiles hit a CPython 3.11 AST race. A
+    real server has one Runtime and one script cache for all sessions, so
+    share both here too.
+    """
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+        if "runtime" not in last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last["runtime"]
+
+    def exists(cls):
+        return cls._instance is not None or "runtime" in last
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    shared_cache = ScriptCache()
+
+    def init_script_cache(self):
+        self._cache = shared_cache._cache
+        self._lock = shared_cache._lock
+
+    ScriptCache.__init__ = init_script_cache
+
+
+def find_button(at, label_prefix: str):
+    for button in at.button:
+        if button.label.startswith(label_prefix):
+            return button
+    raise LookupError(f"No {label_prefix!r} button on the page")
+
+
+def run_session(
+    session_id: str, persona_key: str, article: bool, timeout: float
+) -> Dict[str, Any]:
+    """Walk one session through the app, timing every page render"""
+    from streamlit.testing.v1 import AppTest
+
+    from config import JOB_POLL_INTERVAL
+
+    timings: Dict[str, float] = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    started = time.perf_counter()
+
+    def timed_run(page: str, action):
+        page_started = time.perf_counter()
+        action().run()
+        # AppTest doesn't run fragments on a timer, so poll like the browser
+        while at.session_state["polling_jobs"] and not at.exception:
+            time.sleep(JOB_POLL_INTERVAL)
+            at.run()
+        timings[page] = time.perf_counter() - page_started
+        if at.exception:
+            raise RuntimeError(f"{page} page failed: {at.exception[0].value}")
+
+    try:
+        timed_run("main", lambda: at)
+        at.text_area[0].input(
+            f"Session {session_id}: our town is running out of water this summer"
+        )
+        timed_run("persona", lambda: find_button(at, "Next").click())
+        at.button(key=f"persona_{persona_key}").click().run()
+        timed_run("results", lambda: find_button(at, "Generate Content").click())
+        if article:
+            timed_run("article", lambda: find_button(at, "✍️").click())
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+
+    return {
+        "timings": timings,
+        "latency": time.perf_counter() - started,
+        "session_state_bytes": session_state_bytes(at),
+        "error": error,
+    }
+
+
+def run_level(
+    sessions: int, persona_keys: List[str], article: bool, timeout: float
+) -> Dict[str, Any]:
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as ex:
+        futures = [
+            ex.submit(
+                run_session,
+                # Unique per level so no level is served from an earlier one's cache
+                f"{sessions}.{i}",
+                persona_keys[i % len(persona_keys)],
+                article,
+                timeout,
+            )
+            for i in range(sessions)
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if r["error"] is None]
+    latencies = [r["latency"] for r in ok]
+    report = {
+        "sessions": sessions,
+        "errors": len(results) - len(ok),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "sessions_per_s": round(len(ok) / elapsed, 2),
+        "session_state_kb": round(
+            sum(r["session_state_bytes"] for r in results) / len(results) / 1024, 1
+        ),
+        "rss_mb": round(rss_bytes() / 2**20, 1),
+        "rss_growth_mb": round((rss_bytes() - rss_before) / 2**20, 1),
+        "first_error": next((r["error"] for r in results if r["error"]), None),
+    }
+    for page in PAGES:
+        page_times = [r["timings"][page] for r in ok if page in r["timings"]]
+        if page_times:
+            report[f"{page}_p50_s"] = round(percentile(page_times, 50), 3)
+            report[f"{page}_p95_s"] = round(percentile(page_times, 95), 3)
+    return report
+
+
+def print_table(reports: List[Dict[str, Any]]):
+    columns = [c for c in reports[0] if c != "first_error"]
+    print(" | ".join(f"{c:>16}" for c in columns))
+    for report in reports:
+        print(" | ".join(f"{str(report.get(c, '')):>16}" for c in columns))
+    for report in reports:
+        if report["first_error"]:
+            print(
+                f"{report['sessions']} sessions, first error: {report['first_error']}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Concurrent Streamlit session load test"
+    )
+    parser.add_argument(
+        "--sessions", default="1,5,10,20", help="Comma-separated concurrency levels"
+    )
+    parser.add_argument(
+        "--article", action="store_true", help="Also write the sample article"
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--latency-median", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--base-url", help="Use a running fake_claude.py instead of starting one"
+    )
+    args = parser.parse_args(argv)
+    levels = [int(level) for level in args.sessions.split(",") if level.strip()]
+
+    # Every session must miss the cache, so results go to throwaway databases
+    state_dir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ["CACHE_DB_PATH"] = os.path.join(state_dir, "results.db")
+    os.environ["ARCHIVE_DB_PATH"] = os.path.join(state_dir, "archive.db")
+    os.environ.setdefault("CLAUDE_API_KEY", "fake-key")
+
+    settings = FakeSettings(
+        latency_median=args.latency_median,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        seed=1234,
+    )
+    with running_fake_server(settings) as fake_url:
+        # Read by config on first import, which happens inside the first session
+        os.environ["CLAUDE_BASE_URL"] = args.base_url or fake_url
+        from config import AVAILABLE_PERSONAS
+
+        # Configured before app.py is imported so its own logging setup is a no-op
+        logging.basicConfig(level=logging.WARNING)
+        share_server_state()
+        persona_keys = list(AVAILABLE_PERSONAS)
+        reports = [
+            run_level(level, persona_keys, args.article, args.timeout)
+            for level in levels
+        ]
+
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,37 @@ class MessageInput(BaseModel):
     selected_personas: List[str]
 
 class GeneratedContent(BaseModel):
-    tone: str
-    keywords: List[str]
-    feedback: str
-    related_news: List[str]
+    tone: str = Field(..., description="Appropriate tone for this audience")
+    keywords: List[str] = Field(
+        ..., description="Key phrases and keywords that will resonate"
+    )
+    feedback: str = Field(..., description="Specific feedback on message effectiveness")
+    related_news: List[str] = Field(
+        ..., description="Types of news stories that would interest this audience"
+    )
+    # Generated on demand by a separate call, so absent until requested
+    article: Optional[str] = Field(
+        None, description="A sample article tailored to this audience"
+    )
+    # Set on the fallback built from the persona when Claude is too slow
+    degraded: bool = Field(False, description="Generic content built without Claude")
+    # Set when Claude stopped at max_tokens; shown, but never cached
+    truncated: bool = Field(False, description="Cut off at the output token limit")
+    generated_at: datetime = Field(default_factory=datetime.now)
+
+class GeneratedArticle(BaseModel):
     article: str
+    truncated: bool = Field(False, description="Cut off at the output token limit")
     generated_at: datetime = Field(default_factory=datetime.now)
 
+class ArchivedContent(BaseModel):
+    message: str
+    persona: str
+    content: GeneratedContent
+    archived_at: float
+    # Best matching passage with the search terms in **bold**
+    snippet: str = ""
+
 # Fixed: Made ProcessingError inherit from Exception
 class ProcessingError(Exception):
     def __init__(self, error_type: str, message: str):
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Type, TypeVar
+
+from config import (
+    CACHE_TTL,
+    CACHE_DB_PATH,
+    CACHE_MAX_ENTRIES,
+    CLAUDE_ANALYSIS_MODEL,
+    CLAUDE_ARTICLE_MODEL,
+    PROMPT_VERSION,
+)
+from pydantic import BaseModel
+from models import GeneratedContent
+from telemetry import CACHE_LOOKUPS, CACHE_OPERATION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+CachedModel = TypeVar("CachedModel", bound=BaseModel)
+
+
+def make_cache_key(
+    message: str,
+    persona: str,
+    prompt_version: str = PROMPT_VERSION,
+    model: str = CLAUDE_ANALYSIS_MODEL,
+    kind: str = "analysis",
+) -> str:
+    """Hash the full message, persona, prompt version, model and kind into a key"""
+    payload = json.dumps(
+        [message, persona, prompt_version, model, kind], ensure_ascii=False
+    ).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def make_article_cache_key(
+    message: str, persona: str, analysis: GeneratedContent
+) -> str:
+    """Cache key of the sample article written from the analysis.
+
+    The article prompt includes the analysis's tone and keywords, so a hash
+    of them is part of the key: a refined analysis gets a fresh article.
+    """
+    guidance = json.dumps([analysis.tone, analysis.keywords], ensure_ascii=False)
+    guidance_hash = hashlib.sha256(guidance.encode("utf-8")).hexdigest()[:16]
+    return make_cache_key(
+        message, persona, model=CLAUDE_ARTICLE_MODEL, kind=f"article:{guidance_hash}"
+    )
+
+
+class ResultCache:
+    """SQLite-backed result cache shared by every session in the process"""
+
+    def __init__(
+        self,
+        path: str = CACHE_DB_PATH,
+        ttl: int = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)"
+        )
+
+    def get(
+        self, key: str, model: Type[CachedModel] = GeneratedContent
+    ) -> Optional[CachedModel]:
+        """Return the cached content for a key, or None if missing or expired"""
+        now = time.time()
+        with CACHE_OPERATION_SECONDS.time(operation="get"), self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.misses += 1
+                CACHE_LOOKUPS.inc(entry=model.__name__, result="miss")
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            CACHE_LOOKUPS.inc(entry=model.__name__, result="hit")
+        try:
+            return model.model_validate_json(row[0])
+        except ValueError as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self.delete(key)
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Return whether an unexpired entry exists, without counting a lookup"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM results WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row is not None
+
+    def set(self, key: str, content: BaseModel):
+        """Store content under a key and evict least recently used entries"""
+        now = time.time()
+        with CACHE_OPERATION_SECONDS.time(operation="set"), self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, content, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, content.model_dump_json(), now, now),
+            )
+            self._evict()
+
+    def delete(self, key: str):
+        """Remove a single entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+
+    def _evict(self):
+        self._conn.execute(
+            "DELETE FROM results WHERE created_at <= ?", (time.time() - self.ttl,)
+        )
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and the current entry count"""
+        with self._lock:
+            (size,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": size,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Return the process-wide result cache, opening it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
@@ -0,0 +1,533 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import (
+    CLAUDE_REQUESTS_PER_MINUTE,
+    CLAUDE_TOKENS_PER_MINUTE,
+    CLAUDE_MAX_IN_FLIGHT,
+    CLAUDE_MAX_RETRIES,
+    CLAUDE_RETRY_BASE_DELAY,
+    CLAUDE_RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    RATE_LIMIT_DB_PATH,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lower values are served first: UI requests jump ahead of queued batch work.
+# Speculative calls (cache warming) go last and give way to anything waiting.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITY_SPECULATIVE = 20
+
+# Seconds a call waiting for the shared rate limits keeps the speculative
+# calls of every process from starting
+CONTENTION_WINDOW = 1.0
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an upstream error is worth retrying and counts against the breaker.
+
+    Rate limits, timeouts, connection failures and every 5xx, including 529
+    overloaded, which the SDK raises as a plain APIStatusError.
+    """
+    import anthropic
+
+    if isinstance(
+        error,
+        (
+            anthropic.RateLimitError,
+            anthropic.APITimeoutError,
+            anthropic.APIConnectionError,
+        ),
+    ):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+
+class RequestCancelled(BaseException):
+    """Raised when a call is abandoned through its CancelToken.
+
+    Like KeyboardInterrupt it is not an Exception, so generic error handling
+    doesn't report it as a failed generation and single-flight followers
+    retry instead of inheriting it.
+    """
+
+
+class CancelToken:
+    """Cancellation signal shared by a job and the upstream calls made for it"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Signal cancellation and run every registered callback once"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback failed: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run callback on cancellation (now if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds, returning True early if cancelled"""
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled()
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(
+        self,
+        per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is available now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimits:
+    """Request and token buckets of the upstream rate limits, in this process"""
+
+    def __init__(
+        self,
+        requests_per_minute: float = CLAUDE_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = CLAUDE_TOKENS_PER_MINUTE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.requests = TokenBucket(requests_per_minute, clock=clock)
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock)
+
+    def take(self, tokens: int) -> float:
+        """Spend one request and tokens if both are available, else return the seconds to wait"""
+        wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if wait == 0:
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+        return wait
+
+    def mark_contended(self):
+        """Note that a call is waiting for the limits, for other processes to see"""
+
+    def contended(self) -> bool:
+        """Whether a call of another process is waiting for the limits"""
+        return False
+
+
+class SharedRateLimits(RateLimits):
+    """Rate limits in SQLite, shared by every process using the file.
+
+    Both buckets are refilled and spent in one transaction, so the app,
+    its worker processes and other replicas on the host together stay
+    within the account's limits instead of each assuming all of them.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = CLAUDE_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = CLAUDE_TOKENS_PER_MINUTE,
+        path: str = RATE_LIMIT_DB_PATH,
+    ):
+        # Wall clock time, which unlike the monotonic clock is the same in every process
+        super().__init__(requests_per_minute, tokens_per_minute, clock=time.time)
+        self.path = path
+        self._marked = 0.0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # One row per bucket, plus "contended" whose updated is the last wait
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS rate_limits (
+                name TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated REAL NOT NULL
+            )""")
+
+    def take(self, tokens: int) -> float:
+        buckets = {"requests": self.requests, "tokens": self.tokens}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name, bucket in buckets.items():
+                    row = self._conn.execute(
+                        "SELECT level, updated FROM rate_limits WHERE name = ?",
+                        (name,),
+                    ).fetchone()
+                    if row is None:
+                        row = (bucket.capacity, time.time())
+                    bucket.tokens, bucket.updated = row
+                wait = super().take(tokens)
+                if wait == 0:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO rate_limits (name, level, updated) "
+                        "VALUES (?, ?, ?)",
+                        [
+                            (name, bucket.tokens, bucket.updated)
+                            for name, bucket in buckets.items()
+                        ],
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def mark_contended(self):
+        now = time.time()
+        # Rewritten at most twice per window however many calls wait
+        if now - self._marked < CONTENTION_WINDOW / 2:
+            return
+        self._marked = now
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, level, updated) "
+                "VALUES ('contended', 0, ?)",
+                (now,),
+            )
+
+    def contended(self) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated FROM rate_limits WHERE name = 'contended'"
+            ).fetchone()
+        return row is not None and time.time() - row[0] < CONTENTION_WINDOW
+
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures, then probe with one call"""
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                # Let a single trial request through
+                self.state = "half_open"
+                self.opened_at = time.monotonic()
+                return True
+            if self.state == "half_open":
+                # Allow another trial if the last one never reported back
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning("Circuit breaker opened after upstream failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read the retry-after header from an API error, if present"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    """Central gate for Claude calls shared by every session in the process.
+
+    Calls wait in a priority queue for a concurrency slot and for room in the
+    request and token buckets; retryable failures are retried with jittered
+    exponential backoff that honors retry-after, and a circuit breaker fails
+    fast while the upstream is unhealthy. Speculative calls with a cancel
+    token are preempted, queued or in flight, as soon as any other call has
+    to wait, here or, with SharedRateLimits, in another process.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = CLAUDE_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = CLAUDE_TOKENS_PER_MINUTE,
+        max_in_flight: int = CLAUDE_MAX_IN_FLIGHT,
+        max_retries: int = CLAUDE_MAX_RETRIES,
+        base_delay: float = CLAUDE_RETRY_BASE_DELAY,
+        max_delay: float = CLAUDE_RETRY_MAX_DELAY,
+        breaker: Optional[CircuitBreaker] = None,
+        limits: Optional[RateLimits] = None,
+    ):
+        self.limits = limits or RateLimits(requests_per_minute, tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.retries = 0
+        self.preempted = 0
+        self._queue = []
+        # Cancel tokens of speculative calls, queued or in flight, by ticket
+        self._preemptible: Dict[tuple, CancelToken] = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+    def _acquire(
+        self,
+        priority: int,
+        estimated_tokens: int,
+        cancel: Optional[CancelToken] = None,
+    ) -> tuple:
+        ticket = (priority, next(self._counter))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            if cancel is not None and priority >= PRIORITY_SPECULATIVE:
+                self._preemptible[ticket] = cancel
+            try:
+                while True:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    wait = None
+                    if self._queue[0] == ticket and self.in_flight < self.max_in_flight:
+                        if ticket in self._preemptible and self.limits.contended():
+                            # Another process has calls waiting for the limits
+                            self._preempt()
+                            continue
+                        wait = self.limits.take(estimated_tokens)
+                        if wait == 0:
+                            break
+                    if priority < PRIORITY_SPECULATIVE:
+                        self._preempt()
+                        if wait:
+                            self.limits.mark_contended()
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._preemptible.pop(ticket, None)
+                raise
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+            self.in_flight += 1
+        return ticket
+
+    def _preempt(self):
+        """Cancel every speculative call so the capacity goes to real traffic"""
+        if not self._preemptible:
+            return
+        tokens = list(self._preemptible.values())
+        self._preemptible.clear()
+        self.preempted += len(tokens)
+        logger.info(f"Preempting {len(tokens)} speculative call(s)")
+        # The condition's lock is reentrant, so callbacks may wake waiters
+        for token in tokens:
+            token.cancel()
+
+    def _release(self, ticket: tuple):
+        with self._cond:
+            self._preemptible.pop(ticket, None)
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter keeps retrying sessions from stampeding in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def run(
+        self,
+        fn: Callable[[], Any],
+        estimated_tokens: int = 0,
+        priority: int = PRIORITY_INTERACTIVE,
+        cancel: Optional[CancelToken] = None,
+    ) -> Any:
+        """Run fn under rate limits, retries and the circuit breaker.
+
+        Once cancel is triggered the call stops waiting for a slot, is not
+        retried and raises RequestCancelled. Aborting fn itself mid-flight
+        is up to fn, e.g. by closing its stream from a cancel callback.
+        """
+        unregister = cancel.on_cancel(self._wake) if cancel is not None else None
+        try:
+            return self._run(fn, estimated_tokens, priority, cancel)
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def _run(
+        self,
+        fn: Callable[[], Any],
+        estimated_tokens: int,
+        priority: int,
+        cancel: Optional[CancelToken],
+    ) -> Any:
+        attempt = 0
+        while True:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    "Claude is temporarily unavailable, please try again shortly"
+                )
+            ticket = self._acquire(priority, estimated_tokens, cancel)
+            try:
+                result = fn()
+            except Exception as e:
+                if cancel is not None and cancel.cancelled:
+                    # The failure is our own abort, not upstream trouble
+                    raise RequestCancelled() from e
+                if not is_retryable(e):
+                    # Client errors say nothing about upstream health
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                self.retries += 1
+                logger.warning(
+                    f"Retryable Claude error ({e.__class__.__name__}), "
+                    f"retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                self._release(ticket)
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                raise RequestCancelled()
+
+    def busy(self) -> bool:
+        """Whether calls are waiting here, or for the shared limits elsewhere"""
+        with self._cond:
+            if self._queue:
+                return True
+        return self.limits.contended()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return retry and preemption counts, calls running and waiting, and the breaker state"""
+        with self._cond:
+            return {
+                "retries": self.retries,
+                "preempted": self.preempted,
+                "in_flight": self.in_flight,
+                "queued": len(self._queue),
+                "circuit": self.breaker.state,
+            }
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def process_limits(share: int = 1) -> RateLimits:
+    """Return the rate limits of a process: shared, or its part of share processes.
+
+    Without RATE_LIMIT_DB_PATH nothing is shared, so each of share
+    processes gets an equal part of the limits.
+    """
+    if RATE_LIMIT_DB_PATH:
+        return SharedRateLimits()
+    return RateLimits(
+        CLAUDE_REQUESTS_PER_MINUTE / share, CLAUDE_TOKENS_PER_MINUTE / share
+    )
+
+
+def get_scheduler() -> RequestScheduler:
+    """Return the process-wide request scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler(limits=process_limits())
+    return _scheduler
@@ -0,0 +1,288 @@
+"""Near-duplicate detection of messages, so trivial edits can reuse a generation.
+
+Messages are normalized (case, accents, punctuation, whitespace), cut into
+overlapping character shingles and summarized by a MinHash signature whose
+agreement estimates the Jaccard similarity of two shingle sets. Bands of the
+signature are indexed in SQLite (locality-sensitive hashing), so a lookup
+only compares the few messages that share a band instead of all of them.
+
+Character shingles barely notice a changed number or an added "not", so a
+candidate must also have the same words, give or take a few typos: numbers
+and negations have to match exactly.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import FrozenSet, List, Optional, Tuple
+
+from config import CACHE_DB_PATH, CACHE_TTL
+
+SHINGLE_SIZE = 4
+NUM_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs at 0.8 similarity share a band 99.9% of the time
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# Fixed seed so signatures stay comparable across processes and restarts
+_rng = random.Random(1729)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+]
+_NON_WORD = re.compile(r"[\W_]+")
+# Words at least this long may differ by one edit and still count as the same
+MIN_TYPO_LENGTH = 4
+# Words that flip a message's meaning, so never mistaken for a typo
+NEGATIONS = frozenset(
+    [
+        "no",
+        "not",
+        "never",
+        "none",
+        "nor",
+        "neither",
+        "nobody",
+        "nothing",
+        "nowhere",
+        "without",
+        "cannot",
+    ]
+)
+
+
+def normalize(message: str) -> str:
+    """Lowercase, strip accents and reduce punctuation and whitespace to single spaces"""
+    text = unicodedata.normalize("NFKD", message)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet[str]:
+    """Return the overlapping character n-grams of text"""
+    if len(text) <= size:
+        return frozenset([text])
+    return frozenset(text[i : i + size] for i in range(len(text) - size + 1))
+
+
+def minhash(message: str) -> List[int]:
+    """Return the MinHash signature of a message's normalized shingles"""
+    hashes = [
+        int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for shingle in shingles(normalize(message))
+    ]
+    return [
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def _within_one_edit(word: str, other: str) -> bool:
+    """Whether one substitution, insertion, deletion or adjacent swap turns word into other"""
+    if abs(len(word) - len(other)) > 1:
+        return False
+    if len(word) == len(other):
+        diffs = [i for i, (a, b) in enumerate(zip(word, other)) if a != b]
+        if len(diffs) <= 1:
+            return True
+        i, j = diffs[0], diffs[-1]
+        return (
+            len(diffs) == 2
+            and j == i + 1
+            and word[i] == other[j]
+            and word[j] == other[i]
+        )
+    shorter, longer = sorted([word, other], key=len)
+    for i, char in enumerate(shorter):
+        if char != longer[i]:
+            return shorter[i:] == longer[i + 1 :]
+    return True
+
+
+def _typo_of(word: str, other: str) -> bool:
+    if min(len(word), len(other)) < MIN_TYPO_LENGTH:
+        return False
+    if word in NEGATIONS or other in NEGATIONS:
+        return False
+    if any(char.isdigit() for char in word + other):
+        return False
+    return _within_one_edit(word, other)
+
+
+def same_words(message: str, other: str) -> bool:
+    """Whether two messages have the same words, allowing one-edit typos.
+
+    Every word must pair up with an identical word or, if both are long
+    enough, a typo of it. Numbers and negations only pair with themselves,
+    so "2030" and "2040" or an added "not" make the messages different.
+    """
+    words = Counter(normalize(message).split())
+    other_words = Counter(normalize(other).split())
+    unmatched = list((words - other_words).elements())
+    other_unmatched = list((other_words - words).elements())
+    if len(unmatched) != len(other_unmatched):
+        return False
+    for word in unmatched:
+        for i, candidate in enumerate(other_unmatched):
+            if _typo_of(word, candidate):
+                del other_unmatched[i]
+                break
+        else:
+            return False
+    return True
+
+
+def similarity(signature: List[int], other: List[int]) -> float:
+    """Estimate the Jaccard similarity of two messages from their signatures"""
+    return sum(a == b for a, b in zip(signature, other)) / len(signature)
+
+
+def _bands(signature: List[int]) -> List[str]:
+    return [
+        hashlib.sha1(
+            json.dumps(signature[i : i + ROWS_PER_BAND]).encode("ascii")
+        ).hexdigest()
+        for i in range(0, NUM_PERMUTATIONS, ROWS_PER_BAND)
+    ]
+
+
+def _message_hash(message: str) -> str:
+    return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+
+class SimilarityIndex:
+    """MinHash index of generated messages per persona, in SQLite next to the result cache.
+
+    Entries expire with the results they point to, after CACHE_TTL seconds.
+    """
+
+    def __init__(self, path: str = CACHE_DB_PATH, ttl: int = CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS similar_messages (
+                message_hash TEXT NOT NULL,
+                persona TEXT NOT NULL,
+                message TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (message_hash, persona)
+            )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS similar_bands (
+                persona TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                message_hash TEXT NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS similar_bands_bucket "
+            "ON similar_bands (persona, band, bucket)"
+        )
+
+    def add(self, message: str, persona: str):
+        """Index a message whose results for persona were just cached"""
+        signature = minhash(message)
+        message_hash = _message_hash(message)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire()
+                self._conn.execute(
+                    "DELETE FROM similar_bands WHERE message_hash = ? AND persona = ?",
+                    (message_hash, persona),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO similar_messages "
+                    "(message_hash, persona, message, signature, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        message_hash,
+                        persona,
+                        message,
+                        json.dumps(signature),
+                        time.time(),
+                    ),
+                )
+                self._conn.executemany(
+                    "INSERT INTO similar_bands (persona, band, bucket, message_hash) "
+                    "VALUES (?, ?, ?, ?)",
+                    [
+                        (persona, band, bucket, message_hash)
+                        for band, bucket in enumerate(_bands(signature))
+                    ],
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def find(
+        self, message: str, persona: str, threshold: float
+    ) -> List[Tuple[str, float]]:
+        """Return other indexed messages for persona at least threshold similar, best first.
+
+        Only messages with the same words, up to typos, count; see same_words.
+        """
+        signature = minhash(message)
+        buckets = list(enumerate(_bands(signature)))
+        condition = " OR ".join(["(b.band = ? AND b.bucket = ?)"] * len(buckets))
+        params = [value for pair in buckets for value in pair]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT m.message, m.signature FROM similar_bands b "
+                "JOIN similar_messages m "
+                "ON m.message_hash = b.message_hash AND m.persona = b.persona "
+                f"WHERE b.persona = ? AND m.created_at > ? AND ({condition})",
+                [persona, time.time() - self.ttl] + params,
+            ).fetchall()
+        matches = []
+        for candidate, candidate_signature in rows:
+            if candidate == message:
+                continue
+            score = similarity(signature, json.loads(candidate_signature))
+            if score >= threshold and same_words(message, candidate):
+                matches.append((candidate, score))
+        return sorted(matches, key=lambda match: match[1], reverse=True)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        self._conn.execute(
+            "DELETE FROM similar_bands WHERE (message_hash, persona) IN ("
+            "SELECT message_hash, persona FROM similar_messages WHERE created_at <= ?)",
+            (cutoff,),
+        )
+        self._conn.execute(
+            "DELETE FROM similar_messages WHERE created_at <= ?", (cutoff,)
+        )
+
+
+_index: Optional[SimilarityIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """Return the process-wide similarity index, opening it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SimilarityIndex()
+    return _index
@@ -0,0 +1,86 @@
+import logging
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one in-flight call.
+
+    The first caller for a key becomes the leader and runs the call; callers
+    arriving while it is in flight wait for the leader's result or error.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+
+    def join(self, key: str) -> Tuple[Future, bool]:
+        """Return the future for key and whether the caller is its leader.
+
+        A leader must publish the outcome with resolve(), even on failure,
+        otherwise followers wait forever.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.calls += 1
+            return future, True
+
+    def resolve(
+        self,
+        key: str,
+        result: Any = None,
+        error: Optional[BaseException] = None,
+    ):
+        """Publish the leader's outcome to every waiting follower"""
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # The leader was interrupted (e.g. its script run was stopped);
+            # followers retry rather than inherit the interruption
+            future.cancel()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn once for all concurrent callers with the same key"""
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as e:
+                    self.resolve(key, error=e)
+                    raise
+                self.resolve(key, result=result)
+                return result
+            try:
+                return future.result()
+            except CancelledError:
+                logger.info(f"In-flight call for {key} was interrupted, retrying")
+
+    def stats(self) -> Dict[str, int]:
+        """Return counters of leader calls, coalesced callers and calls in flight"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+            }
+
+
+# Shared by every session so identical generations run upstream only once
+generation_flight = SingleFlight()
@@ -0,0 +1,157 @@
+"""Cold-start benchmark: import time of each entry point and the first page render.
+
+Every measurement runs in a fresh interpreter with no CLAUDE_API_KEY, the
+way a new container starts. Reports the median time over several runs and
+whether the Anthropic SDK was loaded, and exits with status 1 when a module
+can't be imported without credentials, loads the SDK, or is over its time
+budget, so cold-start regressions are caught in CI.
+
+Usage:
+    python startup_benchmark.py [--runs 5] [--json startup.json] [--no-budgets]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Module to import: budget in milliseconds for the median run. Generous, so
+# only a regression such as the SDK being imported eagerly again trips them
+IMPORT_BUDGETS_MS = {
+    "config": 100,
+    "personas": 100,
+    "models": 400,
+    "generation": 600,
+    "batch": 600,
+    "api": 900,
+    "app": 1200,
+}
+FIRST_RENDER_BUDGET_MS = 2500
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "anthropic": "anthropic" in sys.modules,
+}}))
+"""
+
+RENDER_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app_path!r}, default_timeout=30).run()
+if at.exception:
+    raise SystemExit(at.exception[0].message)
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "anthropic": "anthropic" in sys.modules,
+}}))
+"""
+
+
+def probe_env() -> Dict[str, str]:
+    """Environment of a fresh start: no credentials, state kept in a temp dir"""
+    env = dict(os.environ)
+    # Empty rather than unset, so a local .env can't supply a key either
+    env["CLAUDE_API_KEY"] = ""
+    env["CACHE_DB_PATH"] = os.path.join(
+        tempfile.mkdtemp(prefix="startup-"), "results.db"
+    )
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_probe(code: str, env: Dict[str, str]) -> Dict[str, Any]:
+    process = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tempfile.gettempdir(),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines() or ["no output"]
+        return {"error": error[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def measure(
+    name: str, code: str, runs: int, budget_ms: Optional[float]
+) -> Dict[str, Any]:
+    """Run a probe several times and summarize it against its budget"""
+    env = probe_env()
+    results = [run_probe(code, env) for _ in range(runs)]
+    errors = [result["error"] for result in results if "error" in result]
+    report: Dict[str, Any] = {"target": name, "budget_ms": budget_ms}
+    if errors:
+        report.update(error=errors[0], ok=False)
+        return report
+
+    median_ms = median(result["seconds"] for result in results) * 1000
+    loads_sdk = any(result["anthropic"] for result in results)
+    report.update(
+        median_ms=round(median_ms, 1),
+        min_ms=round(min(result["seconds"] for result in results) * 1000, 1),
+        loads_anthropic=loads_sdk,
+        ok=not loads_sdk and (budget_ms is None or median_ms <= budget_ms),
+    )
+    return report
+
+
+def print_table(reports: List[Dict[str, Any]]):
+    columns = ["target", "median_ms", "min_ms", "budget_ms", "loads_anthropic", "ok"]
+    print(" | ".join(f"{c:>16}" for c in columns))
+    for report in reports:
+        print(" | ".join(f"{str(report.get(c, '')):>16}" for c in columns))
+        if "error" in report:
+            print(f"    {report['target']} failed: {report['error']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start import benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument(
+        "--no-budgets",
+        action="store_true",
+        help="Only report times; still fail on errors or an eager SDK import",
+    )
+    args = parser.parse_args(argv)
+
+    reports = [
+        measure(
+            f"import {module}",
+            IMPORT_PROBE.format(module=module),
+            args.runs,
+            None if args.no_budgets else budget,
+        )
+        for module, budget in IMPORT_BUDGETS_MS.items()
+    ]
+    reports.append(
+        measure(
+            "app first render",
+            RENDER_PROBE.format(app_path=os.path.join(ROOT, "app.py")),
+            max(1, args.runs // 2),
+            None if args.no_budgets else FIRST_RENDER_BUDGET_MS,
+        )
+    )
+
+    print_table(reports)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    return 0 if all(report["ok"] for report in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
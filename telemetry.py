@@ -0,0 +1,406 @@
+"""Process-wide performance metrics, exported in the Prometheus text format.
+
+Metrics are plain in-memory counters and histograms shared by the app, the
+batch CLI and the HTTP API. render_prometheus() also pulls the live
+counters of the result cache, single-flight and scheduler, so those modules
+keep their own bookkeeping.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import LOG_PROMPT_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Sum over every series matching the given labels"""
+        with self._lock:
+            return sum(
+                value
+                for key, value in self._values.items()
+                if all(
+                    key[self.labels.index(name)] == str(v) for name, v in labels.items()
+                )
+            )
+
+    def series(self) -> Dict[LabelValues, float]:
+        """Return a copy of every labelled value"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the with-block, whether or not it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self) -> Dict[LabelValues, Dict[str, float]]:
+        """Return count, mean and bucket-estimated p50/p95 for every series"""
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        result = {}
+        for key, values in series.items():
+            count = sum(values[:-1])
+            result[key] = {
+                "count": count,
+                "mean": values[-1] / count if count else 0.0,
+                "p50": self._quantile(values, 0.5),
+                "p95": self._quantile(values, 0.95),
+            }
+        return result
+
+    def _quantile(self, values: List[float], q: float) -> float:
+        count = sum(values[:-1])
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, values):
+            seen += bucket_count
+            if count and seen >= q * count:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, values in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, values):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                cumulative += values[len(self.buckets)]
+                labels = _format_labels(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                plain = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{plain} {values[-1]}")
+                lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+CLAUDE_REQUEST_SECONDS = Histogram(
+    "claude_request_seconds",
+    "Upstream Messages API latency per attempt",
+    ["model", "mode"],
+)
+CLAUDE_FIRST_TOKEN_SECONDS = Histogram(
+    "claude_time_to_first_token_seconds",
+    "Time from sending a streamed request to its first content delta",
+    ["model"],
+)
+CLAUDE_REQUESTS = Counter(
+    "claude_requests_total",
+    "Upstream Messages API attempts by outcome",
+    ["model", "mode", "outcome"],
+)
+CLAUDE_TOKENS = Counter(
+    "claude_tokens_total",
+    "Tokens billed by type: input, cache_read, cache_write, output",
+    ["model", "type"],
+)
+PARSE_SECONDS = Histogram(
+    "parse_seconds", "Time to validate or repair a response", buckets=FAST_BUCKETS
+)
+PARSE_RESULTS = Counter(
+    "parse_results_total", "Parsed responses by outcome", ["outcome"]
+)
+HEDGED_CALLS = Counter(
+    "claude_hedged_calls_total",
+    "Slow interactive calls: hedged, won by the backup, or past the hard deadline",
+    ["outcome"],
+)
+CACHE_WARMS = Counter(
+    "cache_warms_total",
+    "Speculative generations for popular messages by outcome",
+    ["outcome"],
+)
+GENERATION_SECONDS = Histogram(
+    "generation_seconds",
+    "End-to-end generation time including queueing and retries",
+    ["stage"],
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Result cache lookups by entry type", ["entry", "result"]
+)
+CACHE_OPERATION_SECONDS = Histogram(
+    "cache_operation_seconds",
+    "Result cache read and write time",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+
+METRICS = [
+    CLAUDE_REQUEST_SECONDS,
+    CLAUDE_FIRST_TOKEN_SECONDS,
+    CLAUDE_REQUESTS,
+    CLAUDE_TOKENS,
+    PARSE_SECONDS,
+    PARSE_RESULTS,
+    HEDGED_CALLS,
+    CACHE_WARMS,
+    GENERATION_SECONDS,
+    CACHE_LOOKUPS,
+    CACHE_OPERATION_SECONDS,
+]
+
+
+class RequestTimer:
+    """Times one upstream attempt and, for streams, its first token"""
+
+    def __init__(self, model: str, mode: str):
+        self.model = model
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            CLAUDE_FIRST_TOKEN_SECONDS.observe(
+                self.first_token_at - self.started, model=self.model
+            )
+
+
+@contextmanager
+def track_request(model: str, mode: str) -> Iterator[RequestTimer]:
+    """Record latency and outcome of one upstream call made in the with-block"""
+    timer = RequestTimer(model, mode)
+    try:
+        yield timer
+    except Exception:
+        CLAUDE_REQUESTS.inc(model=model, mode=mode, outcome="error")
+        raise
+    CLAUDE_REQUEST_SECONDS.observe(
+        time.perf_counter() - timer.started, model=model, mode=mode
+    )
+    CLAUDE_REQUESTS.inc(model=model, mode=mode, outcome="ok")
+
+
+def record_tokens(model: str, usage: Dict[str, int]):
+    names = {
+        "input_tokens": "input",
+        "cache_read_input_tokens": "cache_read",
+        "cache_creation_input_tokens": "cache_write",
+        "output_tokens": "output",
+    }
+    for field, value in usage.items():
+        if value:
+            CLAUDE_TOKENS.inc(value, model=model, type=names.get(field, field))
+
+
+def log_prompt(log: logging.Logger, prompt: str):
+    """Log the full prompt for a sampled share of calls (LOG_PROMPT_SAMPLE_RATE)"""
+    if LOG_PROMPT_SAMPLE_RATE > 0 and random.random() < LOG_PROMPT_SAMPLE_RATE:
+        log.info(f"Sampled prompt: {prompt}")
+
+
+def _live_metrics() -> List[str]:
+    """Counters owned by the cache, single-flight, scheduler and job queue"""
+    from jobs import get_job_queue
+    from result_cache import get_result_cache
+    from scheduler import get_scheduler
+    from singleflight import generation_flight
+
+    cache = get_result_cache().stats()
+    flight = generation_flight.stats()
+    scheduler = get_scheduler().stats()
+    queue = get_job_queue().stats()
+    values = [
+        ("result_cache_hits_total", "counter", "Result cache hits", cache["hits"]),
+        (
+            "result_cache_misses_total",
+            "counter",
+            "Result cache misses",
+            cache["misses"],
+        ),
+        (
+            "result_cache_evictions_total",
+            "counter",
+            "Entries evicted by TTL or size",
+            cache["evictions"],
+        ),
+        ("result_cache_entries", "gauge", "Entries in the result cache", cache["size"]),
+        (
+            "generation_calls_total",
+            "counter",
+            "Generations actually run",
+            flight["calls"],
+        ),
+        (
+            "generation_coalesced_total",
+            "counter",
+            "Requests served by an identical generation already in flight",
+            flight["coalesced"],
+        ),
+        (
+            "scheduler_retries_total",
+            "counter",
+            "Upstream retries after retryable errors",
+            scheduler["retries"],
+        ),
+        (
+            "scheduler_preempted_total",
+            "counter",
+            "Speculative calls cancelled to make way for other traffic",
+            scheduler["preempted"],
+        ),
+        (
+            "scheduler_in_flight",
+            "gauge",
+            "Upstream calls running",
+            scheduler["in_flight"],
+        ),
+        ("scheduler_queued", "gauge", "Upstream calls waiting", scheduler["queued"]),
+        (
+            "scheduler_circuit_open",
+            "gauge",
+            "1 while the circuit breaker rejects calls",
+            int(scheduler["circuit"] == "open"),
+        ),
+        ("job_queue_depth", "gauge", "Jobs waiting for a worker", queue["queued"]),
+        ("job_queue_running", "gauge", "Jobs being run", queue["running"]),
+        (
+            "job_queue_oldest_seconds",
+            "gauge",
+            "How long the oldest queued job has waited",
+            round(queue["queue_age"], 3),
+        ),
+        (
+            "job_queue_workers",
+            "gauge",
+            "Consumers, app or worker processes, holding a job lease",
+            queue["workers"],
+        ),
+        (
+            "job_queue_retried",
+            "gauge",
+            "Retained jobs run again after their worker stopped",
+            queue["retried"],
+        ),
+    ]
+    lines = []
+    for name, kind, help_text, value in values:
+        lines += [
+            f"# HELP {name} {help_text}",
+            f"# TYPE {name} {kind}",
+            f"{name} {value}",
+        ]
+    return lines
+
+
+def render_prometheus() -> str:
+    """Return every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    try:
+        lines += _live_metrics()
+    except Exception as e:
+        logger.warning(f"Could not collect live metrics: {e}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics on a background thread; later calls are no-ops"""
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        threading.Thread(
+            target=_server.serve_forever, name="metrics", daemon=True
+        ).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
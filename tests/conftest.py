@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+from contextlib import ExitStack
+
+import anthropic
+import pytest
+
+# The modules live at the repository root and read their paths from the
+# environment on import, so keep every test database out of the checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_STATE_DIR = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(_STATE_DIR, "results.db"))
+os.environ.setdefault("ARCHIVE_DB_PATH", os.path.join(_STATE_DIR, "archive.db"))
+os.environ.setdefault("CLAUDE_API_KEY", "test-key")
+
+from fake_claude import FakeSettings, running_fake_server
+
+
+@pytest.fixture
+def fake_api():
+    """Start the fake Messages API; returns an SDK client for it, without SDK retries"""
+    with ExitStack() as stack:
+
+        def start(**settings) -> anthropic.Anthropic:
+            settings = {"latency_median": 0.0, "tokens_per_second": 1e6, **settings}
+            url = stack.enter_context(running_fake_server(FakeSettings(**settings)))
+            return anthropic.Anthropic(base_url=url, api_key="test-key", max_retries=0)
+
+        yield start
@@ -0,0 +1,146 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import api
+import claude_service
+import token_budget
+from api import GenerationPool, create_app
+from claude_service import ClaudeService
+from scheduler import RateLimits, RequestScheduler
+from token_budget import TokenQuota
+
+
+@pytest.fixture
+def service(fake_api):
+    client = fake_api()
+    service = ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+    service.fake_url = str(client.base_url).rstrip("/")
+    return service
+
+
+def _fake_stats(service) -> dict:
+    return httpx.get(service.fake_url + "/stats").json()
+
+
+def _post(app, path: str, body: dict, **headers):
+    """POST body to the app; returns the status, headers and response text"""
+
+    async def request():
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(path, json=body, headers=headers)
+            return response.status, response.headers, await response.text()
+
+    return asyncio.run(request())
+
+
+def _events(text: str) -> list:
+    """Split a server-sent event stream into (event, data) pairs"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+def test_generate_returns_the_content(service):
+    body = {"content": "Bike lanes on Main Street", "selected_personas": ["student"]}
+    status, _, text = _post(create_app(service), "/v1/generate", body)
+    assert status == 200
+    content = json.loads(text)
+    assert content["tone"] and content["keywords"]
+    assert content["article"].startswith("# Fake article")
+    assert _fake_stats(service)["requests"] == 2
+
+
+def test_generate_rejects_unknown_personas(service):
+    body = {"content": "Bike lanes on Main Street", "selected_personas": ["pirate"]}
+    status, _, text = _post(create_app(service), "/v1/generate", body)
+    assert status == 400
+    assert json.loads(text)["error_type"] == "validation_error"
+    assert _fake_stats(service)["requests"] == 0
+
+
+def test_stream_sends_sections_then_the_content(service):
+    body = {
+        "content": "Library hours are being cut on weekends",
+        "selected_personas": ["student"],
+    }
+    status, headers, text = _post(create_app(service), "/v1/generate/stream", body)
+    assert status == 200
+    assert headers["Content-Type"].startswith("text/event-stream")
+    events = _events(text)
+    names = [event for event, _ in events]
+    assert names[-1] == "done"
+    assert {data["field"] for event, data in events if event == "section"} >= {
+        "tone",
+        "keywords",
+        "feedback",
+    }
+    article = "".join(data["text"] for event, data in events if event == "article")
+    assert article == events[-1][1]["article"]
+
+
+def test_full_queue_is_answered_with_429(service):
+    app = create_app(service, GenerationPool(workers=1, max_pending=0))
+    body = {"content": "New parking fees downtown", "selected_personas": ["student"]}
+    status, headers, text = _post(app, "/v1/generate", body)
+    assert status == 429
+    assert json.loads(text)["error_type"] == "queue_full"
+    assert int(headers["Retry-After"]) > 0
+    assert _fake_stats(service)["requests"] == 0
+
+
+def test_spent_quota_is_answered_with_429(service, tmp_path, monkeypatch):
+    quota = TokenQuota(path=str(tmp_path / "quota.db"), daily_limit=10)
+    monkeypatch.setattr(token_budget, "_quota", quota)
+    monkeypatch.setattr(claude_service, "DAILY_TOKEN_QUOTA", 10)
+    body = {
+        "content": "The school lunch menu changes",
+        "selected_personas": ["student"],
+    }
+    status, headers, text = _post(create_app(service), "/v1/generate", body)
+    assert status == 429
+    assert json.loads(text)["error_type"] == "quota_exceeded"
+    assert int(headers["Retry-After"]) > 0
+    assert _fake_stats(service)["requests"] == 0
+
+
+def test_renamed_user_ids_share_the_callers_quota(service, tmp_path, monkeypatch):
+    quota = TokenQuota(path=str(tmp_path / "quota.db"), daily_limit=100000)
+    monkeypatch.setattr(token_budget, "_quota", quota)
+    monkeypatch.setattr(claude_service, "DAILY_TOKEN_QUOTA", 100000)
+    monkeypatch.setattr(token_budget, "TRUST_CLIENT_USER_ID", False)
+    body = {
+        "content": "Recycling pickup moves to Fridays",
+        "selected_personas": ["student"],
+    }
+    status, _, _ = _post(
+        create_app(service), "/v1/generate", body, **{"X-User-Id": "fresh-quota"}
+    )
+    assert status == 200
+    assert quota.usage("fresh-quota")["used"] == 0
+    assert quota.usage("127.0.0.1")["used"] > 0
+
+
+def test_api_keys_are_required_and_name_the_user(service, tmp_path, monkeypatch):
+    quota = TokenQuota(path=str(tmp_path / "quota.db"), daily_limit=100000)
+    monkeypatch.setattr(token_budget, "_quota", quota)
+    monkeypatch.setattr(claude_service, "DAILY_TOKEN_QUOTA", 100000)
+    monkeypatch.setattr(api, "API_KEYS", {"key1": "alice"})
+    monkeypatch.setattr(token_budget, "API_KEYS", {"key1": "alice"})
+    body = {"content": "Street lights switch to LEDs", "selected_personas": ["student"]}
+    status, _, text = _post(create_app(service), "/v1/generate", body)
+    assert status == 401
+    assert json.loads(text)["error_type"] == "unauthorized"
+    status, _, _ = _post(
+        create_app(service), "/v1/generate", body, Authorization="Bearer key1"
+    )
+    assert status == 200
+    assert quota.usage("alice")["used"] > 0
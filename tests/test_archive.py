@@ -0,0 +1,76 @@
+import pytest
+
+from archive import ContentArchive
+from models import GeneratedContent
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return ContentArchive(path=str(tmp_path / "archive.db"))
+
+
+def _content(keywords, article=None) -> GeneratedContent:
+    return GeneratedContent(
+        tone="Warm and direct",
+        keywords=keywords,
+        feedback="Lead with the savings",
+        related_news=["Town council debates the budget"],
+        article=article,
+    )
+
+
+def test_saved_content_is_found_by_its_terms(archive):
+    content = _content(["solar", "savings"], "# Solar gardens\nBills fall by a third.")
+    archive.save("Community solar gardens cut energy bills", "student", content)
+    [entry] = archive.search("solar garden")
+    assert entry.message == "Community solar gardens cut energy bills"
+    assert entry.persona == "student"
+    assert entry.content == content
+    assert "**" in entry.snippet
+    # Article text, keywords and related news are searched too
+    assert archive.search("third")
+    assert archive.search("savings")
+    assert archive.search("council")
+    assert archive.search("windmill") == []
+
+
+def test_search_filters_by_persona(archive):
+    message = "Bus routes are changing next month"
+    archive.save(message, "student", _content(["bus"]))
+    archive.save(message, "senior", _content(["bus"]))
+    assert {entry.persona for entry in archive.search("bus routes")} == {
+        "student",
+        "senior",
+    }
+    [entry] = archive.search("bus routes", persona="senior")
+    assert entry.persona == "senior"
+    assert archive.search("bus routes", persona="educator") == []
+
+
+def test_query_syntax_is_not_interpreted(archive):
+    archive.save("Water prices rise", "student", _content(["water"]))
+    assert archive.search('water" OR "x') == []
+    assert archive.search("***") == []
+    assert len(archive.search("WATER pri")) == 1
+
+
+def test_saving_again_replaces_but_keeps_the_article(archive):
+    message = "Parks will stay open later"
+    archive.save(message, "student", _content(["lawns"], "# Later park hours"))
+    archive.save(message, "student", _content(["evenings"]))
+    assert archive.search("lawns") == []
+    [entry] = archive.search("evenings")
+    assert entry.content.article == "# Later park hours"
+    assert archive.stats() == {"entries": 1, "articles": 1}
+
+
+def test_similar_articles_leave_out_the_same_message(archive):
+    archive.save(
+        "Solar panels for every school",
+        "student",
+        _content(["solar"], "# Solar schools"),
+    )
+    archive.save("Solar panels on the library", "student", _content(["solar"]))
+    content = _content(["solar"], "# Solar library")
+    similar = archive.similar_articles("Solar panels on the library", content)
+    assert [entry.message for entry in similar] == ["Solar panels for every school"]
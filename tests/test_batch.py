@@ -0,0 +1,95 @@
+import json
+
+import httpx
+import pytest
+
+from batch import ANALYSIS, ARTICLE, load_checkpoint, run_batch
+from claude_service import ClaudeService
+from scheduler import RateLimits, RequestScheduler
+
+
+def _write_lines(path, lines):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def _record(message_id, persona, stage=None, article=None):
+    record = {"id": message_id, "persona": persona, "content": {"article": article}}
+    if stage is not None:
+        record["stage"] = stage
+    return json.dumps(record)
+
+
+def test_checkpoint_counts_only_finished_stages(tmp_path):
+    path = tmp_path / "results.jsonl"
+    _write_lines(
+        path,
+        [
+            _record("m1", "student", ARTICLE, "# Article"),
+            _record("m1", "senior", ANALYSIS),
+            json.dumps({"id": "m2", "persona": "student", "error": "Fake overload"}),
+            # Written before records had a stage
+            _record("m2", "senior", article="# Article"),
+            _record("m3", "student"),
+            '{"id": "m3", "persona": "senior", "cont',
+        ],
+    )
+    assert load_checkpoint(str(path)) == {("m1", "student"), ("m2", "senior")}
+    assert load_checkpoint(str(path), include_article=False) == {
+        ("m1", "student"),
+        ("m1", "senior"),
+        ("m2", "senior"),
+        ("m3", "student"),
+    }
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) == set()
+
+
+@pytest.fixture
+def fake_client(fake_api):
+    return fake_api()
+
+
+def _service(client) -> ClaudeService:
+    return ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+
+
+def _requests(client) -> int:
+    return httpx.get(str(client.base_url).rstrip("/") + "/stats").json()["requests"]
+
+
+def test_resumed_run_redoes_only_unfinished_stages(fake_client, tmp_path):
+    messages = tmp_path / "messages.jsonl"
+    _write_lines(
+        messages,
+        [
+            json.dumps({"id": "m1", "message": "Ice rink opens in December"}),
+            json.dumps({"id": "m2", "message": "Cycle hire comes to the old town"}),
+        ],
+    )
+    output = str(tmp_path / "results.jsonl")
+    personas = ["student", "senior"]
+
+    # An earlier run without articles, then a crash mid-line
+    stats = run_batch(
+        str(messages),
+        output,
+        personas,
+        include_article=False,
+        service=_service(fake_client),
+    )
+    assert stats["succeeded"] == 4
+    assert _requests(fake_client) == 4
+    _write_lines(output, ['{"id": "m1", "persona": "student", "cont'])
+
+    # Every item lacks its article, which is all that is generated again
+    stats = run_batch(str(messages), output, personas, service=_service(fake_client))
+    assert stats == {"skipped": 0, "pending": 4, "succeeded": 4, "failed": 0}
+    assert _requests(fake_client) == 8
+    assert len(load_checkpoint(output)) == 4
+
+    stats = run_batch(str(messages), output, personas, service=_service(fake_client))
+    assert stats == {"skipped": 4, "pending": 0, "succeeded": 0, "failed": 0}
+    assert _requests(fake_client) == 8
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+
+import httpx
+import pytest
+
+from claude_service import ClaudeService
+from models import MessageInput
+from personas import get_persona_data
+from scheduler import (
+    PRIORITY_BATCH,
+    CancelToken,
+    RateLimits,
+    RequestCancelled,
+    RequestScheduler,
+)
+
+ANALYSIS = {
+    "tone": "Warm and direct",
+    "keywords": ["solar", "savings"],
+    "feedback": "Lead with the savings",
+    "related_news": ["Local energy prices"],
+}
+MESSAGE = MessageInput(
+    content="Community solar gardens cut energy bills", selected_personas=[]
+)
+
+
+def test_parse_counters_survive_concurrent_parses():
+    service = ClaudeService(client=object())
+    response = json.dumps(ANALYSIS)
+    threads = [
+        threading.Thread(
+            target=lambda: [service._parse_content(response) for _ in range(500)]
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert service.parses == 8 * 500
+    assert service.parse_repairs == service.parse_failures == 0
+
+
+def test_cancelling_a_whole_message_call_closes_its_stream(fake_api):
+    # About 2s to write the article, cancelled 0.3s in
+    client = fake_api(tokens_per_second=300, article_tokens=400)
+    scheduler = RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0)
+    service = ClaudeService(client=client, scheduler=scheduler)
+    analysis = service._parse_content(json.dumps(ANALYSIS))
+    cancel = CancelToken()
+    threading.Timer(0.3, cancel.cancel).start()
+
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        service.generate_article(
+            MESSAGE,
+            get_persona_data("student"),
+            analysis,
+            priority=PRIORITY_BATCH,
+            cancel=cancel,
+        )
+    assert time.monotonic() - started < 1
+    assert scheduler.stats()["in_flight"] == 0
+    stats = httpx.get(str(client.base_url).rstrip("/") + "/stats").json()
+    deadline = time.monotonic() + 2
+    while not stats["disconnected"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+        stats = httpx.get(str(client.base_url).rstrip("/") + "/stats").json()
+    assert stats["disconnected"] == 1
@@ -0,0 +1,87 @@
+import httpx
+import pytest
+
+from claude_service import ClaudeService
+from deferred import (
+    ANALYSIS,
+    ARTICLE,
+    FAILED,
+    PENDING,
+    SUCCEEDED,
+    DeferredGenerator,
+    DeferredStore,
+    _custom_id,
+)
+from generation import lookup_cached
+from scheduler import RateLimits, RequestScheduler
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DeferredStore(path=str(tmp_path / "deferred.db"))
+
+
+def _generator(client, store) -> DeferredGenerator:
+    service = ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+    return DeferredGenerator(service, store, poll_interval=0.05)
+
+
+def _fake_stats(client) -> dict:
+    return httpx.get(str(client.base_url).rstrip("/") + "/stats").json()
+
+
+def test_submit_records_the_batch_and_skips_submitted_items(fake_api, store):
+    client = fake_api(batch_seconds=5)
+    generator = _generator(client, store)
+    items = [
+        ("Ferry fares rise in spring", "student"),
+        ("Ferry fares rise in spring", "senior"),
+    ]
+    [batch_id] = generator.submit(items)
+    assert store.open_batches() == [batch_id]
+    for message, persona in items:
+        item = store.item(_custom_id(message, persona, ANALYSIS))
+        assert item["status"] == PENDING
+    # Pending items are waited for, not paid for twice
+    assert generator.submit(items) == []
+    assert generator.poll() == 1
+    assert _fake_stats(client)["batch_requests"] == 2
+
+
+def test_poll_collects_ended_batches_into_the_cache(fake_api, store):
+    client = fake_api(batch_seconds=0.2)
+    generator = _generator(client, store)
+    message = "The harbour will close for repairs"
+    generator.submit([(message, "student")])
+    generator.wait(timeout=5)
+    assert store.open_batches() == []
+    assert store.item(_custom_id(message, "student", ANALYSIS))["status"] == SUCCEEDED
+    assert lookup_cached(message, "student").tone
+
+
+def test_a_restarted_run_resumes_its_batches(fake_api, store):
+    client = fake_api(batch_seconds=0.3)
+    message = "Night buses return to the suburbs"
+    _generator(client, store).submit([(message, "student")])
+    # A new process with the same store waits for the batch already submitted
+    results = _generator(client, store).run([(message, "student")], timeout=5)
+    content = results[(message, "student")]
+    assert content.tone and content.article.startswith("# Fake article")
+    stats = _fake_stats(client)
+    assert stats["batches"] == 2
+    assert stats["batch_requests"] == 2
+    assert store.item(_custom_id(message, "student", ARTICLE, content))
+
+
+def test_failed_items_are_reported_and_resubmitted(fake_api, store):
+    client = fake_api(batch_seconds=0.1, error_rate=1.0)
+    generator = _generator(client, store)
+    message = "Sports fields get new floodlights"
+    results = generator.run([(message, "student")], timeout=5)
+    assert isinstance(results[(message, "student")], Exception)
+    assert "Fake overload" in str(results[(message, "student")])
+    assert store.item(_custom_id(message, "student", ANALYSIS))["status"] == FAILED
+    assert len(generator.submit([(message, "student")])) == 1
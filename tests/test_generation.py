@@ -0,0 +1,68 @@
+import httpx
+import pytest
+
+from archive import get_archive
+from claude_service import ClaudeService
+from generation import generate_cached, lookup_cached, refine_cached
+from scheduler import RateLimits, RequestScheduler
+
+
+@pytest.fixture
+def service(fake_api):
+    client = fake_api()
+    service = ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+    service.fake_url = str(client.base_url).rstrip("/")
+    return service
+
+
+def _requests(service) -> int:
+    return httpx.get(service.fake_url + "/stats").json()["requests"]
+
+
+def test_refined_sections_bypass_the_shared_cache(service):
+    message = "Tram service extends to the airport"
+    original = generate_cached(service, message, "student")
+    refined = refine_cached(
+        service, message, "student", "tone", instruction="Make it more formal"
+    )
+    assert refined.tone != original.tone
+    assert refined.keywords == original.keywords
+    assert refined.article == original.article
+    # Other users keep getting the canonical content, without a new call
+    assert lookup_cached(message, "student") == original
+    calls = _requests(service)
+    assert generate_cached(service, message, "student") == original
+    assert _requests(service) == calls
+
+
+def test_refined_articles_are_not_cached_or_archived(service):
+    message = "Public pools lower their entry fees"
+    original = generate_cached(service, message, "student")
+    streamed = []
+    refined = refine_cached(
+        service, message, "student", "article", on_text=streamed.append
+    )
+    assert refined.article != original.article
+    assert streamed and refined.article == streamed[-1].strip()
+    assert lookup_cached(message, "student").article == original.article
+    [archived] = get_archive().search("public pools entry fees", persona="student")
+    assert archived.content.article == original.article
+
+
+def test_refining_needs_cached_content(service):
+    with pytest.raises(ValueError, match="Nothing is cached"):
+        refine_cached(service, "Nobody asked about this yet", "student", "tone")
+    assert _requests(service) == 0
+
+
+def test_given_content_is_refined_without_a_lookup(service):
+    message = "Farmers markets open on Sundays"
+    original = generate_cached(service, message, "student", include_article=False)
+    edited = original.model_copy(update={"feedback": "A user's own edit"})
+    refined = refine_cached(service, message, "student", "tone", content=edited)
+    assert refined.feedback == "A user's own edit"
+    assert refined.tone != original.tone
+    assert lookup_cached(message, "student") == original
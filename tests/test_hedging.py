@@ -0,0 +1,136 @@
+import threading
+import time
+
+import httpx
+import pytest
+
+import claude_service
+import hedging
+from claude_service import ClaudeService
+from hedging import Attempt, DeadlineExceeded, hedged_call
+from models import MessageInput
+from personas import get_persona_data
+from scheduler import CancelToken, RateLimits, RequestCancelled, RequestScheduler
+from telemetry import HEDGED_CALLS
+
+MESSAGE = MessageInput(
+    content="Community solar gardens cut energy bills", selected_personas=[]
+)
+
+
+@pytest.fixture(autouse=True)
+def quick_hedges(monkeypatch):
+    """Hedge after 0.2s and give up after 1s, with no latency history"""
+    monkeypatch.setattr(hedging, "_windows", {})
+    monkeypatch.setattr(hedging, "CLAUDE_HEDGE_DEFAULT_DELAY", 0.2)
+    monkeypatch.setattr(hedging, "CLAUDE_HEDGE_MIN_DELAY", 0.2)
+    monkeypatch.setattr(claude_service, "CLAUDE_HEDGING", True)
+    monkeypatch.setattr(claude_service, "CLAUDE_HARD_DEADLINE", 1.0)
+
+
+def _attempt(output_after: float, result: str):
+    """An attempt that sends at once, outputs after a delay and then returns"""
+
+    def fn(attempt: Attempt) -> str:
+        attempt.sent()
+        if attempt.cancel.wait(output_after):
+            raise RequestCancelled()
+        attempt.first_output()
+        return result
+
+    return fn
+
+
+def test_fast_calls_are_not_hedged():
+    calls = []
+
+    def fn(attempt):
+        calls.append(attempt.model)
+        return _attempt(0.01, "primary")(attempt)
+
+    assert hedged_call(fn, "main", "sync", "backup", deadline=1.0) == "primary"
+    assert calls == ["main"]
+
+
+def test_slow_calls_are_hedged_and_the_first_output_wins():
+    delays = {"main": 0.6, "backup": 0.05}
+    cancelled = []
+
+    def fn(attempt):
+        attempt.cancel.on_cancel(lambda: cancelled.append(attempt.model))
+        return _attempt(delays[attempt.model], attempt.model)(attempt)
+
+    won = HEDGED_CALLS.value(outcome="backup_won")
+    assert hedged_call(fn, "main", "sync", "backup", deadline=1.0) == "backup"
+    assert HEDGED_CALLS.value(outcome="backup_won") == won + 1
+    assert "main" in cancelled
+
+
+def test_calls_without_output_fail_at_the_deadline():
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        hedged_call(_attempt(5, "late"), "main", "sync", "backup", deadline=0.4)
+    assert time.monotonic() - started < 1
+
+
+def test_an_error_waits_for_the_other_attempt():
+    def fn(attempt):
+        if attempt.model == "main":
+            attempt.sent()
+            time.sleep(0.3)
+            raise ValueError("primary failed")
+        return _attempt(0.05, "backup")(attempt)
+
+    assert hedged_call(fn, "main", "sync", "backup", deadline=1.0) == "backup"
+
+
+def test_cancelling_the_call_cancels_its_attempts():
+    cancel = CancelToken()
+    threading.Timer(0.05, cancel.cancel).start()
+    with pytest.raises(RequestCancelled):
+        hedged_call(_attempt(5, "late"), "main", "sync", "backup", 1.0, cancel)
+
+
+def _service(client) -> ClaudeService:
+    return ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+
+
+def _fake_stats(client) -> dict:
+    return httpx.get(str(client.base_url).rstrip("/") + "/stats").json()
+
+
+def test_long_answers_are_timed_from_their_first_token(fake_api):
+    # The first token comes at once but the article takes about 2s, twice the
+    # hard deadline, so a call timed to its end would be hedged and then fail
+    client = fake_api(tokens_per_second=300, article_tokens=400)
+    service = _service(client)
+    hedged = HEDGED_CALLS.value()
+    analysis = service.generate_analysis(MESSAGE, get_persona_data("student"))
+    started = time.monotonic()
+    article = service.generate_article(MESSAGE, get_persona_data("student"), analysis)
+    assert time.monotonic() - started > 1.0
+    assert article.article.startswith("# Fake article")
+    assert HEDGED_CALLS.value() == hedged
+    assert _fake_stats(client)["requests"] == 2
+
+
+def test_slow_first_tokens_are_hedged_upstream(fake_api):
+    client = fake_api(latency_median=0.4, latency_sigma=0.0)
+    service = _service(client)
+    hedged = HEDGED_CALLS.value(outcome="hedged")
+    content = service.generate_analysis(MESSAGE, get_persona_data("student"))
+    assert not content.degraded
+    assert HEDGED_CALLS.value(outcome="hedged") == hedged + 1
+    assert _fake_stats(client)["requests"] == 2
+
+
+def test_no_first_token_by_the_deadline_degrades_the_analysis(fake_api):
+    client = fake_api(latency_median=3.0, latency_sigma=0.0)
+    service = _service(client)
+    started = time.monotonic()
+    content = service.generate_analysis(MESSAGE, get_persona_data("student"))
+    assert content.degraded
+    assert time.monotonic() - started < 2
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from claude_service import ClaudeService
+from jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobConsumer, JobQueue
+from models import MessageInput
+from personas import get_persona_data
+from scheduler import RateLimits, RequestScheduler
+
+PAYLOAD = {"message": "Community solar gardens cut energy bills", "persona": "student"}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(path=str(tmp_path / "jobs.db"), visibility_timeout=30)
+
+
+def _wait_finished(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job.finished:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_identical_submissions_share_a_job(queue):
+    first = queue.submit("analysis", PAYLOAD, user_id="a")
+    assert queue.submit("analysis", dict(PAYLOAD), user_id="b").id == first.id
+    assert queue.submit("article", PAYLOAD).id != first.id
+    # Shared until its last subscriber cancels
+    queue.cancel(first.id)
+    assert queue.get(first.id).status == QUEUED
+    queue.cancel(first.id)
+    assert queue.get(first.id).status == CANCELLED
+    assert queue.submit("analysis", PAYLOAD).id != first.id
+
+
+def test_claim_and_finish(queue):
+    job = queue.submit("analysis", PAYLOAD)
+    claimed = queue.claim("worker")
+    assert (claimed.id, claimed.status, claimed.attempts) == (job.id, RUNNING, 1)
+    assert queue.claim("other") is None
+    assert not queue.finish(job.id, "other", DONE, result={"tone": "Warm"})
+    assert queue.finish(job.id, "worker", DONE, result={"tone": "Warm"})
+    assert queue.get(job.id).result == {"tone": "Warm"}
+
+
+def test_expired_lease_is_claimed_again_until_max_attempts(tmp_path):
+    queue = JobQueue(
+        path=str(tmp_path / "jobs.db"), visibility_timeout=0, max_attempts=2
+    )
+    job = queue.submit("analysis", PAYLOAD)
+    assert queue.claim("first").attempts == 1
+    time.sleep(0.01)
+    assert queue.claim("second").attempts == 2
+    assert queue.stats()["retried"] == 1
+    time.sleep(0.01)
+    assert queue.claim("third") is None
+    assert queue.get(job.id).status == FAILED
+    assert queue.get(job.id).error == "Abandoned by 2 workers"
+
+
+def test_heartbeat_writes_progress_and_reports_cancels(queue):
+    job = queue.submit("analysis", PAYLOAD)
+    queue.claim("worker")
+    assert queue.heartbeat("worker", {job.id: {"tone": "Wa"}}) == set()
+    assert queue.get(job.id).progress == {"tone": "Wa"}
+    queue.cancel(job.id)
+    assert queue.heartbeat("worker", {}) == {job.id}
+
+
+def test_release_requeues_without_counting_an_attempt(queue):
+    job = queue.submit("analysis", PAYLOAD)
+    queue.claim("worker")
+    queue.release("worker")
+    assert queue.get(job.id).status == QUEUED
+    assert queue.claim("other").attempts == 1
+
+
+def test_consumer_runs_generations(queue, fake_api):
+    service = ClaudeService(
+        client=fake_api(),
+        scheduler=RequestScheduler(limits=RateLimits(), max_retries=0),
+    )
+
+    def analysis(job):
+        message = MessageInput(content=job.payload["message"], selected_personas=[])
+        content = service.generate_analysis(
+            message,
+            get_persona_data(job.payload["persona"]),
+            cancel=job.cancel_token,
+        )
+        return content.model_dump(mode="json")
+
+    consumer = JobConsumer(queue, {"analysis": analysis}, threads=2)
+    consumer.start()
+    try:
+        job = _wait_finished(queue, queue.submit("analysis", PAYLOAD).id)
+        unknown = _wait_finished(queue, queue.submit("unknown", PAYLOAD).id)
+    finally:
+        consumer.stop()
+    assert job.status == DONE
+    assert "community" in job.result["feedback"].lower()
+    assert (unknown.status, unknown.error) == (FAILED, "No handler for unknown jobs")
+
+
+def test_cancelling_a_running_job_stops_its_handler(queue):
+    def wait_for_cancel(job):
+        job.cancel_token.wait(10)
+        job.cancel_token.raise_if_cancelled()
+
+    consumer = JobConsumer(queue, {"analysis": wait_for_cancel}, threads=1)
+    consumer.start()
+    try:
+        job = queue.submit("analysis", PAYLOAD)
+        while queue.get(job.id).status != RUNNING:
+            time.sleep(0.05)
+        queue.cancel(job.id)
+        assert _wait_finished(queue, job.id, timeout=5).status == CANCELLED
+    finally:
+        consumer.stop()
@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+import json_utils
+from json_utils import PartialJsonParser, parse_partial_json, repair_json
+from models import GeneratedContent
+
+ANALYSIS = {
+    "tone": "Warm and direct",
+    "keywords": ["solar", "savings"],
+    "feedback": 'Say "we" more often',
+}
+
+
+def test_partial_fields_grow_with_the_text():
+    text = json.dumps(ANALYSIS)
+    previous = {}
+    for end in range(len(text) + 1):
+        fields, complete = parse_partial_json(text[:end])
+        assert complete <= set(fields)
+        for key in complete:
+            assert fields[key] == ANALYSIS[key]
+        for key, value in previous.items():
+            if isinstance(value, str):
+                assert fields[key].startswith(value)
+        previous = fields
+    assert parse_partial_json(text) == (ANALYSIS, set(ANALYSIS))
+
+
+def test_unterminated_string_is_not_complete():
+    fields, complete = parse_partial_json('{"tone": "Warm", "feedback": "Say')
+    assert fields == {"tone": "Warm", "feedback": "Say"}
+    assert complete == {"tone"}
+
+
+def test_half_received_escape_is_dropped():
+    fields, _ = parse_partial_json('{"feedback": "Say \\"we\\u00')
+    assert fields == {"feedback": 'Say "we'}
+
+
+def test_last_value_is_complete_only_once_terminated():
+    assert parse_partial_json('{"tone": "Warm"') == ({"tone": "Warm"}, set())
+    assert parse_partial_json('{"tone": "Warm"}') == ({"tone": "Warm"}, {"tone"})
+
+
+def test_text_before_the_object_is_ignored():
+    assert parse_partial_json('Sure, here it is: {"tone": "Warm",')[1] == {"tone"}
+    assert parse_partial_json("No object yet") == ({}, set())
+
+
+def test_parser_matches_a_full_parse_as_text_grows():
+    text = json.dumps({**ANALYSIS, "related_news": ["Energy \\u00e9 prices"]})
+    parser = PartialJsonParser()
+    for end in range(len(text) + 1):
+        assert parser.feed(text[:end]) == parse_partial_json(text[:end])
+
+
+def test_parser_resumes_after_the_last_complete_field(monkeypatch):
+    parser = PartialJsonParser()
+    parser.feed('{"tone": "Warm", "keywords": ["solar", "sav')
+    decoded = []
+    decode = json_utils._decoder.raw_decode
+    monkeypatch.setattr(
+        json_utils._decoder,
+        "raw_decode",
+        lambda text, idx: decoded.append(idx) or decode(text, idx),
+    )
+    fields, complete = parser.feed('{"tone": "Warm", "keywords": ["solar", "savings"],')
+    assert complete == {"tone", "keywords"}
+    # Only the keywords value is decoded again, not the tone before it
+    assert decoded == [len('{"tone": "Warm", "keywords": ')]
+
+
+def test_parser_starts_over_on_new_text():
+    parser = PartialJsonParser()
+    parser.feed('{"tone": "Warm", "feedback": "Say')
+    assert parser.feed('{"tone": "Urgent",') == ({"tone": "Urgent"}, {"tone"})
+
+
+def test_repair_leaves_valid_json_alone():
+    assert json.loads(repair_json(json.dumps(ANALYSIS))) == ANALYSIS
+
+
+def test_repair_unwraps_fenced_json():
+    fenced = "```json\n" + json.dumps(ANALYSIS, indent=2) + "\n```"
+    assert json.loads(repair_json(fenced)) == ANALYSIS
+
+
+def test_repair_drops_surrounding_prose():
+    wrapped = f"Here is the analysis: {json.dumps(ANALYSIS)} Let me know!"
+    assert json.loads(repair_json(wrapped)) == ANALYSIS
+
+
+@pytest.mark.parametrize(
+    "cut, repaired",
+    [
+        ('{"tone": "Wa', {"tone": "Wa"}),
+        (
+            '{"tone": "Warm", "keywords": ["solar", "sav',
+            {"tone": "Warm", "keywords": ["solar", "sav"]},
+        ),
+        (
+            '{"tone": "Warm", "keywords": ["solar", ',
+            {"tone": "Warm", "keywords": ["solar"]},
+        ),
+        ('{"tone": "Warm", "keywords": [', {"tone": "Warm", "keywords": []}),
+        (
+            '{"tone": "Warm", "feedback": "Say \\u00',
+            {"tone": "Warm", "feedback": "Say "},
+        ),
+        ('{"tone": "Warm", "count": 12', {"tone": "Warm"}),
+        ('{"tone": "Warm", "related_news": ', {"tone": "Warm"}),
+        ('{"tone": "Warm", "related_news"', {"tone": "Warm"}),
+        ('{"tone": "Warm", "rel', {"tone": "Warm"}),
+        ('```json\n{"tone": "Warm", "nested": {"a": ', {"tone": "Warm", "nested": {}}),
+    ],
+)
+def test_repair_closes_truncated_json(cut, repaired):
+    assert json.loads(repair_json(cut)) == repaired
+
+
+def test_repaired_truncation_validates_once_every_field_began():
+    text = json.dumps({**ANALYSIS, "related_news": ["Local energy prices"]})
+    cut = text[: text.index("prices")]
+    content = GeneratedContent.model_validate_json(repair_json(cut))
+    assert content.related_news == ["Local energy "]
@@ -0,0 +1,76 @@
+import pytest
+
+from models import GeneratedArticle, GeneratedContent
+from result_cache import ResultCache, make_article_cache_key, make_cache_key
+
+
+def _content(tone: str = "Warm") -> GeneratedContent:
+    return GeneratedContent(
+        tone=tone,
+        keywords=["solar", "savings"],
+        feedback="Lead with the savings",
+        related_news=["Local energy prices"],
+    )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(path=str(tmp_path / "results.db"), ttl=3600, max_entries=3)
+
+
+def test_set_then_get_round_trips(cache):
+    content = _content()
+    cache.set("key", content)
+    assert cache.get("key") == content
+    assert cache.get("missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+
+def test_entries_load_as_the_model_asked_for(cache):
+    cache.set("article", GeneratedArticle(article="# Title"))
+    assert cache.get("article", model=GeneratedArticle).article == "# Title"
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResultCache(path=str(tmp_path / "results.db"), ttl=0, max_entries=3)
+    cache.set("key", _content())
+    assert not cache.contains("key")
+    assert cache.get("key") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(cache):
+    for key in ("a", "b", "c"):
+        cache.set(key, _content())
+    cache.get("a")
+    cache.set("d", _content())
+    assert [cache.contains(key) for key in "abcd"] == [True, False, True, True]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_contains_does_not_count_a_lookup(cache):
+    cache.set("key", _content())
+    assert cache.contains("key")
+    assert cache.stats()["hits"] == 0
+
+
+def test_unreadable_entries_are_dropped(cache):
+    cache.set("key", GeneratedArticle(article="# Title"))
+    assert cache.get("key", model=GeneratedContent) is None
+    assert not cache.contains("key")
+
+
+def test_keys_separate_messages_personas_and_kinds():
+    keys = {
+        make_cache_key("Save water", "student"),
+        make_cache_key("Save water", "parent"),
+        make_cache_key("Save energy", "student"),
+        make_cache_key("Save water", "student", kind="article"),
+    }
+    assert len(keys) == 4
+
+
+def test_article_keys_follow_the_analysis():
+    warm = make_article_cache_key("Save water", "student", _content("Warm"))
+    assert warm == make_article_cache_key("Save water", "student", _content("Warm"))
+    assert warm != make_article_cache_key("Save water", "student", _content("Urgent"))
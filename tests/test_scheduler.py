@@ -0,0 +1,174 @@
+import threading
+import time
+
+import anthropic
+import pytest
+
+from scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_SPECULATIVE,
+    CancelToken,
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimits,
+    RequestCancelled,
+    RequestScheduler,
+    SharedRateLimits,
+    TokenBucket,
+    is_retryable,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _scheduler(**kwargs) -> RequestScheduler:
+    kwargs.setdefault("limits", RateLimits(6000, 1e6))
+    return RequestScheduler(base_delay=0.01, max_delay=0.05, **kwargs)
+
+
+def _call(client: anthropic.Anthropic):
+    return lambda: client.messages.create(
+        model="fake-model",
+        max_tokens=50,
+        messages=[{"role": "user", "content": "Save water"}],
+    )
+
+
+def test_bucket_refills_at_its_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.now = 0.5
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.now = 1000
+    assert bucket.wait_time(60) == 0
+    # Amounts over the capacity wait only for a full bucket
+    assert bucket.wait_time(500) == 0
+
+
+def test_limits_take_only_when_both_buckets_have_room():
+    clock = FakeClock()
+    limits = RateLimits(2, 100, clock=clock)
+    assert limits.take(60) == 0
+    assert limits.take(60) == pytest.approx(12.0)
+    assert limits.take(40) == 0
+    assert limits.take(0) == pytest.approx(30.0)
+
+
+def test_shared_limits_are_spent_across_instances(tmp_path):
+    path = str(tmp_path / "limits.db")
+    first = SharedRateLimits(2, 1e6, path=path)
+    second = SharedRateLimits(2, 1e6, path=path)
+    assert first.take(10) == 0
+    assert second.take(10) == 0
+    assert first.take(10) > 0
+    assert second.take(10) > 0
+
+    assert not first.contended()
+    second.mark_contended()
+    assert first.contended()
+
+
+def test_retryable_errors_are_retried(fake_api):
+    client = fake_api(error_rate=0.5, retry_after=0.01, seed=3)
+    scheduler = _scheduler(max_retries=10)
+    for _ in range(5):
+        assert scheduler.run(_call(client)).content
+    assert scheduler.stats()["retries"] > 0
+    assert scheduler.stats()["circuit"] == "closed"
+
+
+def test_retries_give_up_and_open_the_circuit(fake_api):
+    client = fake_api(error_rate=1.0, retry_after=0.01, seed=1)
+    scheduler = _scheduler(
+        max_retries=2, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    )
+    with pytest.raises(anthropic.APIStatusError) as raised:
+        scheduler.run(_call(client))
+    assert raised.value.status_code in (429, 529)
+    assert is_retryable(raised.value)
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["circuit"] == "open"
+    with pytest.raises(CircuitOpenError):
+        scheduler.run(_call(client))
+
+
+def test_client_errors_are_not_retried():
+    scheduler = _scheduler(max_retries=3)
+
+    def fail():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.run(fail)
+    assert not is_retryable(ValueError())
+    assert scheduler.stats()["retries"] == 0
+
+
+def test_interactive_calls_are_served_first():
+    scheduler = _scheduler(max_in_flight=1)
+    release = threading.Event()
+    order = []
+    holder = threading.Thread(target=scheduler.run, args=(lambda: release.wait(5),))
+    holder.start()
+    while scheduler.stats()["in_flight"] < 1:
+        time.sleep(0.01)
+
+    waiters = [
+        threading.Thread(
+            target=scheduler.run,
+            args=(lambda p=priority: order.append(p),),
+            kwargs={"priority": priority},
+        )
+        for priority in (PRIORITY_BATCH, PRIORITY_INTERACTIVE)
+    ]
+    for queued, waiter in enumerate(waiters, 1):
+        waiter.start()
+        while scheduler.stats()["queued"] < queued:
+            time.sleep(0.01)
+    release.set()
+    for thread in [holder] + waiters:
+        thread.join(5)
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BATCH]
+
+
+def test_waiting_calls_preempt_speculative_ones():
+    scheduler = _scheduler(max_in_flight=1)
+    cancel = CancelToken()
+    errors = []
+
+    def speculative():
+        cancel.wait(5)
+        cancel.raise_if_cancelled()
+
+    def run_speculative():
+        try:
+            scheduler.run(speculative, priority=PRIORITY_SPECULATIVE, cancel=cancel)
+        except RequestCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run_speculative)
+    thread.start()
+    while scheduler.stats()["in_flight"] < 1:
+        time.sleep(0.01)
+    assert scheduler.run(lambda: "served") == "served"
+    thread.join(5)
+    assert len(errors) == 1
+    assert scheduler.stats()["preempted"] == 1
+
+
+def test_cancelled_calls_stop_waiting():
+    scheduler = _scheduler(max_in_flight=0)
+    cancel = CancelToken()
+    threading.Timer(0.05, cancel.cancel).start()
+    with pytest.raises(RequestCancelled):
+        scheduler.run(lambda: None, cancel=cancel)
+    assert scheduler.stats()["queued"] == 0
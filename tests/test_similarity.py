@@ -0,0 +1,67 @@
+import pytest
+
+from similarity import SimilarityIndex, minhash, same_words, similarity
+
+THRESHOLD = 0.85
+EMISSIONS = (
+    "The city council must cut car emissions in the downtown area to protect "
+    "the health of our children and elderly residents"
+)
+NET_ZERO = (
+    "The city council pledges to reach net zero emissions by 2030 through new "
+    "bus lanes, bike paths and cleaner buildings"
+)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SimilarityIndex(path=str(tmp_path / "similar.db"), ttl=3600)
+
+
+def test_formatting_edits_match(index):
+    index.add(EMISSIONS, "student")
+    edited = EMISSIONS.upper().replace(" ", "  ") + "!"
+    assert index.find(edited, "student", THRESHOLD) == [(EMISSIONS, 1.0)]
+
+
+def test_typo_matches(index):
+    index.add(NET_ZERO, "student")
+    matches = index.find(
+        NET_ZERO.replace("buildings", "buildngs"), "student", THRESHOLD
+    )
+    assert [message for message, _ in matches] == [NET_ZERO]
+
+
+def test_added_negation_does_not_match(index):
+    negated = EMISSIONS.replace("must cut", "must not cut")
+    assert similarity(minhash(EMISSIONS), minhash(negated)) >= THRESHOLD
+    index.add(EMISSIONS, "student")
+    assert index.find(negated, "student", THRESHOLD) == []
+
+
+def test_changed_number_does_not_match(index):
+    later = NET_ZERO.replace("2030", "2040")
+    assert similarity(minhash(NET_ZERO), minhash(later)) >= THRESHOLD
+    index.add(NET_ZERO, "student")
+    assert index.find(later, "student", THRESHOLD) == []
+
+
+def test_other_persona_does_not_match(index):
+    index.add(EMISSIONS, "student")
+    assert index.find(EMISSIONS + ".", "parent", THRESHOLD) == []
+
+
+@pytest.mark.parametrize(
+    "message, other, expected",
+    [
+        ("Water prices are rising", "water prices, are rising!", True),
+        ("Water prices are rising", "Water prcies are rising", True),
+        ("Water prices are rising", "Water prices rising", False),
+        ("Water prices are rising", "Water prices are not rising", False),
+        ("Bus fares go up by 10%", "Bus fares go up by 15%", False),
+        ("We can fix this", "We can mix this", False),
+        ("Taxes will never rise", "Taxes will ever rise", False),
+    ],
+)
+def test_same_words(message, other, expected):
+    assert same_words(message, other) is expected
@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        leader = executor.submit(flight.do, "key", fn)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "key", fn) for _ in range(4)]
+        while flight.stats()["coalesced"] < 4:
+            time.sleep(0.01)
+        release.set()
+        results = [leader.result(5)] + [f.result(5) for f in followers]
+
+    assert results == ["result"] * 5
+    assert calls == [1]
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_followers_get_the_leaders_error():
+    flight = SingleFlight()
+    future, leader = flight.join("key")
+    assert leader
+    follower, leader = flight.join("key")
+    assert follower is future and not leader
+
+    flight.resolve("key", error=ValueError("upstream failed"))
+    with pytest.raises(ValueError, match="upstream failed"):
+        follower.result(1)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_interrupted_leader_makes_followers_retry():
+    flight = SingleFlight()
+    flight.join("key")
+    result = []
+    follower = threading.Thread(
+        target=lambda: result.append(flight.do("key", lambda: "retried"))
+    )
+    follower.start()
+    while flight.stats()["coalesced"] < 1:
+        time.sleep(0.01)
+    flight.resolve("key", error=KeyboardInterrupt())
+    follower.join(5)
+    assert result == ["retried"]
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats() == {"calls": 2, "coalesced": 0, "in_flight": 0}
@@ -0,0 +1,95 @@
+import pytest
+
+import token_budget
+from config import OUTPUT_TOKEN_BUDGETS
+from token_budget import (
+    QuotaExceededError,
+    TokenQuota,
+    api_key_user,
+    estimate_input_tokens,
+    estimate_tokens,
+    forwarded_user,
+    output_budget,
+)
+
+
+@pytest.fixture
+def quota(tmp_path):
+    return TokenQuota(path=str(tmp_path / "quota.db"), daily_limit=1000)
+
+
+def test_estimate_counts_words_numbers_and_symbols():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Save water today") == 3
+    assert estimate_tokens("2030") == 2
+    assert estimate_tokens("internationalization") == 3
+    assert estimate_tokens("cut, now!") == 4
+
+
+def test_estimate_errs_high_on_prose():
+    text = "The city council must cut car emissions in the downtown area. " * 20
+    # 11 common words and a period, which a real tokenizer makes 12 tokens
+    assert estimate_tokens(text) >= 12 * 20
+
+
+def test_input_estimate_includes_system_and_tool():
+    system = [{"type": "text", "text": "You write for students"}]
+    plain = estimate_input_tokens(system, "Save water")
+    assert plain == 10 + estimate_tokens("Save water You write for students")
+    tool = {"name": "analysis", "input_schema": {"type": "object"}}
+    assert estimate_input_tokens(system, "Save water", tool) > plain + 300
+
+
+def test_persona_budget_overrides_the_default():
+    persona = {"output_tokens": {"article": 300}}
+    assert output_budget(persona, "article") == 300
+    assert output_budget({}, "article") == OUTPUT_TOKEN_BUDGETS["article"]
+
+
+def test_reserve_grants_what_is_left(quota):
+    assert quota.reserve("user", 100, 500, 200) == 500
+    # 600 of 1000 reserved: 100 input leaves 300 of the 500 asked for
+    assert quota.reserve("user", 100, 500, 200) == 300
+    assert quota.usage("user") == {"used": 0, "reserved": 1000, "limit": 1000}
+    with pytest.raises(QuotaExceededError):
+        quota.reserve("user", 100, 500, 200)
+    # Other users have their own quota
+    assert quota.reserve("other", 100, 500, 200) == 500
+
+
+def test_record_and_release_settle_a_reservation(quota):
+    granted = quota.reserve("user", 100, 500, 200)
+    quota.record("user", 250)
+    quota.release("user", 100 + granted)
+    assert quota.usage("user") == {"used": 250, "reserved": 0, "limit": 1000}
+    assert quota.reserve("user", 100, 1000, 200) == 650
+
+
+def test_quota_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "quota.db")
+    TokenQuota(path=path, daily_limit=1000).record("user", 900)
+    with pytest.raises(QuotaExceededError):
+        TokenQuota(path=path, daily_limit=1000).reserve("user", 50, 100, 100)
+
+
+def test_client_chosen_user_ids_are_ignored_unless_trusted(monkeypatch):
+    monkeypatch.setattr(token_budget, "TRUSTED_USER_HEADER", "")
+    monkeypatch.setattr(token_budget, "TRUST_CLIENT_USER_ID", False)
+    assert forwarded_user({"X-User-Id": "someone-else"}) is None
+    monkeypatch.setattr(token_budget, "TRUST_CLIENT_USER_ID", True)
+    assert forwarded_user({"X-User-Id": "someone-else"}) == "someone-else"
+
+
+def test_trusted_proxy_header_names_the_user(monkeypatch):
+    monkeypatch.setattr(token_budget, "TRUSTED_USER_HEADER", "X-Forwarded-User")
+    monkeypatch.setattr(token_budget, "TRUST_CLIENT_USER_ID", True)
+    headers = {"X-Forwarded-User": "alice", "X-User-Id": "someone-else"}
+    assert forwarded_user(headers) == "alice"
+
+
+def test_api_keys_name_their_user(monkeypatch):
+    monkeypatch.setattr(token_budget, "API_KEYS", {"key1": "alice"})
+    assert api_key_user({"Authorization": "Bearer key1"}) == "alice"
+    assert api_key_user({"X-API-Key": "key1"}) == "alice"
+    assert api_key_user({"Authorization": "Bearer key2"}) is None
+    assert api_key_user({}) is None
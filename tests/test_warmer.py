@@ -0,0 +1,80 @@
+import time
+
+import httpx
+import pytest
+
+from claude_service import ClaudeService
+from config import AVAILABLE_PERSONAS
+from generation import cache_generated
+from models import GeneratedContent
+from result_cache import get_result_cache, make_cache_key
+from scheduler import RateLimits, RequestScheduler
+from warmer import CacheWarmer, MessagePopularity
+
+
+@pytest.fixture
+def fake_client(fake_api):
+    return fake_api()
+
+
+def _warmer(client, tmp_path, **kwargs) -> CacheWarmer:
+    service = ClaudeService(
+        client=client,
+        scheduler=RequestScheduler(limits=RateLimits(6000, 1e6), max_retries=0),
+    )
+    popularity = MessagePopularity(path=str(tmp_path / "popularity.db"))
+    kwargs.setdefault("tokens_per_minute", 1e6)
+    return CacheWarmer(service, popularity, **kwargs)
+
+
+def _requests(client) -> int:
+    return httpx.get(str(client.base_url).rstrip("/") + "/stats").json()["requests"]
+
+
+def _cached(message: str) -> list:
+    cache = get_result_cache()
+    return [
+        key
+        for key in AVAILABLE_PERSONAS
+        if cache.contains(make_cache_key(message, key))
+    ]
+
+
+def test_warm_fills_the_cache_for_every_persona(fake_client, tmp_path):
+    message = "The river path reopens after the floods"
+    assert _warmer(fake_client, tmp_path).warm(message) == len(AVAILABLE_PERSONAS)
+    assert _cached(message) == list(AVAILABLE_PERSONAS)
+    assert _requests(fake_client) == len(AVAILABLE_PERSONAS)
+
+
+def test_warm_skips_cached_personas(fake_client, tmp_path):
+    message = "A new skate park opens by the station"
+    cached = GeneratedContent(
+        tone="Upbeat", keywords=["skate"], feedback="Name the date", related_news=[]
+    )
+    cache_generated(message, "student", cached)
+    warmer = _warmer(fake_client, tmp_path)
+    assert warmer.warm(message) == len(AVAILABLE_PERSONAS) - 1
+    assert _requests(fake_client) == len(AVAILABLE_PERSONAS) - 1
+    # Warming again finds everything cached and calls nothing
+    assert warmer.warm(message) == 0
+    assert _requests(fake_client) == len(AVAILABLE_PERSONAS) - 1
+
+
+def test_warm_stops_once_its_budget_is_spent(fake_client, tmp_path):
+    # One analysis spends far more than 10 tokens, leaving none for the next
+    warmer = _warmer(fake_client, tmp_path, tokens_per_minute=10)
+    assert warmer.warm("Town hall meetings move online") == 1
+    assert _requests(fake_client) == 1
+
+
+def test_popular_messages_are_warmed_in_the_background(fake_client, tmp_path):
+    message = "Community gardens get free compost"
+    warmer = _warmer(fake_client, tmp_path, min_uses=2)
+    assert not warmer.message_entered(message)
+    assert warmer.message_entered(message)
+    deadline = time.monotonic() + 5
+    while len(_cached(message)) < len(AVAILABLE_PERSONAS):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert warmer.popular() == [(message, 2)]
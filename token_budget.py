@@ -0,0 +1,214 @@
+"""Pre-flight token estimates, per-persona output budgets and daily quotas.
+
+All of this runs before a request goes out. The local estimate sizes the
+scheduler's token-bucket reservation; the persona's budget and the user's
+remaining quota decide max_tokens; and a call that can't fit in the quota
+is refused without touching the network.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Union
+
+from config import (
+    API_KEYS,
+    DAILY_TOKEN_QUOTA,
+    OUTPUT_TOKEN_BUDGETS,
+    QUOTA_DB_PATH,
+    TRUST_CLIENT_USER_ID,
+    TRUSTED_USER_HEADER,
+)
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and single symbols, roughly how the tokenizer splits text
+_PIECES = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+# Fixed cost of the message framing and of forcing a tool call
+MESSAGE_OVERHEAD_TOKENS = 10
+TOOL_OVERHEAD_TOKENS = 300
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of text without calling the API.
+
+    Common words are one token and long words one more per 8 letters;
+    numbers split every 3 digits and other symbols, including non-Latin
+    characters, count one each. This errs slightly high on English prose.
+    """
+    return sum(
+        1 + len(piece) // 8 if piece[0].isalpha() else 1
+        for piece in _PIECES.findall(text)
+    )
+
+
+def estimate_input_tokens(
+    system: List[Dict[str, Any]],
+    prompt: Union[str, List[Dict[str, Any]]],
+    tool: Optional[Dict[str, Any]] = None,
+) -> int:
+    """Estimate the input tokens of a Messages API call.
+
+    prompt is the user's text, or the conversation's messages, whose JSON
+    framing is counted too and keeps the estimate on the high side.
+    """
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, ensure_ascii=False)
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(prompt)
+    tokens += sum(estimate_tokens(block["text"]) for block in system)
+    if tool is not None:
+        tokens += TOOL_OVERHEAD_TOKENS + estimate_tokens(json.dumps(tool))
+    return tokens
+
+
+def output_budget(persona: Dict[str, Any], stage: str) -> int:
+    """Return max_tokens for a generation stage, as budgeted for the persona"""
+    return persona.get("output_tokens", {}).get(stage, OUTPUT_TOKEN_BUDGETS[stage])
+
+
+class QuotaExceededError(Exception):
+    """Raised before the network call when a user's daily quota can't cover it"""
+
+
+def api_key_user(headers: Mapping[str, str]) -> Optional[str]:
+    """Return the user of the configured API key sent as a Bearer token or X-API-Key"""
+    key = headers.get("X-API-Key", "")
+    scheme, _, token = headers.get("Authorization", "").partition(" ")
+    if not key and scheme.lower() == "bearer":
+        key = token.strip()
+    return API_KEYS.get(key) if key else None
+
+
+def forwarded_user(headers: Mapping[str, str]) -> Optional[str]:
+    """Return the user named by the trusted proxy's header, or by X-User-Id if trusted.
+
+    X-User-Id is set by the client itself, so it only counts with
+    TRUST_CLIENT_USER_ID; otherwise anyone could rename themselves to a
+    fresh quota.
+    """
+    if TRUSTED_USER_HEADER and headers.get(TRUSTED_USER_HEADER):
+        return headers[TRUSTED_USER_HEADER]
+    if TRUST_CLIENT_USER_ID and headers.get("X-User-Id"):
+        return headers["X-User-Id"]
+    return None
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def seconds_until_reset() -> int:
+    """Seconds until quotas reset at the next UTC midnight"""
+    return 86400 - int(time.time()) % 86400
+
+
+class TokenQuota:
+    """Daily per-user token quota in SQLite, shared by every process using the file.
+
+    A call reserves its estimated input plus max_tokens up front, records
+    what was actually billed once it returns and then releases its
+    reservation, so concurrent calls can't overspend the quota together.
+    """
+
+    def __init__(self, path: str = QUOTA_DB_PATH, daily_limit: int = DAILY_TOKEN_QUOTA):
+        self.path = path
+        self.daily_limit = daily_limit
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS token_usage (
+                user_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                used INTEGER NOT NULL DEFAULT 0,
+                reserved INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )""")
+
+    def reserve(
+        self, user_id: str, input_tokens: int, max_tokens: int, min_tokens: int
+    ) -> int:
+        """Reserve a call's tokens and return the max_tokens the quota allows.
+
+        max_tokens is cut down to what is left of the quota, but never below
+        min_tokens; if even that doesn't fit QuotaExceededError is raised.
+        """
+        day = _today()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM token_usage WHERE day < ?", (day,))
+                row = self._conn.execute(
+                    "SELECT used + reserved FROM token_usage "
+                    "WHERE user_id = ? AND day = ?",
+                    (user_id, day),
+                ).fetchone()
+                left = self.daily_limit - (row[0] if row else 0) - input_tokens
+                granted = min(max_tokens, left)
+                if granted < min_tokens:
+                    raise QuotaExceededError(
+                        f"Daily token quota of {self.daily_limit} reached, "
+                        "please try again tomorrow"
+                    )
+                self._conn.execute(
+                    "INSERT INTO token_usage (user_id, day, reserved) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, day) DO UPDATE "
+                    "SET reserved = reserved + excluded.reserved",
+                    (user_id, day, input_tokens + granted),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return granted
+
+    def record(self, user_id: str, tokens: int):
+        """Count tokens actually billed to the user today"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO token_usage (user_id, day, used) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, day) DO UPDATE SET used = used + excluded.used",
+                (user_id, _today(), tokens),
+            )
+
+    def release(self, user_id: str, tokens: int):
+        """Drop a reservation once its call has finished"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE token_usage SET reserved = MAX(0, reserved - ?) "
+                "WHERE user_id = ? AND day = ?",
+                (tokens, user_id, _today()),
+            )
+
+    def usage(self, user_id: str) -> Dict[str, int]:
+        """Return the tokens used and still reserved by the user today"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT used, reserved FROM token_usage WHERE user_id = ? AND day = ?",
+                (user_id, _today()),
+            ).fetchone()
+        used, reserved = row or (0, 0)
+        return {"used": used, "reserved": reserved, "limit": self.daily_limit}
+
+
+_quota: Optional[TokenQuota] = None
+_quota_lock = threading.Lock()
+
+
+def get_token_quota() -> TokenQuota:
+    """Return the process-wide token quota, opening it on first use"""
+    global _quota
+    if _quota is None:
+        with _quota_lock:
+            if _quota is None:
+                _quota = TokenQuota()
+    return _quota
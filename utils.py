@@ -1,8 +1,7 @@
 import streamlit as st
-from typing import Dict, Any
-import json
-from datetime import datetime, timedelta
-from config import CACHE_TTL
+from typing import Dict, Optional
+from models import GeneratedContent, GeneratedArticle
+from result_cache import get_result_cache, make_cache_key, make_article_cache_key
 
 def init_session_state():
     """Initialize session state variables"""
@@ -13,21 +12,26 @@ def init_session_state():
     if 'error' not in st.session_state:
         st.session_state.error = None
 
-def cache_result(key: str, content: Dict[str, Any]):
-    """Cache the generated content with timestamp"""
-    st.session_state[f"cache_{key}"] = {
-        "content": content,
-        "timestamp": datetime.now()
-    }
+def cache_result(key: str, content: GeneratedContent):
+    """Cache the generated content in the shared result cache"""
+    get_result_cache().set(key, content)
 
-def get_cached_result(key: str) -> Dict[str, Any]:
+def get_cached_result(key: str) -> Optional[GeneratedContent]:
     """Retrieve cached content if still valid"""
-    cache_key = f"cache_{key}"
-    if cache_key in st.session_state:
-        cached = st.session_state[cache_key]
-        if datetime.now() - cached["timestamp"] < timedelta(seconds=CACHE_TTL):
-            return cached["content"]
-    return None
+    return get_result_cache().get(key)
+
+def cache_article(key: str, article: str):
+    """Cache a separately generated sample article"""
+    get_result_cache().set(key, GeneratedArticle(article=article))
+
+def get_cached_article(key: str) -> Optional[str]:
+    """Retrieve a cached sample article if still valid"""
+    cached = get_result_cache().get(key, GeneratedArticle)
+    return cached.article if cached else None
+
+def get_cache_stats() -> Dict[str, int]:
+    """Return hit/miss/eviction counters of the shared result cache"""
+    return get_result_cache().stats()
 
 def display_error(error: str):
     """Display error message in Streamlit"""
@@ -35,4 +39,8 @@ def display_error(error: str):
 
 def create_cache_key(message: str, persona: str) -> str:
     """Create a unique cache key for the message-persona combination"""
-    return f"{message}_{persona}".replace(" ", "_")[:50]
\ No newline at end of file
+    return make_cache_key(message, persona)
+
+def create_article_cache_key(message: str, persona: str, analysis: GeneratedContent) -> str:
+    """Create the cache key for the sample article written from an analysis"""
+    return make_article_cache_key(message, persona, analysis)
\ No newline at end of file
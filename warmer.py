@@ -0,0 +1,231 @@
+"""Speculative cache warming for the messages the team keeps reusing.
+
+Every message entered in the app is counted. Once a message is popular, its
+analysis is generated in the background for every persona not cached yet,
+so whoever picks one of them next gets a cache hit instead of the full wait.
+Warming only uses spare capacity: its calls have the lowest scheduler
+priority, spend from their own token budget and are cancelled as soon as
+any other call has to wait for the scheduler, in this process or for the
+rate limits shared with others.
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from claude_service import ClaudeService
+from config import (
+    AVAILABLE_PERSONAS,
+    CACHE_DB_PATH,
+    CACHE_WARM_MAX_PENDING,
+    CACHE_WARM_MIN_USES,
+    CACHE_WARM_TOKENS_PER_MINUTE,
+    CACHE_WARM_WINDOW_DAYS,
+    CACHE_WARMING,
+)
+from generation import stream_cached
+from personas import get_persona_data
+from result_cache import get_result_cache, make_cache_key
+from scheduler import (
+    PRIORITY_SPECULATIVE,
+    CancelToken,
+    RequestCancelled,
+    TokenBucket,
+    get_scheduler,
+)
+from telemetry import CACHE_WARMS
+from token_budget import output_budget
+
+logger = logging.getLogger(__name__)
+
+
+def _message_hash(message: str) -> str:
+    return hashlib.sha256(message.encode("utf-8")).hexdigest()
+
+
+class MessagePopularity:
+    """How often each message was entered recently, in SQLite shared across processes"""
+
+    def __init__(
+        self, path: str = CACHE_DB_PATH, window_days: float = CACHE_WARM_WINDOW_DAYS
+    ):
+        self.path = path
+        self.window = window_days * 86400
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS message_uses (
+                message_hash TEXT PRIMARY KEY,
+                message TEXT NOT NULL,
+                uses INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+
+    def record(self, message: str) -> int:
+        """Count a use of message and return its uses within the window"""
+        now = time.time()
+        cutoff = now - self.window
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM message_uses WHERE last_used < ?", (cutoff,)
+            )
+            self._conn.execute(
+                "INSERT INTO message_uses (message_hash, message, uses, last_used) "
+                "VALUES (?, ?, 1, ?) ON CONFLICT (message_hash) DO UPDATE "
+                "SET uses = uses + 1, last_used = excluded.last_used",
+                (_message_hash(message), message, now),
+            )
+            (uses,) = self._conn.execute(
+                "SELECT uses FROM message_uses WHERE message_hash = ?",
+                (_message_hash(message),),
+            ).fetchone()
+        return uses
+
+    def top(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return the most used messages within the window with their use counts"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT message, uses FROM message_uses WHERE last_used >= ? "
+                "ORDER BY uses DESC, last_used DESC LIMIT ?",
+                (time.time() - self.window, limit),
+            ).fetchall()
+
+
+class CacheWarmer:
+    """Pre-generates the analysis of popular messages for every persona.
+
+    Messages are warmed one at a time on a single background thread, in the
+    order they became popular. A warm stops at the first persona that would
+    exceed the token budget, or as soon as other calls need the scheduler.
+    """
+
+    def __init__(
+        self,
+        service: Optional[ClaudeService] = None,
+        popularity: Optional[MessagePopularity] = None,
+        min_uses: int = CACHE_WARM_MIN_USES,
+        tokens_per_minute: float = CACHE_WARM_TOKENS_PER_MINUTE,
+        max_pending: int = CACHE_WARM_MAX_PENDING,
+    ):
+        # A service of its own, so its usage totals are exactly what warming spent
+        self.service = service or ClaudeService()
+        self.popularity = popularity
+        self.min_uses = min_uses
+        self.budget = TokenBucket(tokens_per_minute)
+        self._pending: "queue.Queue[str]" = queue.Queue(maxsize=max_pending)
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def message_entered(self, message: str) -> bool:
+        """Count a use of message and queue it for warming once it is popular.
+
+        Returns True if the message was queued. Never blocks the caller.
+        """
+        if not CACHE_WARMING:
+            return False
+        try:
+            uses = self._popularity().record(message)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record message use: {e}")
+            return False
+        if uses < self.min_uses:
+            return False
+
+        with self._lock:
+            if message in self._queued:
+                return False
+            try:
+                self._pending.put_nowait(message)
+            except queue.Full:
+                CACHE_WARMS.inc(outcome="dropped")
+                return False
+            self._queued.add(message)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="cache-warmer", daemon=True
+                )
+                self._thread.start()
+        logger.info(f"Queued popular message for warming ({uses} uses)")
+        return True
+
+    def _popularity(self) -> MessagePopularity:
+        if self.popularity is None:
+            self.popularity = MessagePopularity()
+        return self.popularity
+
+    def popular(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Return the most used recent messages with their use counts"""
+        return self._popularity().top(limit)
+
+    def _work(self):
+        while True:
+            message = self._pending.get()
+            try:
+                self.warm(message)
+            except Exception as e:
+                logger.error(f"Cache warming failed: {e}")
+            finally:
+                with self._lock:
+                    self._queued.discard(message)
+
+    def warm(self, message: str) -> int:
+        """Generate the analysis of message for every uncached persona; returns how many"""
+        cache = get_result_cache()
+        scheduler = get_scheduler()
+        warmed = 0
+        for persona_key in AVAILABLE_PERSONAS:
+            if cache.contains(make_cache_key(message, persona_key)):
+                continue
+            if scheduler.busy():
+                CACHE_WARMS.inc(outcome="busy")
+                break
+            needed = output_budget(get_persona_data(persona_key), "analysis")
+            if self.budget.wait_time(needed) > 0:
+                CACHE_WARMS.inc(outcome="over_budget")
+                break
+
+            spent_before = sum(self.service.usage_totals.values())
+            try:
+                # Streamed, so a preemption closes the response mid-flight
+                stream_cached(
+                    self.service,
+                    message,
+                    persona_key,
+                    on_section=lambda field, value: None,
+                    include_article=False,
+                    priority=PRIORITY_SPECULATIVE,
+                    cancel=CancelToken(),
+                )
+            except RequestCancelled:
+                CACHE_WARMS.inc(outcome="preempted")
+                logger.info("Cache warming preempted by interactive traffic")
+                break
+            except Exception as e:
+                CACHE_WARMS.inc(outcome="failed")
+                logger.warning(f"Could not warm {persona_key}: {e}")
+                break
+            finally:
+                self.budget.consume(
+                    sum(self.service.usage_totals.values()) - spent_before
+                )
+            CACHE_WARMS.inc(outcome="warmed")
+            warmed += 1
+        if warmed:
+            logger.info(f"Warmed the cache for {warmed} persona(s)")
+        return warmed
+
+
+# Shared by every session so warming runs once per process
+cache_warmer = CacheWarmer()
@@ -0,0 +1,277 @@
+"""Worker processes that run the app's generation jobs from the shared queue.
+
+Each process claims jobs from the queue in jobs.py and runs them on
+JOB_WORKERS threads, so generation scales across cores without competing
+with the Streamlit process for its interpreter. The processes share the
+upstream rate limits with the app and each other through RATE_LIMIT_DB_PATH,
+and a process that dies is started again. The app starts JOB_PROCESSES
+workers itself; to share one pool between several app replicas, set
+JOB_EXTERNAL_WORKERS and run:
+
+    python worker.py --processes 4
+"""
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from claude_service import ClaudeService
+from config import (
+    CLAUDE_MAX_IN_FLIGHT,
+    JOB_EXTERNAL_WORKERS,
+    JOB_PROCESSES,
+    JOB_WORKERS,
+    LOG_LEVEL,
+)
+from generation import (
+    generate_cached_for_personas,
+    refine_cached,
+    stream_cached,
+    write_article_cached,
+)
+from jobs import Job, JobConsumer, get_job_queue
+from models import GeneratedContent
+from scheduler import RequestScheduler, process_limits
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks that the pool's processes and parent are alive
+SUPERVISE_INTERVAL = 1.0
+
+
+def job_handlers(service: ClaudeService) -> Dict[str, Callable[[Job], Any]]:
+    """Return the handler of each job kind the app submits"""
+
+    def analysis(job: Job):
+        content = stream_cached(
+            service,
+            job.payload["message"],
+            job.payload["persona"],
+            on_section=lambda field, value: job.publish(**{field: value}),
+            include_article=False,
+            cancel=job.cancel_token,
+            user_id=job.user_id,
+        )
+        return content.model_dump(mode="json")
+
+    def article(job: Job):
+        return write_article_cached(
+            service,
+            job.payload["message"],
+            job.payload["persona"],
+            GeneratedContent.model_validate(job.payload["analysis"]),
+            on_text=lambda text: job.publish(article=text),
+            cancel=job.cancel_token,
+            user_id=job.user_id,
+        )
+
+    def personas(job: Job):
+        # Articles are generated lazily per persona from the results page
+        results = generate_cached_for_personas(
+            service,
+            job.payload["message"],
+            job.payload["personas"],
+            include_article=False,
+            cancel=job.cancel_token,
+            user_id=job.user_id,
+        )
+        return {
+            persona_key: (
+                {"error": str(result)}
+                if isinstance(result, Exception)
+                else {"content": result.model_dump(mode="json")}
+            )
+            for persona_key, result in results.items()
+        }
+
+    def refine(job: Job):
+        field = job.payload["field"]
+        content = refine_cached(
+            service,
+            job.payload["message"],
+            job.payload["persona"],
+            field,
+            job.payload["instruction"] or None,
+            GeneratedContent.model_validate(job.payload["content"]),
+            # Only the article is long enough to be worth streaming
+            on_text=(
+                (lambda text: job.publish(article=text)) if field == "article" else None
+            ),
+            cancel=job.cancel_token,
+            user_id=job.user_id,
+        )
+        return content.model_dump(mode="json")
+
+    return {
+        "analysis": analysis,
+        "article": article,
+        "personas": personas,
+        "refine": refine,
+    }
+
+
+def job_result(job: Job):
+    """Return a done job's result as the generation function returned it.
+
+    The "personas" result maps each persona key to its GeneratedContent or
+    exception.
+    """
+    if job.kind in ("analysis", "refine"):
+        return GeneratedContent.model_validate(job.result)
+    if job.kind == "personas":
+        return {
+            persona_key: (
+                GeneratedContent.model_validate(result["content"])
+                if "content" in result
+                else Exception(result["error"])
+            )
+            for persona_key, result in job.result.items()
+        }
+    return job.result
+
+
+class WorkerPool:
+    """Worker processes consuming the job queue, restarted if they exit"""
+
+    def __init__(self, processes: int, threads: int = JOB_WORKERS):
+        self.processes = max(1, processes)
+        self.threads = threads
+        self._procs: List[subprocess.Popen] = []
+        self._stopped = threading.Event()
+
+    def _spawn(self) -> subprocess.Popen:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--threads",
+                str(self.threads),
+                "--share",
+                str(self.processes),
+                "--parent-pid",
+                str(os.getpid()),
+            ]
+        )
+
+    def start(self):
+        self._procs = [self._spawn() for _ in range(self.processes)]
+        threading.Thread(target=self.supervise, name="job-pool", daemon=True).start()
+        logger.info(f"Started {self.processes} job worker processes")
+
+    def supervise(self):
+        """Restart workers that exit until the pool is stopped"""
+        while not self._stopped.wait(SUPERVISE_INTERVAL):
+            for i, proc in enumerate(self._procs):
+                if proc.poll() is not None:
+                    logger.warning(
+                        f"Job worker {proc.pid} exited with {proc.returncode}, "
+                        "restarting it"
+                    )
+                    self._procs[i] = self._spawn()
+
+    def stop(self):
+        self._stopped.set()
+        for proc in self._procs:
+            proc.terminate()
+        for proc in self._procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def run_worker(threads: int, share: int = 1, parent_pid: Optional[int] = None):
+    """Consume the queue in this process until terminated or orphaned.
+
+    share is the number of processes in the pool, whose calls in flight
+    this process gets an equal part of, and its rate limits too unless they
+    are shared.
+    """
+    scheduler = RequestScheduler(
+        max_in_flight=max(1, CLAUDE_MAX_IN_FLIGHT // share),
+        limits=process_limits(share),
+    )
+    consumer = JobConsumer(
+        get_job_queue(), job_handlers(ClaudeService(scheduler=scheduler)), threads
+    )
+    consumer.start()
+    try:
+        while parent_pid is None or os.getppid() == parent_pid:
+            time.sleep(SUPERVISE_INTERVAL)
+        logger.info("Parent process exited, stopping")
+    finally:
+        consumer.stop()
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_job_workers(service: ClaudeService):
+    """Start consuming the queue for the app, once per process.
+
+    Runs jobs on threads of this process, or in JOB_PROCESSES worker
+    processes; does nothing with JOB_EXTERNAL_WORKERS.
+    """
+    global _started
+    if _started or JOB_EXTERNAL_WORKERS:
+        return
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    if JOB_PROCESSES > 0:
+        WorkerPool(JOB_PROCESSES).start()
+    else:
+        JobConsumer(get_job_queue(), job_handlers(service)).start()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Run generation jobs from the shared job queue"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=max(1, JOB_PROCESSES),
+        help="Worker processes, which split the calls in flight",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=JOB_WORKERS,
+        help="Jobs each process runs at once",
+    )
+    # Set by WorkerPool on the processes it starts
+    parser.add_argument("--share", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--parent-pid", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    # Stop through the finally blocks, handing running jobs back to the queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if args.share is not None or args.processes == 1:
+            run_worker(args.threads, args.share or 1, args.parent_pid)
+            return 0
+        pool = WorkerPool(args.processes, args.threads)
+        pool.start()
+        try:
+            while True:
+                time.sleep(SUPERVISE_INTERVAL)
+        finally:
+            pool.stop()
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())